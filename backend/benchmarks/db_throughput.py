@@ -0,0 +1,114 @@
+"""
+Compares request throughput of GET /api/v1/repositories/ under concurrency for the
+ways the endpoints can reach the database:
+
+  inline      crud called directly on the event loop (the previous behaviour)
+  threadpool  DATABASE_MODE=sync, crud runs in the threadpool
+  async       DATABASE_MODE=async, crud runs on an AsyncSession (aiosqlite)
+
+Usage: python -m benchmarks.db_throughput --requests 2000 --concurrency 50
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+os.environ.setdefault("SECRET_KEY", "benchmark-secret-key")
+
+import httpx  # noqa: E402
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from src.api.v1.endpoints import repositories  # noqa: E402
+from src.core.security import TokenData, get_current_user  # noqa: E402
+from src.db import models  # noqa: E402
+from src.db.database import get_request_db  # noqa: E402
+from src.db.migrations import init_db  # noqa: E402
+from src.main import app  # noqa: E402
+
+
+def seed(db_path: str, count: int):
+    engine = create_engine(f"sqlite:///{db_path}")
+    init_db(engine)
+    db = sessionmaker(bind=engine)()
+    db.add_all(
+        models.Repository(url=f"https://github.com/bench/repo{i}", name=f"bench/repo{i}", owner_id=1)
+        for i in range(count)
+    )
+    db.commit()
+    db.close()
+    engine.dispose()
+
+
+async def run_inline(db, fn, *args, **kwargs):
+    return fn(db, *args, **kwargs)
+
+
+async def measure(requests: int, concurrency: int) -> float:
+    remaining = iter(range(requests))
+
+    async def worker(client):
+        for _ in remaining:
+            response = await client.get("/api/v1/repositories/")
+            response.raise_for_status()
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        return requests / (time.perf_counter() - started)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--repositories", type=int, default=50)
+    args = parser.parse_args()
+
+    fd, db_path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    seed(db_path, args.repositories)
+
+    # Every in-flight request holds a connection, so size the pools to the concurrency
+    pool = {"pool_size": args.concurrency, "max_overflow": 0}
+    sync_engine = create_engine(f"sqlite:///{db_path}", connect_args={"check_same_thread": False}, **pool)
+    sync_sessions = sessionmaker(bind=sync_engine, autoflush=False)
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}", **pool)
+    async_sessions = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+    def get_sync_db():
+        db = sync_sessions()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    async def get_async_db():
+        async with async_sessions() as db:
+            yield db
+
+    app.dependency_overrides[get_current_user] = lambda: TokenData(username="bench", id=1)
+    run_db = repositories.run_db
+    try:
+        for mode, get_db, runner in [
+            ("inline", get_sync_db, run_inline),
+            ("threadpool", get_sync_db, run_db),
+            ("async", get_async_db, run_db),
+        ]:
+            app.dependency_overrides[get_request_db] = get_db
+            repositories.run_db = runner
+            throughput = await measure(args.requests, args.concurrency)
+            print(f"{mode:>10}: {throughput:8.1f} req/s")
+    finally:
+        repositories.run_db = run_db
+        app.dependency_overrides.clear()
+        await async_engine.dispose()
+        sync_engine.dispose()
+        os.unlink(db_path)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
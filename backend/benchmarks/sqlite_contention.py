@@ -0,0 +1,114 @@
+"""
+Runs concurrent readers and writers against a SQLite database, the way the API reads
+repositories while Celery workers write their status, with and without the SQLite profile
+of src.db.database (WAL, synchronous=NORMAL, busy timeout, mmap and cache size).
+
+Usage: python -m benchmarks.sqlite_contention --readers 8 --writers 4 --seconds 5
+"""
+import argparse
+import contextlib
+import os
+import tempfile
+import threading
+import time
+
+os.environ.setdefault("SECRET_KEY", "benchmark-secret-key")
+
+from sqlalchemy import create_engine, select, update  # noqa: E402
+from sqlalchemy.exc import OperationalError  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from src.core.enums import AnalysisStatus  # noqa: E402
+from src.db import models  # noqa: E402
+from src.db.database import Base, create_db_engine  # noqa: E402
+
+STATUSES = [AnalysisStatus.PENDING, AnalysisStatus.IN_PROGRESS, AnalysisStatus.COMPLETED]
+
+
+def seed(engine, count: int):
+    Base.metadata.create_all(bind=engine)
+    with sessionmaker(bind=engine)() as db:
+        db.add_all(
+            models.Repository(url=f"https://github.com/bench/repo{i}", name=f"bench/repo{i}", owner_id=1)
+            for i in range(count)
+        )
+        db.commit()
+
+
+def run(engine, readers: int, writers: int, seconds: float, repositories: int) -> dict:
+    sessions = sessionmaker(bind=engine, autoflush=False)
+    deadline = time.monotonic() + seconds
+    counts = {"reads": 0, "writes": 0, "locked": 0}
+    lock = threading.Lock()
+
+    def count(name):
+        with lock:
+            counts[name] += 1
+
+    def reader():
+        while time.monotonic() < deadline:
+            try:
+                with sessions() as db:
+                    db.execute(select(models.Repository).where(models.Repository.owner_id == 1)).all()
+                count("reads")
+            except OperationalError:
+                count("locked")
+
+    def writer(offset):
+        i = offset
+        while time.monotonic() < deadline:
+            try:
+                with sessions() as db:
+                    db.execute(
+                        update(models.Repository)
+                        .where(models.Repository.id == i % repositories + 1)
+                        .values(status=STATUSES[i % len(STATUSES)])
+                    )
+                    db.commit()
+                count("writes")
+            except OperationalError:
+                count("locked")
+            i += 1
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)]
+    threads += [threading.Thread(target=writer, args=(n,)) for n in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--repositories", type=int, default=100)
+    args = parser.parse_args()
+
+    connect_args = {"check_same_thread": False}
+    profiles = {
+        "default": lambda url: create_engine(url, connect_args=connect_args),
+        "tuned": lambda url: create_db_engine(url, connect_args=connect_args),
+    }
+    for name, make_engine in profiles.items():
+        fd, db_path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        engine = make_engine(f"sqlite:///{db_path}")
+        try:
+            seed(engine, args.repositories)
+            counts = run(engine, args.readers, args.writers, args.seconds, args.repositories)
+        finally:
+            engine.dispose()
+            for suffix in ("", "-wal", "-shm"):
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(db_path + suffix)
+        print(
+            f"{name:>8}: {counts['reads'] / args.seconds:8.1f} reads/s "
+            f"{counts['writes'] / args.seconds:8.1f} writes/s {counts['locked']:5d} locked"
+        )
+
+
+if __name__ == "__main__":
+    main()
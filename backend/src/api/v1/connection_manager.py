@@ -1,41 +1,230 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
 
+import msgpack
 from fastapi import WebSocket, status
 
+from src.utils import metrics
+
+# Updates arriving within this window are sent together as a single frame
+STATUS_COALESCE_WINDOW_SECONDS = float(os.getenv("STATUS_COALESCE_WINDOW_SECONDS", "0.05"))
+
+# Proxies and NATs can leave half-open sockets behind that TCP takes hours to notice, so
+# the server pings every connection and evicts those that stay silent for too long
+WS_HEARTBEAT_INTERVAL_SECONDS = float(os.getenv("WS_HEARTBEAT_INTERVAL_SECONDS", "20"))
+WS_IDLE_TIMEOUT_SECONDS = float(os.getenv("WS_IDLE_TIMEOUT_SECONDS", "60"))
+HEARTBEAT_EVENT = {"type": "ping"}
+
+# Clients that offer this subprotocol receive binary msgpack frames instead of JSON text
+MSGPACK_SUBPROTOCOL = "msgpack"
+
+
+def negotiate_subprotocol(offered: list[str]) -> str | None:
+    """
+    Picks the frame encoding from the subprotocols the client offered, JSON being the default.
+    """
+    return MSGPACK_SUBPROTOCOL if MSGPACK_SUBPROTOCOL in offered else None
+
+
+class Connection:
+    """
+    A websocket with its own bounded outbox, drained by a dedicated writer task so a slow
+    client never delays messages to anyone else.
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        user_id: int,
+        max_pending_messages: int,
+        coalesce_window_seconds: float = STATUS_COALESCE_WINDOW_SECONDS,
+        subprotocol: str | None = None,
+    ):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.max_pending_messages = max_pending_messages
+        self.coalesce_window_seconds = coalesce_window_seconds
+        self.subprotocol = subprotocol
+        self.pending: OrderedDict[object, dict] = OrderedDict()
+        self.has_pending = asyncio.Event()
+        self.writer_task: asyncio.Task | None = None
+        self.last_seen = time.monotonic()
+
+    def touch(self):
+        """
+        Records that the client is alive; called for every message it sends.
+        """
+        self.last_seen = time.monotonic()
+
+    def enqueue(self, event: dict, key=None) -> bool:
+        """
+        Queues an event for the writer task. Returns False if the outbox is full.
+        Events sharing a key are coalesced, keeping only the newest one.
+        """
+        if key is not None and key in self.pending:
+            self.pending[key] = event
+            return True
+        if len(self.pending) >= self.max_pending_messages:
+            return False
+        self.pending[key if key is not None else object()] = event
+        self.has_pending.set()
+        return True
+
+    async def write_pending(self):
+        while True:
+            await self.has_pending.wait()
+            # Let a burst (e.g. a bulk import) accumulate so it goes out as one frame
+            await asyncio.sleep(self.coalesce_window_seconds)
+            self.has_pending.clear()
+            events = list(self.pending.values())
+            self.pending.clear()
+            await self.send_frame(events)
+
+    async def send_frame(self, events: list[dict]):
+        if self.subprotocol == MSGPACK_SUBPROTOCOL:
+            await self.websocket.send_bytes(msgpack.packb(events))
+        else:
+            await self.websocket.send_text(json.dumps(events))
+
 
 class ConnectionManager:
-    def __init__(self, max_total_connections: int = 1000, max_connections_per_user: int = 5):
-        self.active_connections: dict[str, WebSocket] = {}
-        self.user_connection_counts: dict[str, int] = {}
+    def __init__(
+        self,
+        max_total_connections: int = 1000,
+        max_connections_per_user: int = 5,
+        max_pending_messages: int = 100,
+        coalesce_window_seconds: float = STATUS_COALESCE_WINDOW_SECONDS,
+        heartbeat_interval_seconds: float = WS_HEARTBEAT_INTERVAL_SECONDS,
+        idle_timeout_seconds: float = WS_IDLE_TIMEOUT_SECONDS,
+    ):
+        # Every open socket of a user (one per browser tab) is kept in that user's set
+        self.active_connections: dict[int, set[Connection]] = {}
         self.max_total_connections = max_total_connections
         self.max_connections_per_user = max_connections_per_user
+        self.max_pending_messages = max_pending_messages
+        self.coalesce_window_seconds = coalesce_window_seconds
+        self.heartbeat_interval_seconds = heartbeat_interval_seconds
+        self.idle_timeout_seconds = idle_timeout_seconds
+        self._closing_tasks: set[asyncio.Task] = set()
+
+    @property
+    def connection_count(self) -> int:
+        return sum(len(connections) for connections in self.active_connections.values())
 
-    async def connect(self, websocket: WebSocket, user_id: str):
-        if len(self.active_connections) >= self.max_total_connections:
+    async def connect(self, websocket: WebSocket, user_id: int, subprotocol: str | None = None) -> Connection | None:
+        if self.connection_count >= self.max_total_connections:
             await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER, reason="Server is at maximum capacity.")
-            return False
+            return None
 
-        if self.user_connection_counts.get(user_id, 0) >= self.max_connections_per_user:
+        if len(self.active_connections.get(user_id, ())) >= self.max_connections_per_user:
             await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER, reason="Too many connections for this user.")
-            return False
+            return None
 
-        await websocket.accept()
-        self.active_connections[user_id] = websocket
-        self.user_connection_counts[user_id] = self.user_connection_counts.get(user_id, 0) + 1
-        return True
+        await websocket.accept(subprotocol=subprotocol)
+        connection = Connection(
+            websocket, user_id, self.max_pending_messages, self.coalesce_window_seconds, subprotocol
+        )
+        connection.writer_task = asyncio.create_task(self._run_writer(connection))
+        self.active_connections.setdefault(user_id, set()).add(connection)
+        metrics.increment("websocket_connections_opened")
+        return connection
+
+    def disconnect(self, connection: Connection):
+        self._remove(connection)
+        if connection.writer_task and connection.writer_task is not asyncio.current_task():
+            connection.writer_task.cancel()
+
+    def _remove(self, connection: Connection):
+        connections = self.active_connections.get(connection.user_id)
+        if connections is None:
+            return
+        connections.discard(connection)
+        if not connections:
+            del self.active_connections[connection.user_id]
+
+    async def _run_writer(self, connection: Connection):
+        try:
+            await connection.write_pending()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # The socket is gone; the endpoint's receive loop will notice it as well
+            logging.info(f"Stopped writing to a websocket of user {connection.user_id}: {e}")
+            metrics.increment("websocket_send_failures")
+            self._remove(connection)
+
+    async def send_to_user(self, user_id: int, event: dict, key=None):
+        """
+        Queues an event for every connection of a user without waiting for the sends.
+        Connections whose outbox is full are closed instead of buffering without limit.
+        """
+        slow_connections = [
+            connection
+            for connection in list(self.active_connections.get(user_id, ()))
+            if not connection.enqueue(event, key)
+        ]
+        await self._drop(slow_connections)
+
+    async def send_personal_message(self, event: dict, user_id: int):
+        await self.send_to_user(user_id, event)
+
+    async def broadcast(self, event: dict):
+        slow_connections = [
+            connection
+            for connections in list(self.active_connections.values())
+            for connection in list(connections)
+            if not connection.enqueue(event)
+        ]
+        await self._drop(slow_connections)
+
+    async def run_heartbeat(self):
+        """
+        Pings every connection and evicts idle ones, for the lifetime of the API process.
+        """
+        while True:
+            await asyncio.sleep(self.heartbeat_interval_seconds)
+            try:
+                await self.check_heartbeats()
+            except Exception as e:
+                logging.error(f"Error checking websocket heartbeats: {e}")
+
+    async def check_heartbeats(self):
+        now = time.monotonic()
+        idle_connections = []
+        slow_connections = []
+        for connections in list(self.active_connections.values()):
+            for connection in list(connections):
+                if now - connection.last_seen > self.idle_timeout_seconds:
+                    idle_connections.append(connection)
+                elif not connection.enqueue(HEARTBEAT_EVENT, key="heartbeat"):
+                    slow_connections.append(connection)
+        for connection in idle_connections:
+            logging.info(f"Evicting idle websocket of user {connection.user_id}.")
+            metrics.increment("websocket_idle_evictions")
+            self._evict(connection, status.WS_1001_GOING_AWAY, "Heartbeat timeout.")
+        await self._drop(slow_connections)
 
-    def disconnect(self, user_id: str):
-        if user_id in self.active_connections:
-            del self.active_connections[user_id]
-            self.user_connection_counts[user_id] = self.user_connection_counts.get(user_id, 1) - 1
-            if self.user_connection_counts[user_id] <= 0:
-                del self.user_connection_counts[user_id]
+    async def _drop(self, connections: list[Connection]):
+        for connection in connections:
+            logging.warning(f"Dropping slow websocket of user {connection.user_id}.")
+            metrics.increment("websocket_slow_consumer_drops")
+            self._evict(connection, status.WS_1013_TRY_AGAIN_LATER, "Client is too slow.")
 
-    async def send_personal_message(self, message: str, user_id: str):
-        if user_id in self.active_connections:
-            await self.active_connections[user_id].send_text(message)
+    def _evict(self, connection: Connection, code: int, reason: str):
+        self.disconnect(connection)
+        # Closing sends a frame too, so it must not hold up delivery to other users
+        close_task = asyncio.create_task(self._close(connection, code, reason))
+        self._closing_tasks.add(close_task)
+        close_task.add_done_callback(self._closing_tasks.discard)
 
-    async def broadcast(self, message: str):
-        for connection in self.active_connections.values():
-            await connection.send_text(message)
+    async def _close(self, connection: Connection, code: int, reason: str):
+        try:
+            await connection.websocket.close(code=code, reason=reason)
+        except Exception as e:
+            logging.info(f"Could not close websocket of user {connection.user_id}: {e}")
 
 manager = ConnectionManager()
@@ -4,27 +4,43 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 
+from src.core.exceptions import PasswordHashingBusyError
 from src.core.security import (
     ACCESS_TOKEN_EXPIRE_MINUTES,
     create_access_token,
-    verify_password,
+    verify_and_update_password,
 )
 from src.db import crud
-from src.db.database import get_db
+from src.db.async_crud import run_db
+from src.db.database import get_request_db
 
 router = APIRouter()
 
 @router.post("/token")
 async def login_for_access_token(
-    form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)
+    form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_request_db)
 ):
-    user = crud.get_user_by_username(db, username=form_data.username)
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Incorrect username or password",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    user = await run_db(db, crud.get_user_by_username, username=form_data.username)
+    if not user:
+        raise credentials_exception
+    try:
+        verified, new_hash = await verify_and_update_password(form_data.password, user.hashed_password)
+    except PasswordHashingBusyError as err:
         raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Incorrect username or password",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many logins in progress, please try again shortly",
+            headers={"Retry-After": "1"},
+        ) from err
+    if not verified:
+        raise credentials_exception
+    if new_hash is not None:
+        # The stored hash was made with another bcrypt cost
+        await run_db(db, crud.update_user_password_hash, user=user, hashed_password=new_hash)
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
         data={"username": user.username, "id": user.id}, expires_delta=access_token_expires
@@ -1,25 +1,44 @@
+import asyncio
+import contextlib
 import time
 from collections import defaultdict
 
 from fastapi import (
     APIRouter,
     Depends,
+    Header,
     HTTPException,
+    Query,
     Response,
     WebSocket,
     WebSocketException,
     status,
 )
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 
 from src.api.v1 import schemas
-from src.api.v1.connection_manager import manager
-from src.core.security import TokenData, get_current_user, get_current_websocket_user
-from src.db import crud
-from src.db.database import get_db
-from src.services import repository_service  # Import the new service
-from src.celery_app import celery_app # Import celery_app
-from src.services.analysis_service import clone_and_analyze_repository # Import the Celery task
+from src.api.v1.connection_manager import manager, negotiate_subprotocol
+from src.api.v1.status_events import status_waiters, stream_status_events
+from src.core.enums import AnalysisStatus
+from src.core.security import (
+    TokenData,
+    get_current_stream_user,
+    get_current_user,
+    get_current_websocket_user,
+)
+from src.db.async_crud import release_connection, run_db
+from src.db.database import get_request_db
+from src.services.repository_service import repository_service
+from src.services.progress import get_progress_snapshot
+from src.utils.pagination import (
+    DEFAULT_PAGE_SIZE,
+    MAX_PAGE_SIZE,
+    InvalidCursorError,
+    decode_cursor,
+    next_cursor,
+)
 
 router = APIRouter()
 
@@ -28,6 +47,11 @@ WS_CONNECT_RATE_LIMIT_SECONDS = 60
 WS_CONNECT_RATE_LIMIT_COUNT = 5
 user_connection_attempts = defaultdict(lambda: {"count": 0, "last_attempt": 0})
 
+# Upper bound for ?wait= on the analysis endpoint, below common proxy read timeouts
+MAX_ANALYSIS_WAIT_SECONDS = 60
+# Relevance order has no stable key to seek on, so search pages by offset, capped instead
+MAX_SEARCH_OFFSET = 1000
+
 async def rate_limit_websocket_connect(current_user: TokenData = Depends(get_current_websocket_user)):
     username = current_user.id
     now = time.time()
@@ -44,47 +68,130 @@ async def rate_limit_websocket_connect(current_user: TokenData = Depends(get_cur
             )
     return current_user
 
+def validate_cursor(cursor: str | None = None) -> str | None:
+    if cursor is not None:
+        try:
+            decode_cursor(cursor)
+        except InvalidCursorError:
+            raise HTTPException(status_code=400, detail="Invalid cursor") from None
+    return cursor
+
 @router.post("/", response_model=schemas.Repository)
 async def create_repository_analysis_request(
-    repo: "schemas.RepositoryCreate", db: Session = Depends(get_db), response: Response = None, current_user: TokenData = Depends(get_current_user)
+    repo: "schemas.RepositoryCreate", db: Session = Depends(get_request_db), response: Response = None, current_user: TokenData = Depends(get_current_user)
 ):
     """
     Accepts a repository URL for analysis.
-    Creates a record in the database and triggers an asynchronous analysis task.
+    Creates a record in the database and triggers the asynchronous analysis task.
     """
-    db_repo = repository_service.get_repository_by_url(db, str(repo.url))
+    db_repo = await run_db(db, repository_service.get_repository_by_url, str(repo.url))
     if db_repo:
         # If repository already exists, return it with 200 OK
         response.status_code = status.HTTP_200_OK
         return db_repo
 
     # Create a new repository record in the database
-    db_repo = repository_service.create_repository(db=db, repo=repo, owner_id=current_user.id)
+    db_repo = await run_db(db, repository_service.create_repository, repo=repo, owner_id=current_user.id)
+    # Dispatching makes blocking Redis and broker calls, which run_db may run on the event loop
+    await run_in_threadpool(repository_service.dispatch_analysis, db_repo.id)
     response.status_code = status.HTTP_201_CREATED # Explicitly set 201 for new creation
-    
-    # Trigger Celery task for analysis
-    clone_and_analyze_repository.delay(db_repo.id)
-
     return db_repo
 
 
-@router.get("/", response_model=list[schemas.Repository])
+@router.get("/", response_model=list[schemas.RepositoryListItem])
 async def read_repositories(
-    skip: int = 0, limit: int = 100, db: Session = Depends(get_db), current_user: TokenData = Depends(get_current_user)
+    response: Response,
+    cursor: str | None = Depends(validate_cursor),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    technology: list[str] = Query([]),
+    language: str | None = None,
+    min_language_share: float = Query(0, ge=0, le=1),
+    db: Session = Depends(get_request_db),
+    current_user: TokenData = Depends(get_current_user),
 ):
     """
-    Retrieve a list of all repositories for the current user.
+    Retrieve a page of the current user's repositories, newest first.
+    Filters apply to each repository's latest analysis: every given technology must have been
+    found, and the language must make up at least min_language_share of the code.
+    The X-Next-Cursor header, when present, is the cursor of the next page.
     """
-    repositories = repository_service.get_repositories_by_owner(db, owner_id=current_user.id, skip=skip, limit=limit)
+    repositories = await run_db(
+        db,
+        repository_service.get_repositories_by_owner,
+        owner_id=current_user.id,
+        cursor=cursor,
+        limit=limit,
+        technologies=technology,
+        language=language,
+        min_language_share=min_language_share,
+    )
+    page_cursor = next_cursor(repositories, limit)
+    if page_cursor is not None:
+        response.headers["X-Next-Cursor"] = page_cursor
     return repositories
 
 
-@router.get("/{repository_id}")
-async def read_repository(repository_id: int, db: Session = Depends(get_db), current_user: TokenData = Depends(get_current_user)):
+@router.get("/facets", response_model=schemas.RepositoryFacets)
+async def read_repository_facets(db: Session = Depends(get_request_db), current_user: TokenData = Depends(get_current_user)):
+    """
+    Count the current user's repositories per technology and language, for building filters.
+    """
+    facets = await run_db(db, repository_service.get_stack_facets, owner_id=current_user.id)
+    return schemas.RepositoryFacets(
+        **{name: [schemas.Facet(name=term, count=count) for term, count in rows] for name, rows in facets.items()}
+    )
+
+
+@router.get("/stats", response_model=schemas.UserStats)
+async def read_repository_stats(
+    db: Session = Depends(get_request_db),
+    current_user: TokenData = Depends(get_current_user),
+):
+    """
+    Dashboard totals over all of the current user's analyses: counts by status, commits,
+    files, lines, language bytes and technology usage.
+    """
+    return await run_db(db, repository_service.get_user_stats, user_id=current_user.id)
+
+
+@router.get("/search", response_model=schemas.SearchResults)
+async def search_repositories(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=MAX_SEARCH_OFFSET),
+    db: Session = Depends(get_request_db),
+    current_user: TokenData = Depends(get_current_user),
+):
+    """
+    Full-text search over the current user's repository names, analysis summaries and
+    narratives, best match first.
+    """
+    hits = await run_db(db, repository_service.search_analyses, owner_id=current_user.id, query=q, limit=limit, offset=offset)
+    next_offset = offset + limit if len(hits) == limit and offset + limit <= MAX_SEARCH_OFFSET else None
+    return schemas.SearchResults(hits=hits, next_offset=next_offset)
+
+
+@router.get("/events")
+async def stream_repository_events(
+    last_event_id: str | None = Header(None), current_user: TokenData = Depends(get_current_stream_user)
+):
+    """
+    Streams status events for the current user's repositories as Server-Sent Events.
+    Reconnecting clients resume after the Last-Event-ID header they send.
+    """
+    return StreamingResponse(
+        stream_status_events(current_user.id, last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/{repository_id}", response_model=schemas.Repository)
+async def read_repository(repository_id: int, db: Session = Depends(get_request_db), current_user: TokenData = Depends(get_current_user)):
     """
     Retrieve a single repository by its ID.
     """
-    db_repo = repository_service.get_repository(db, repository_id=repository_id)
+    db_repo = await run_db(db, repository_service.get_repository, repository_id=repository_id)
     if db_repo is None:
         raise HTTPException(status_code=404, detail="Repository not found")
     # Basic authorization: ensure the repository belongs to the current user
@@ -94,42 +201,70 @@ async def read_repository(repository_id: int, db: Session = Depends(get_db), cur
 
 
 @router.get("/{repository_id}/analysis", response_model=schemas.AnalysisResultsList)
-async def read_repository_analysis(repository_id: int, db: Session = Depends(get_db), current_user: TokenData = Depends(get_current_user)):
+async def read_repository_analysis(
+    repository_id: int,
+    wait: float = Query(0, ge=0, le=MAX_ANALYSIS_WAIT_SECONDS),
+    cursor: str | None = Depends(validate_cursor),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: Session = Depends(get_request_db),
+    current_user: TokenData = Depends(get_current_user),
+):
     """
-    Retrieve analysis results for a specific repository.
+    Retrieve a page of a repository's analysis results, newest first.
+    With wait, a pending analysis holds the request for up to that many seconds until
+    the repository's status changes, instead of the client polling.
+    """
+    with status_waiters.watch(repository_id) as status_changed:
+        db_repo = await run_db(db, repository_service.get_repository, repository_id=repository_id, with_analyses=False)
+        if db_repo is None:
+            raise HTTPException(status_code=404, detail="Repository not found")
+        # Basic authorization: ensure the repository belongs to the current user
+        if db_repo.owner_id!= current_user.id:
+            raise HTTPException(status_code=403, detail="Not authorized to access this repository's analysis")
+        if wait and db_repo.status in (AnalysisStatus.PENDING, AnalysisStatus.IN_PROGRESS):
+            # Don't hold a pooled connection while waiting; the results below are read in a
+            # new transaction, which also sees the rows the worker committed meanwhile
+            await release_connection(db)
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(status_changed.wait(), timeout=wait)
+    analysis_results = await run_db(
+        db, repository_service.get_analysis_results_for_repository, repository_id=repository_id, cursor=cursor, limit=limit
+    )
+    return schemas.AnalysisResultsList(analysis_results=analysis_results, next_cursor=next_cursor(analysis_results, limit))
+
+@router.get("/{repository_id}/progress", response_model=schemas.AnalysisProgress)
+async def read_repository_progress(repository_id: int, db: Session = Depends(get_request_db), current_user: TokenData = Depends(get_current_user)):
     """
-    db_repo = repository_service.get_repository(db, repository_id=repository_id)
+    Retrieve the latest progress of each stage of the repository's current analysis.
+    """
+    db_repo = await run_db(db, repository_service.get_repository, repository_id=repository_id, with_analyses=False)
     if db_repo is None:
         raise HTTPException(status_code=404, detail="Repository not found")
     # Basic authorization: ensure the repository belongs to the current user
-    if db_repo.owner_id!= current_user.id:
-        raise HTTPException(status_code=403, detail="Not authorized to access this repository's analysis")
-    analysis_results = repository_service.get_analysis_results_for_repository(db, repository_id=repository_id)
-    return schemas.AnalysisResultsList(analysis_results=analysis_results)
+    if db_repo.owner_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Not authorized to access this repository's progress")
+    # The Redis client is synchronous, so it is kept off the event loop like the database calls
+    return schemas.AnalysisProgress(stages=await run_in_threadpool(get_progress_snapshot, repository_id))
 
 @router.get("/analysis/{analysis_id}/narrative", response_model=str)
-async def get_analysis_narrative(analysis_id: int, db: Session = Depends(get_db), current_user: TokenData = Depends(get_current_user)):
+async def get_analysis_narrative(analysis_id: int, db: Session = Depends(get_request_db), current_user: TokenData = Depends(get_current_user)):
     """
     Retrieve the generated narrative for a specific analysis result.
     """
-    # First, get the analysis result to check its repository ID for authorization
-    analysis_result_obj = crud.get_analysis_result(db, analysis_id=analysis_id)
-    if analysis_result_obj is None:
+    # Authorization only needs the owner's ID, not the analysis or its repository
+    owner_id = await run_db(db, repository_service.get_analysis_owner_id, analysis_id=analysis_id)
+    if owner_id is None:
         raise HTTPException(status_code=404, detail="Analysis result not found")
 
     # Basic authorization: ensure the analysis result's repository belongs to the current user
-    db_repo = repository_service.get_repository(db, repository_id=analysis_result_obj.repository_id)
-    if db_repo is None or db_repo.owner_id != current_user.id:
+    if owner_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not authorized to access this analysis narrative")
 
-    narrative = analysis_result_obj.narrative
+    narrative = await run_db(db, repository_service.get_analysis_narrative, analysis_id=analysis_id)
     if narrative is None:
         raise HTTPException(status_code=404, detail="Narrative not available for this analysis result")
     return narrative
 
-from starlette.websockets import WebSocketDisconnect
-
-# ... (other imports)
 
 # ... (router and rate limit code)
 
@@ -139,14 +274,19 @@ async def websocket_endpoint(
     current_user: TokenData = Depends(rate_limit_websocket_connect)
 ):
     username = current_user.id
-    await manager.connect(websocket, username)
-    await websocket.accept()
+    subprotocol = negotiate_subprotocol(websocket.scope.get("subprotocols", []))
+    connection = await manager.connect(websocket, username, subprotocol)
+    if connection is None:
+        return
     try:
         while True:
-            # Keep the connection alive, or handle incoming messages if needed
-            # For status updates, typically the server sends messages, not the client
-            await websocket.receive_text() # Expecting client to send something to keep alive or for specific requests
-    except WebSocketDisconnect as e:
-        print(f"WebSocket disconnected for {username}: {e.code}")
+            # Status updates only flow from the server; any frame the client sends, such as
+            # the reply to a heartbeat ping, shows that it is still alive. msgpack clients
+            # reply in binary frames, so text and bytes both count.
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                print(f"WebSocket disconnected for {username}: {message.get('code')}")
+                break
+            connection.touch()
     finally:
-        manager.disconnect(username)
\ No newline at end of file
+        manager.disconnect(connection)
\ No newline at end of file
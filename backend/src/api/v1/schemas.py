@@ -59,8 +59,80 @@ class Repository(BaseModel):
 
     model_config = ConfigDict(from_attributes=True)
 
+class AnalysisSummary(BaseModel):
+    id: int
+    status: AnalysisStatus
+    summary: str | None = None
+    created_at: datetime
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class RepositoryListItem(BaseModel):
+    """
+    A repository as shown in list views: its latest analysis only, without narrative or JSON data.
+    """
+    id: int
+    name: str
+    url: HttpUrl
+    owner_id: int
+    status: AnalysisStatus
+    created_at: datetime
+    updated_at: datetime | None = None
+    latest_analysis: AnalysisSummary | None = None
+
+    model_config = ConfigDict(from_attributes=True)
+
+class Facet(BaseModel):
+    name: str
+    count: int
+
+
+class RepositoryFacets(BaseModel):
+    """
+    How many of the user's repositories use each technology and language, most common first.
+    """
+    technologies: list[Facet]
+    languages: list[Facet]
+
+class UserStats(BaseModel):
+    analysis_count: int
+    status_counts: dict[str, int]
+    total_commits: int
+    total_files: int
+    total_lines: int
+    language_bytes: dict[str, int]
+    technology_counts: dict[str, int] # Number of analyses using each technology
+
+
+class SearchHit(BaseModel):
+    analysis_id: int
+    repository_id: int
+    repository_name: str
+    summary: str | None = None
+    created_at: datetime
+    rank: float
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class SearchResults(BaseModel):
+    hits: list[SearchHit]
+    next_offset: int | None = None # Pass back as offset for the next page
+
 class AnalysisResultsList(BaseModel):
     analysis_results: list[AnalysisResult]
+    next_cursor: str | None = None # Pass back as cursor for the next (older) page
+
+class StageProgress(BaseModel):
+    stage: str
+    done: int
+    total: int | None = None
+    elapsed_seconds: float
+    eta_seconds: float | None = None
+
+class AnalysisProgress(BaseModel):
+    stages: dict[str, StageProgress]
 
 # Manually rebuild the models to resolve forward references
 # This is often needed in complex applications with circular dependencies
@@ -0,0 +1,175 @@
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import re
+
+import redis
+import redis.asyncio as aioredis
+
+from src.utils.redis_utils import REDIS_URL, get_redis_client
+
+# Celery workers hold no websockets, so they publish status events here and every API
+# process relays them to the sockets connected to it
+STATUS_CHANNEL = "repository-status"
+RELAY_RECONNECT_MAX_DELAY_SECONDS = 30
+
+# Each user's recent events are also kept in a bounded stream, so SSE clients can
+# replay what they missed while reconnecting
+STATUS_STREAM_MAXLEN = int(os.getenv("STATUS_STREAM_MAXLEN", "1000"))
+STATUS_STREAM_TTL_SECONDS = int(os.getenv("STATUS_STREAM_TTL_SECONDS", "86400"))
+SSE_KEEPALIVE_SECONDS = 15
+SSE_READ_COUNT = 100
+_STREAM_ID_PATTERN = re.compile(r"^\d+-\d+$")
+
+
+class StatusWaiters:
+    """
+    Lets requests in this process wait for the next status event of a repository.
+    """
+
+    def __init__(self):
+        self._waiters: dict[int, set[asyncio.Event]] = {}
+
+    @contextlib.contextmanager
+    def watch(self, repo_id: int):
+        """
+        Registers a waiter for the duration of the block. Register before reading the
+        current status, so a change that lands in between is not missed.
+        """
+        waiter = asyncio.Event()
+        self._waiters.setdefault(repo_id, set()).add(waiter)
+        try:
+            yield waiter
+        finally:
+            waiters = self._waiters.get(repo_id)
+            if waiters is not None:
+                waiters.discard(waiter)
+                if not waiters:
+                    del self._waiters[repo_id]
+
+    def notify(self, repo_id: int):
+        for waiter in self._waiters.get(repo_id, ()):
+            waiter.set()
+
+
+status_waiters = StatusWaiters()
+
+
+def status_stream_key(user_id: int) -> str:
+    return f"status-events:{user_id}"
+
+
+def publish_status_event(event: dict):
+    """
+    Publishes a status event to all API processes and appends it to the owner's stream.
+    """
+    try:
+        pipeline = get_redis_client().pipeline()
+        owner_id = event.get("owner_id")
+        if owner_id is not None:
+            key = status_stream_key(owner_id)
+            data = json.dumps({name: value for name, value in event.items() if name != "owner_id"})
+            pipeline.xadd(key, {"data": data}, maxlen=STATUS_STREAM_MAXLEN, approximate=True)
+            pipeline.expire(key, STATUS_STREAM_TTL_SECONDS)
+        pipeline.publish(STATUS_CHANNEL, json.dumps(event))
+        pipeline.execute()
+    except redis.RedisError as e:
+        # Clients still see the final state on their next fetch
+        logging.error(f"Could not publish status event {event}: {e}")
+
+
+async def relay_status_events(connection_manager):
+    """
+    Subscribes to status events and forwards them to this process's websocket connections.
+    Runs for the lifetime of the API process, reconnecting with backoff when Redis is unavailable.
+    """
+    delay = 1
+    while True:
+        client = aioredis.Redis.from_url(REDIS_URL)
+        try:
+            async with client.pubsub() as pubsub:
+                await pubsub.subscribe(STATUS_CHANNEL)
+                delay = 1
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    await _relay_message(connection_manager, message["data"])
+        except (redis.RedisError, OSError) as e:
+            logging.warning(f"Status event relay disconnected: {e}. Retrying in {delay}s.")
+        finally:
+            await client.aclose()
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, RELAY_RECONNECT_MAX_DELAY_SECONDS)
+
+
+async def _relay_message(connection_manager, data: bytes):
+    try:
+        event = json.loads(data)
+        if event.get("type", "status") == "status":
+            status_waiters.notify(event.get("id"))
+        # Only the repository owner's connections receive its status
+        owner_id = event.pop("owner_id", None)
+        if owner_id is None:
+            logging.warning(f"Dropping status event without owner: {event}")
+            return
+        # Pending updates of the same kind for the same repository (and stage) are coalesced
+        key = (event.get("type", "status"), event.get("id"), event.get("stage"))
+        await connection_manager.send_to_user(owner_id, event, key=key)
+    except Exception as e:
+        # A failing socket must not stop the relay for everyone else
+        logging.error(f"Error relaying status event: {e}")
+
+
+async def stream_status_events(user_id: int, last_event_id: str | None = None):
+    """
+    Yields the user's status events as Server-Sent Events, using stream entry IDs as event IDs.
+    With last_event_id, the events after it that are still in the stream are replayed first;
+    a "reset" event tells the client that older history is gone and it should reload.
+    """
+    key = status_stream_key(user_id)
+    client = aioredis.Redis.from_url(REDIS_URL)
+    try:
+        if last_event_id and _STREAM_ID_PATTERN.match(last_event_id):
+            if await _history_truncated(client, key, last_event_id):
+                yield _format_sse("reset", "{}")
+            cursor = last_event_id
+        else:
+            # Start from the newest entry rather than "$", so nothing published between
+            # two reads is skipped
+            newest = await client.xrevrange(key, count=1)
+            cursor = newest[0][0] if newest else "0-0"
+
+        while True:
+            response = await client.xread({key: cursor}, count=SSE_READ_COUNT, block=SSE_KEEPALIVE_SECONDS * 1000)
+            if not response:
+                # Keeps proxies from closing an idle stream
+                yield ": keepalive\n\n"
+                continue
+            for _stream, entries in response:
+                for entry_id, fields in entries:
+                    cursor = entry_id
+                    data = fields[b"data"].decode()
+                    yield _format_sse(json.loads(data).get("type", "status"), data, entry_id.decode())
+    finally:
+        await client.aclose()
+
+
+async def _history_truncated(client, key: str, last_event_id: str) -> bool:
+    oldest = await client.xrange(key, count=1)
+    if not oldest:
+        return True
+    return _parse_stream_id(oldest[0][0].decode()) > _parse_stream_id(last_event_id)
+
+
+def _parse_stream_id(stream_id: str) -> tuple[int, int]:
+    milliseconds, sequence = stream_id.split("-")
+    return int(milliseconds), int(sequence)
+
+
+def _format_sse(event: str, data: str, event_id: str | None = None) -> str:
+    lines = [f"event: {event}", f"data: {data}"]
+    if event_id is not None:
+        lines.insert(0, f"id: {event_id}")
+    return "\n".join(lines) + "\n\n"
@@ -1,6 +1,32 @@
+import logging
 import os
+from contextlib import ExitStack
 
 from celery import Celery
+from celery.signals import task_postrun, task_prerun, worker_process_init, worker_process_shutdown
+from kombu import Queue
+
+from src.db.instrumentation import track_queries
+from src.utils import metrics
+from src.utils.async_utils import start_worker_loop, stop_worker_loop
+
+# Short, I/O-bound GitHub work and slow, quota-bound LLM calls get separate queues so
+# each can be served by its own worker pool, e.g.:
+#   celery -A src.celery_app worker -Q analysis.fetch -c 16
+#   celery -A src.celery_app worker -Q analysis.llm -c 2 --prefetch-multiplier 1
+# The periodic tasks of beat_schedule run only while a single beat process is up:
+#   celery -A src.celery_app beat
+FETCH_QUEUE = 'analysis.fetch'
+LLM_QUEUE = 'analysis.llm'
+
+# How often celery beat repairs drift in the per-user dashboard counters
+USER_STATS_RECONCILE_SECONDS = int(os.environ.get('USER_STATS_RECONCILE_SECONDS', '3600'))
+# How often celery beat deletes blobs that no analysis refers to anymore
+BLOB_SWEEP_SECONDS = int(os.environ.get('BLOB_SWEEP_SECONDS', '86400'))
+
+# Redis emulates priorities with one list per step; 0 is served first
+PRIORITY_STEPS = list(range(10))
+
 
 def get_celery_app():
     # Celery configuration using environment variables
@@ -18,10 +44,81 @@ def get_celery_app():
         task_track_started=True,
         task_serializer='json',
         result_serializer='json',
+        result_compression='zlib', # Fetch subtask results (file trees, commit histories) feed the chord callback
         accept_content=['json'],
         timezone='UTC',
         enable_utc=True,
+        task_queues=(Queue(FETCH_QUEUE), Queue(LLM_QUEUE)),
+        task_default_queue=FETCH_QUEUE,
+        task_routes={
+            'src.services.analysis_service.generate_narratives_task': {'queue': LLM_QUEUE},
+            'src.services.analysis_service.*': {'queue': FETCH_QUEUE},
+        },
+        broker_transport_options={
+            'priority_steps': PRIORITY_STEPS,
+            'sep': ':',
+            'queue_order_strategy': 'priority',
+        },
+        beat_schedule={
+            'reconcile-user-stats': {
+                'task': 'src.services.analysis_service.reconcile_user_stats',
+                'schedule': USER_STATS_RECONCILE_SECONDS,
+            },
+            'delete-orphaned-blobs': {
+                'task': 'src.services.analysis_service.delete_orphaned_blobs',
+                'schedule': BLOB_SWEEP_SECONDS,
+            },
+        },
+        **_get_worker_settings(),
     )
     return app
 
+
+def _get_worker_settings():
+    # Pool size and prefetch are read per worker process, so the fetch and LLM
+    # pools can be tuned independently through their own environment
+    settings = {}
+    concurrency = os.environ.get('CELERY_WORKER_CONCURRENCY')
+    if concurrency:
+        settings['worker_concurrency'] = int(concurrency)
+    prefetch_multiplier = os.environ.get('CELERY_WORKER_PREFETCH_MULTIPLIER')
+    if prefetch_multiplier:
+        settings['worker_prefetch_multiplier'] = int(prefetch_multiplier)
+    return settings
+
+
 celery_app = get_celery_app()
+
+
+@worker_process_init.connect
+def init_worker_event_loop(**_kwargs):
+    # One persistent event loop per worker process, shared by every task it runs
+    start_worker_loop()
+
+
+@worker_process_shutdown.connect
+def shutdown_worker_event_loop(**_kwargs):
+    stop_worker_loop()
+
+
+# SQL statements of the running tasks, by task ID
+_task_queries: dict = {}
+
+
+@task_prerun.connect
+def start_task_query_tracking(task_id=None, **_kwargs):
+    stack = ExitStack()
+    _task_queries[task_id] = (stack, stack.enter_context(track_queries()))
+
+
+@task_postrun.connect
+def finish_task_query_tracking(task_id=None, task=None, **_kwargs):
+    tracking = _task_queries.pop(task_id, None)
+    if tracking is None:
+        return
+    stack, queries = tracking
+    stack.close()
+    queries.log_summary(f"Task {task.name}")
+    metrics.increment("db_queries", queries.count)
+    if queries.count:
+        logging.info(f"Task {task.name} ran {queries.count} SQL statements in {queries.total_seconds * 1000:.1f} ms.")
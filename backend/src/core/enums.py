@@ -6,3 +6,9 @@ class AnalysisStatus(str, enum.Enum):
     IN_PROGRESS = "IN_PROGRESS"
     COMPLETED = "COMPLETED"
     FAILED = "FAILED"
+
+
+class TaskPriority(enum.IntEnum):
+    """Celery message priorities; with the Redis broker lower values are served first."""
+    INTERACTIVE = 0
+    BACKGROUND = 6
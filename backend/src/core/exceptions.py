@@ -18,3 +18,7 @@ class GitHubRateLimitError(GitHubAPIError):
 class GitHubResourceNotFoundError(GitHubAPIError):
     """Exception raised when a GitHub resource is not found (e.g., repository)."""
     pass
+
+class PasswordHashingBusyError(Exception):
+    """Exception raised when too many password hashing jobs are already waiting."""
+    pass
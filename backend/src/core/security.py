@@ -1,16 +1,26 @@
+import asyncio
+import hashlib
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import UTC, datetime, timedelta
 
+import bcrypt
 from dotenv import load_dotenv
 from fastapi import Depends, HTTPException, WebSocket, WebSocketException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from pydantic import BaseModel
+from sqlalchemy import event, inspect
 from sqlalchemy.orm import Session
 
+from src.core.exceptions import PasswordHashingBusyError
 from src.db import crud, models
-from src.db.database import get_db
+from src.db.async_crud import release_connection, run_db
+from src.db.database import get_request_db
+from src.utils import metrics
+from src.utils.ttl_cache import TTLCache
 
 load_dotenv()
 
@@ -26,22 +36,96 @@ if not SECRET_KEY:
         raise ValueError("SECRET_KEY environment variable not set.")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30  # Adjust as needed
+# Verified tokens are remembered until they expire, and usernames are mapped to user IDs,
+# so authenticating a request normally needs neither a signature check nor a query.
+# The user cache is invalidated when this process commits a change to a user; the TTL
+# bounds how long changes committed by other processes can go unnoticed.
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL_SECONDS = int(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt cost factor of new hashes; stored hashes made with another cost are replaced on login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# bcrypt uses only the first 72 bytes of a password, and the bcrypt package rejects longer ones
+BCRYPT_MAX_PASSWORD_BYTES = 72
+# bcrypt releases the GIL, so a few threads keep it off the event loop. Logins beyond
+# PASSWORD_HASH_MAX_PENDING queued or running jobs are turned away instead of piling up.
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "32"))
+
+_password_pool = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+_password_slots = threading.BoundedSemaphore(PASSWORD_HASH_MAX_PENDING)
+
+token_cache = TTLCache(maxsize=TOKEN_CACHE_SIZE, ttl=ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL_SECONDS)
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
 
 class TokenData(BaseModel):
     username: str | None = None
     id: int | None = None
 
 
+def _password_bytes(password: str) -> bytes:
+    return password.encode("utf-8")[:BCRYPT_MAX_PASSWORD_BYTES]
+
+
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    try:
+        return bcrypt.checkpw(_password_bytes(plain_password), hashed_password.encode("utf-8"))
+    except ValueError: # Not a bcrypt hash
+        return False
 
 
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    return bcrypt.hashpw(_password_bytes(password), bcrypt.gensalt(BCRYPT_ROUNDS)).decode("utf-8")
+
+
+def password_needs_rehash(hashed_password: str) -> bool:
+    """
+    Whether a bcrypt hash ($2b$<cost>$<salt and checksum>) was made with another cost than BCRYPT_ROUNDS.
+    """
+    return hashed_password.split("$")[2:3] != [f"{BCRYPT_ROUNDS:02d}"]
+
+
+async def run_password_job(function, *args):
+    """
+    Runs a bcrypt job in the password hashing pool and records how long it waited and ran.
+    Raises PasswordHashingBusyError if PASSWORD_HASH_MAX_PENDING jobs are already pending.
+    """
+    if not _password_slots.acquire(blocking=False):
+        metrics.increment("password_hash_rejected")
+        raise PasswordHashingBusyError("Too many password hashing jobs pending")
+    queued_at = time.perf_counter()
+
+    def job():
+        started_at = time.perf_counter()
+        metrics.increment("password_hash_wait_ms", round((started_at - queued_at) * 1000))
+        try:
+            return function(*args)
+        finally:
+            metrics.increment("password_hash_run_ms", round((time.perf_counter() - started_at) * 1000))
+
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_password_pool, job)
+    finally:
+        _password_slots.release()
+        metrics.increment("password_hash_jobs")
+
+
+def _verify_and_update_password(plain_password, hashed_password):
+    if not verify_password(plain_password, hashed_password):
+        return False, None
+    return True, get_password_hash(plain_password) if password_needs_rehash(hashed_password) else None
+
+
+async def verify_and_update_password(plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+    """
+    Checks a password in the hashing pool. Returns whether it matched and, if the stored hash
+    was made with another cost, a new hash to store in its place.
+    """
+    return await run_password_job(_verify_and_update_password, plain_password, hashed_password)
 
 
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
@@ -54,29 +138,100 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+
+def get_token_username(token: str) -> str | None:
+    """
+    Returns the subject of a valid token, checking each distinct token's signature only
+    once until it expires. Raises JWTError for invalid or expired tokens.
+    """
+    # Tokens are credentials, so only their hashes are kept
+    key = hashlib.sha256(token.encode()).hexdigest()
+    username = token_cache.get(key)
+    if username is not None:
+        metrics.increment("auth_token_cache_hits")
+        return username
+    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    username = payload.get("sub")
+    if username is not None:
+        token_cache.set(key, username, expires_at=payload.get("exp"))
+    return username
+
+
+async def authenticate_token(token: str, db: Session) -> TokenData | None:
+    """
+    Returns the user a token belongs to, or None if the token has no subject or the user
+    no longer exists. Raises JWTError for invalid or expired tokens.
+    """
+    username = get_token_username(token)
+    if username is None:
+        return None
+    user_id = user_cache.get(username)
+    if user_id is not None:
+        metrics.increment("auth_user_cache_hits")
+        return TokenData(username=username, id=user_id)
+    user = await run_db(db, crud.get_user_by_username, username=username)
+    if user is None:
+        return None
+    user_cache.set(username, user.id)
+    return TokenData(username=username, id=user.id)
+
+
+def clear_auth_caches():
+    token_cache.clear()
+    user_cache.clear()
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_changed_users(session, _flush_context):
+    usernames = set()
+    for instance in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(instance, models.User):
+            # A renamed user is also dropped under its old name
+            usernames.update(inspect(instance).attrs.username.history.deleted)
+            usernames.add(instance.username)
+    if usernames:
+        session.info.setdefault("changed_usernames", set()).update(usernames)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_changed_users(session):
+    for username in session.info.pop("changed_usernames", ()):
+        user_cache.pop(username)
+
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_request_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-        user = crud.get_user_by_username(db, username=username)
-        if user is None:
-            raise credentials_exception
-        token_data = TokenData(username=username, id=user.id)
+        token_data = await authenticate_token(token, db)
     except JWTError as err:
         raise credentials_exception from err
+    if token_data is None:
+        raise credentials_exception
     return token_data
 
+async def get_current_stream_user(
+    header_token: str | None = Depends(optional_oauth2_scheme),
+    token: str | None = None,
+    db: Session = Depends(get_request_db),
+):
+    """
+    Like get_current_user, but also accepts the token as a query parameter, since the
+    browser's EventSource cannot send an Authorization header. The stream can stay open for
+    hours, so the session's connection is released once the user is authenticated.
+    """
+    try:
+        return await get_current_user(header_token or token or "", db)
+    finally:
+        await release_connection(db)
+
 async def get_current_websocket_user(
     _websocket: WebSocket,
     token: str = Depends(lambda ws: ws.query_params.get("token")), # Extract token from query parameter
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_request_db)
 ):
     if not token:
         raise WebSocketException(
@@ -88,14 +243,9 @@ async def get_current_websocket_user(
         reason="Could not validate credentials"
     )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-        user = crud.get_user_by_username(db, username=username)
-        if user is None:
-            raise credentials_exception
-        token_data = TokenData(username=username, id=user.id)
+        token_data = await authenticate_token(token, db)
     except JWTError as err:
         raise credentials_exception from err
+    if token_data is None:
+        raise credentials_exception
     return token_data
@@ -0,0 +1,27 @@
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+
+async def run_db(db: Session | AsyncSession, fn, *args, **kwargs):
+    """
+    Runs a function taking a sync Session as its first argument without blocking the event loop.
+    With an AsyncSession it runs on the async driver through run_sync, otherwise in the threadpool.
+    run_sync calls fn on the event loop's thread, so fn must not do any other blocking I/O.
+    """
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(fn, *args, **kwargs)
+    return await run_in_threadpool(fn, db, *args, **kwargs)
+
+
+async def release_connection(db: Session | AsyncSession):
+    """
+    Ends the session's transaction so its connection goes back to the pool before a request
+    waits or streams for a long time. The session stays usable and checks a connection out
+    again on its next query.
+    """
+    if isinstance(db, AsyncSession):
+        await db.rollback()
+    else:
+        await run_in_threadpool(db.rollback)
+
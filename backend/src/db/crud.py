@@ -1,10 +1,36 @@
+from datetime import datetime
 
-
-from sqlalchemy.orm import Session, selectinload
+from sqlalchemy import delete, exists, func, select, update
+from sqlalchemy.orm import Session, joinedload, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.util import identity_key
 
 from src.api.v1 import schemas
 from src.core.enums import AnalysisStatus
-from src.db import models
+from src.db import models, search, stats
+from src.db.database import in_unit_of_work
+from src.utils.compression import compress_json, decompress_json, unpack_blob
+from src.utils.pagination import DEFAULT_PAGE_SIZE, keyset_page
+
+# Detail views read every bulky field, so they load the blobs up front rather than one lazy load per field
+ANALYSIS_BLOB_OPTIONS = [selectinload(relationship) for relationship in models.BLOB_RELATIONSHIPS]
+REPOSITORY_ANALYSES_OPTIONS = [
+    selectinload(models.Repository.analysis_results).selectinload(relationship) for relationship in models.BLOB_RELATIONSHIPS
+]
+
+
+def _save(db: Session, *instances, refresh: bool = True):
+    """
+    Commits a mutator's changes, or only flushes them inside a unit_of_work block, and
+    reloads instances from the database if refresh.
+    """
+    if in_unit_of_work(db):
+        db.flush()
+    else:
+        db.commit()
+    if refresh:
+        for instance in instances:
+            db.refresh(instance)
 
 
 def get_user_by_username(db: Session, username: str):
@@ -14,14 +40,23 @@ def get_user_by_username(db: Session, username: str):
     return db.query(models.User).filter(models.User.username == username).first()
 
 
+def update_user_password_hash(db: Session, user: models.User, hashed_password: str):
+    """
+    Replaces a user's stored password hash, e.g. when it was made with another bcrypt cost.
+    """
+    user.hashed_password = hashed_password
+    _save(db, user, refresh=False)
+    return user
+
+
 def get_repository_by_url(db: Session, url: str):
     """
     Retrieves a repository from the database by its URL.
     """
-    return db.query(models.Repository).options(selectinload(models.Repository.analysis_results)).filter(models.Repository.url == str(url)).first()
+    return db.query(models.Repository).options(*REPOSITORY_ANALYSES_OPTIONS).filter(models.Repository.url == str(url)).first()
 
 
-def create_repository(db: Session, url: str, name: str, owner_id: int):
+def create_repository(db: Session, url: str, name: str, owner_id: int, refresh: bool = True):
     """
     Creates a new repository record in the database.
     """
@@ -31,84 +66,245 @@ def create_repository(db: Session, url: str, name: str, owner_id: int):
         owner_id=owner_id,
         status=AnalysisStatus.PENDING
     )
+    # A new repository has no analyses, so the collection doesn't need to be loaded
+    set_committed_value(db_repo, "analysis_results", [])
     db.add(db_repo)
-    db.commit()
-    db.refresh(db_repo)
+    _save(db, db_repo, refresh=refresh)
     return db_repo
 
 
-def get_repositories(db: Session, skip: int = 0, limit: int = 100):
+def get_repositories(db: Session, cursor: str | None = None, limit: int = DEFAULT_PAGE_SIZE):
     """
-    Retrieves a list of repositories from the database.
+    Retrieves a page of repositories from the database, newest first.
     """
-    return db.query(models.Repository).options(selectinload(models.Repository.analysis_results)).offset(skip).limit(limit).all()
+    query = db.query(models.Repository).options(*REPOSITORY_ANALYSES_OPTIONS)
+    return keyset_page(query, models.Repository, cursor, limit)
 
 
-def get_repositories_by_owner(db: Session, owner_id: int, skip: int = 0, limit: int = 100):
+def get_repositories_by_owner(
+    db: Session,
+    owner_id: int,
+    *,
+    cursor: str | None = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    technologies: list[str] | None = None,
+    language: str | None = None,
+    min_language_share: float = 0,
+):
     """
-    Retrieves a list of repositories for a specific owner.
+    Retrieves a page of repositories for a specific owner, newest first, for list views.
+    Only the latest analysis is loaded, without its narrative and JSON columns, so the cost
+    of a page does not grow with the analysis history.
+    Optionally keeps only repositories whose latest analysis found all the given technologies,
+    and/or at least min_language_share of its code in the given language.
     """
-    return db.query(models.Repository).filter(models.Repository.owner_id == owner_id).options(selectinload(models.Repository.analysis_results)).offset(skip).limit(limit).all()
+    query = db.query(models.Repository).filter(models.Repository.owner_id == owner_id)
+    for technology in technologies or []:
+        query = query.filter(
+            exists().where(
+                models.AnalysisTechnology.analysis_id == models.Repository.latest_analysis_id,
+                models.AnalysisTechnology.technology_id == _term_id(models.Technology, technology),
+            )
+        )
+    if language is not None:
+        query = query.filter(
+            exists().where(
+                models.AnalysisLanguage.analysis_id == models.Repository.latest_analysis_id,
+                models.AnalysisLanguage.language_id == _term_id(models.Language, language),
+                models.AnalysisLanguage.share >= min_language_share,
+            )
+        )
+    query = query.options(
+        joinedload(models.Repository.latest_analysis).load_only(
+            models.AnalysisResult.id,
+            models.AnalysisResult.status,
+            models.AnalysisResult.summary,
+            models.AnalysisResult.created_at,
+        )
+    )
+    return keyset_page(query, models.Repository, cursor, limit)
+
 
+def _term_id(model, name: str):
+    return select(model.id).where(model.key == name.lower()).scalar_subquery()
 
-def get_repository(db: Session, repository_id: int):
+
+def get_stack_facets(db: Session, owner_id: int, limit: int = 50) -> dict[str, list[tuple[str, int]]]:
     """
-    Retrieves a single repository from the database by its ID.
+    Counts the owner's repositories per technology and per language of their latest analysis,
+    most common first.
     """
-    return db.query(models.Repository).options(selectinload(models.Repository.analysis_results)).filter(models.Repository.id == repository_id).first()
+    facets = {}
+    for name, link, term, term_id in (
+        ("technologies", models.AnalysisTechnology, models.Technology, models.AnalysisTechnology.technology_id),
+        ("languages", models.AnalysisLanguage, models.Language, models.AnalysisLanguage.language_id),
+    ):
+        count = func.count().label("count")
+        facets[name] = (
+            db.query(term.name, count)
+            .select_from(models.Repository)
+            .join(link, link.analysis_id == models.Repository.latest_analysis_id)
+            .join(term, term.id == term_id)
+            .filter(models.Repository.owner_id == owner_id)
+            .group_by(term.id, term.name)
+            .order_by(count.desc(), term.name)
+            .limit(limit)
+            .all()
+        )
+    return facets
 
 
-def get_analysis_results_for_repository(db: Session, repository_id: int):
+def get_user_stats(db: Session, user_id: int):
     """
-    Retrieves all analysis results for a given repository ID.
+    Returns the user's dashboard totals from the incrementally maintained counters.
     """
-    return db.query(models.AnalysisResult).filter(
-        models.AnalysisResult.repository_id == repository_id
-    ).all()
+    return stats.get_user_stats(db, user_id)
 
 
+def search_analyses(db: Session, owner_id: int, query: str, limit: int = DEFAULT_PAGE_SIZE, offset: int = 0):
+    """
+    Full-text searches the owner's repository names, analysis summaries and narratives,
+    best match first.
+    """
+    return search.search_analyses(db, owner_id, query, limit=limit, offset=offset)
+
 
-def create_analysis_result(db: Session, analysis: schemas.AnalysisResultCreate):
+def get_repository(db: Session, repository_id: int, with_analyses: bool = True):
     """
-    Creates a new analysis result record in the database from a schema object.
+    Retrieves a single repository from the database by its ID. Without with_analyses, its
+    analysis history is left unloaded, for callers that only check the owner or status.
     """
+    query = db.query(models.Repository).filter(models.Repository.id == repository_id)
+    if with_analyses:
+        query = query.options(*REPOSITORY_ANALYSES_OPTIONS)
+    return query.first()
+
+
+def get_analysis_results_for_repository(db: Session, repository_id: int, cursor: str | None = None, limit: int = DEFAULT_PAGE_SIZE):
+    """
+    Retrieves a page of analysis results for a given repository ID, newest first.
+    """
+    query = db.query(models.AnalysisResult).filter(models.AnalysisResult.repository_id == repository_id).options(*ANALYSIS_BLOB_OPTIONS)
+    return keyset_page(query, models.AnalysisResult, cursor, limit)
+
+
+
+def _new_analysis_result(analysis: schemas.AnalysisResultCreate) -> models.AnalysisResult:
     db_analysis_result = models.AnalysisResult(**analysis.model_dump())
     db_analysis_result.status = analysis.status # Explicitly set the status
     db_analysis_result.total_lines = analysis.total_lines # Explicitly set total_lines
     db_analysis_result.report_url = analysis.report_url # Explicitly set report_url
+    return db_analysis_result
+
+
+def create_analysis_result(db: Session, analysis: schemas.AnalysisResultCreate, refresh: bool = True):
+    """
+    Creates a new analysis result record in the database from a schema object.
+    """
+    db_analysis_result = _new_analysis_result(analysis)
     db.add(db_analysis_result)
-    db.commit()
-    db.refresh(db_analysis_result)
+    db.flush()
+    _set_latest_analyses(db, [db_analysis_result])
+    _save(db, db_analysis_result, refresh=refresh)
     return db_analysis_result
 
+
+def create_analysis_results(db: Session, analyses: list[schemas.AnalysisResultCreate]) -> list[models.AnalysisResult]:
+    """
+    Creates several analysis results with batched INSERTs, pointing each repository at the
+    last of its new analyses with one executemany UPDATE. The results are not refreshed.
+    """
+    db_analysis_results = [_new_analysis_result(analysis) for analysis in analyses]
+    db.add_all(db_analysis_results)
+    db.flush()
+    _set_latest_analyses(db, db_analysis_results)
+    _save(db, refresh=False)
+    return db_analysis_results
+
+
+def _set_latest_analyses(db: Session, analyses: list[models.AnalysisResult]):
+    """
+    Points the repositories of flushed analyses at the last of them, with one UPDATE per
+    batch rather than loading the repositories. Ones already loaded are updated in place.
+    """
+    latest = {analysis.repository_id: analysis for analysis in analyses}
+    if not latest:
+        return
+    db.execute(
+        update(models.Repository),
+        [{"id": repository_id, "latest_analysis_id": analysis.id} for repository_id, analysis in latest.items()],
+    )
+    for repository_id, analysis in latest.items():
+        repository = db.identity_map.get(identity_key(models.Repository, repository_id))
+        if repository is not None:
+            set_committed_value(repository, "latest_analysis_id", analysis.id)
+            set_committed_value(repository, "latest_analysis", analysis)
+
 def get_analysis_result(db: Session, analysis_id: int):
     """
     Retrieves a single analysis result from the database by its ID.
     """
-    return db.query(models.AnalysisResult).filter(models.AnalysisResult.id == analysis_id).first()
+    return db.query(models.AnalysisResult).options(*ANALYSIS_BLOB_OPTIONS).filter(models.AnalysisResult.id == analysis_id).first()
+
+
+def get_analysis_owner_id(db: Session, analysis_id: int) -> int | None:
+    """
+    Returns the ID of the user owning an analysis result's repository, or None if the analysis
+    doesn't exist, without loading either.
+    """
+    return db.execute(
+        select(models.Repository.owner_id)
+        .join(models.AnalysisResult, models.AnalysisResult.repository_id == models.Repository.id)
+        .where(models.AnalysisResult.id == analysis_id)
+    ).scalar_one_or_none()
 
 
-def update_repository_status(db: Session, repository_id: int, new_status: AnalysisStatus):
+def get_analysis_narrative(db: Session, analysis_id: int):
+    """
+    Returns only the narrative of an analysis result, reading its blob directly.
+    """
+    data = db.execute(
+        select(models.Blob.data)
+        .join(models.AnalysisResult, models.AnalysisResult.narrative_hash == models.Blob.hash)
+        .where(models.AnalysisResult.id == analysis_id)
+    ).scalar_one_or_none()
+    return unpack_blob(data) if data is not None else None
+
+
+def update_repository_status(db: Session, repository_id: int, new_status: AnalysisStatus, refresh: bool = True):
     """
     Updates the status of a repository.
     """
     db_repo = db.query(models.Repository).filter(models.Repository.id == repository_id).first()
     if db_repo:
         db_repo.status = new_status
-        db.commit()
-        db.refresh(db_repo)
+        _save(db, db_repo, refresh=refresh)
     return db_repo
 
 
-def update_analysis_result_summary(db: Session, analysis_id: int, new_summary: str):
+def update_repository_statuses(db: Session, repository_ids: list[int], new_status: AnalysisStatus) -> int:
+    """
+    Sets the status of several repositories with a single UPDATE and returns how many matched.
+    """
+    if not repository_ids:
+        return 0
+    count = (
+        db.query(models.Repository)
+        .filter(models.Repository.id.in_(repository_ids))
+        .update({models.Repository.status: new_status, models.Repository.updated_at: func.now()})
+    )
+    _save(db, refresh=False)
+    return count
+
+
+def update_analysis_result_summary(db: Session, analysis_id: int, new_summary: str, refresh: bool = True):
     """
     Updates the summary of an analysis result.
     """
     db_analysis_result = db.query(models.AnalysisResult).filter(models.AnalysisResult.id == analysis_id).first()
     if db_analysis_result:
         db_analysis_result.summary = new_summary
-        db.commit()
-        db.refresh(db_analysis_result)
+        _save(db, db_analysis_result, refresh=refresh)
     return db_analysis_result
 
 
@@ -119,7 +315,7 @@ def delete_repository(db: Session, repository_id: int):
     db_repo = db.query(models.Repository).filter(models.Repository.id == repository_id).first()
     if db_repo:
         db.delete(db_repo)
-        db.commit()
+        _save(db, refresh=False)
     return db_repo
 
 
@@ -129,6 +325,71 @@ def delete_analysis_result(db: Session, analysis_id: int):
     """
     db_analysis_result = db.query(models.AnalysisResult).filter(models.AnalysisResult.id == analysis_id).first()
     if db_analysis_result:
+        db_repo = db_analysis_result.repository
         db.delete(db_analysis_result)
-        db.commit()
+        if db_repo is not None and db_repo.latest_analysis_id == analysis_id:
+            # Point the repository at the analysis before the deleted one
+            db.flush()
+            previous = keyset_page(
+                db.query(models.AnalysisResult).filter(models.AnalysisResult.repository_id == db_repo.id),
+                models.AnalysisResult,
+                None,
+                1,
+            )
+            db_repo.latest_analysis = previous[0] if previous else None
+        _save(db, refresh=False)
     return db_analysis_result
+
+
+def save_analysis_payload(db: Session, analysis_id: int, payload: dict):
+    """
+    Stores the full analysis dict, compressed, under the analysis result's ID.
+    The caller commits, so the payload is written together with its analysis result.
+    """
+    db_payload = db.query(models.AnalysisPayload).filter(models.AnalysisPayload.analysis_id == analysis_id).first()
+    if db_payload is None:
+        db_payload = models.AnalysisPayload(analysis_id=analysis_id)
+        db.add(db_payload)
+    db_payload.data = compress_json(payload)
+    return db_payload
+
+
+def get_analysis_payload(db: Session, analysis_id: int):
+    """
+    Loads and decompresses the analysis dict stored for an analysis result.
+    Returns None if no payload was stored.
+    """
+    db_payload = db.query(models.AnalysisPayload).filter(models.AnalysisPayload.analysis_id == analysis_id).first()
+    if db_payload is None:
+        return None
+    return decompress_json(db_payload.data)
+
+
+def delete_analysis_payload(db: Session, analysis_id: int):
+    """
+    Deletes the stored analysis dict once no task needs it anymore.
+    """
+    db.query(models.AnalysisPayload).filter(models.AnalysisPayload.analysis_id == analysis_id).delete()
+    _save(db, refresh=False)
+
+
+def delete_orphaned_blobs(db: Session, created_before: datetime, batch_size: int = 1000) -> int:
+    """
+    Deletes blobs no analysis result refers to anymore, e.g. the old narrative of a regenerated
+    analysis or the fields of a deleted one, one short transaction per batch, and returns how
+    many were deleted. Only blobs created before created_before are considered, so the ones an
+    uncommitted analysis has just written are kept.
+    """
+    unreferenced = [~exists().where(column == models.Blob.hash) for column in models.BLOB_REFERENCES]
+    orphaned = select(models.Blob.hash).where(models.Blob.created_at < created_before, *unreferenced).limit(batch_size)
+    deleted = 0
+    while True:
+        hashes = db.execute(orphaned).scalars().all()
+        if not hashes:
+            return deleted
+        # The references are checked again in case an analysis reused one of the blobs meanwhile
+        result = db.execute(delete(models.Blob).where(models.Blob.hash.in_(hashes), *unreferenced))
+        db.commit()
+        deleted += result.rowcount
+        if len(hashes) < batch_size:
+            return deleted
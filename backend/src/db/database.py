@@ -1,6 +1,11 @@
 import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import declarative_base, sessionmaker
 
 # Create data directory if it doesn't exist
@@ -19,10 +24,74 @@ else:
     SQLALCHEMY_DATABASE_URL = "sqlite:///./data/sql_app.db"  # Use SQLite for simplicity for now
     connect_args = {"check_same_thread": False}
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args=connect_args
-)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Connection pool of each engine; SQLite file databases are pooled the same way as Postgres
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT_SECONDS = int(os.getenv("DB_POOL_TIMEOUT_SECONDS", "30"))
+DB_POOL_RECYCLE_SECONDS = int(os.getenv("DB_POOL_RECYCLE_SECONDS", "1800"))
+
+# WAL lets the API read while Celery workers write; writers wait for the lock instead
+# of failing with "database is locked"
+SQLITE_PRAGMAS = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    # Negative values are in KiB rather than pages
+    "cache_size": -int(os.getenv("SQLITE_CACHE_SIZE_KB", str(64 * 1024))),
+}
+
+
+def _is_sqlite_memory(url) -> bool:
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+
+def pool_options(url: str) -> dict:
+    """
+    Returns the pool keyword arguments of create_engine for a database URL.
+    """
+    if _is_sqlite_memory(make_url(url)):
+        # In-memory databases live in a single connection and are not pooled
+        return {}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT_SECONDS,
+        "pool_recycle": DB_POOL_RECYCLE_SECONDS,
+        "pool_pre_ping": True,
+    }
+
+
+def _set_sqlite_pragmas(dbapi_connection, _connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+
+def configure_sqlite(engine_to_configure):
+    """
+    Applies SQLITE_PRAGMAS to every new connection of a SQLite engine.
+    """
+    if engine_to_configure.dialect.name == "sqlite":
+        event.listen(engine_to_configure, "connect", _set_sqlite_pragmas)
+    return engine_to_configure
+
+
+def create_db_engine(url: str, **kwargs):
+    return configure_sqlite(create_engine(url, **pool_options(url), **kwargs))
+
+
+engine = create_db_engine(SQLALCHEMY_DATABASE_URL, connect_args=connect_args)
+# Like the async sessions, objects stay loaded after a commit instead of being SELECTed
+# again on the next attribute access; values generated by the database come back via RETURNING
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+
+# "async" serves API requests through an AsyncSession (aiosqlite/asyncpg); Celery tasks always use SessionLocal
+DATABASE_MODE = os.getenv("DATABASE_MODE", "sync")
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
 
 Base = declarative_base()
 
@@ -30,12 +99,51 @@ Base = declarative_base()
 def get_engine():
     return engine
 
-def init_db(engine_to_use=None):
-    global engine, SessionLocal
-    if engine_to_use:
-        engine = engine_to_use
-    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-    Base.metadata.create_all(bind=engine)
+
+def to_async_url(url: str) -> str:
+    """
+    Swaps the driver of a database URL for its asyncio counterpart.
+    """
+    parsed = make_url(url)
+    return parsed.set(drivername=ASYNC_DRIVERS[parsed.get_backend_name()]).render_as_string(hide_password=False)
+
+
+@lru_cache(maxsize=1)
+def get_async_sessionmaker():
+    # Created on first use, so sync deployments don't need the async drivers installed
+    async_engine = create_async_engine(to_async_url(SQLALCHEMY_DATABASE_URL), **pool_options(SQLALCHEMY_DATABASE_URL))
+    configure_sqlite(async_engine.sync_engine)
+    # Objects are serialized after the session work is done, where lazy loads cannot run
+    return async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+
+# Sessions inside a unit_of_work block, per thread or task
+_units_of_work: ContextVar[tuple] = ContextVar("units_of_work", default=())
+
+
+def in_unit_of_work(db) -> bool:
+    return any(session is db for session in _units_of_work.get())
+
+
+@contextmanager
+def unit_of_work(db):
+    """
+    Runs a block of writes as one transaction: crud mutators called inside only flush, and
+    the block commits once at the end, or rolls back if it raises. Nested blocks join the
+    outermost one.
+    """
+    if in_unit_of_work(db):
+        yield db
+        return
+    token = _units_of_work.set((*_units_of_work.get(), db))
+    try:
+        yield db
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+    finally:
+        _units_of_work.reset(token)
 
 
 # Dependency to get a database session
@@ -45,3 +153,12 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    async with get_async_sessionmaker()() as db:
+        yield db
+
+
+# Session dependency of the API endpoints, selected per deployment
+get_request_db = get_async_db if DATABASE_MODE == "async" else get_db
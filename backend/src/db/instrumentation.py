@@ -0,0 +1,107 @@
+import logging
+import os
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Adds the query count and time of each request as response headers; for development only
+SQL_DEBUG = os.getenv("SQL_DEBUG", "false").lower() == "true"
+SQL_SLOWEST_STATEMENTS = int(os.getenv("SQL_SLOWEST_STATEMENTS", "3"))
+# The same statement this many times in one request or task is reported as a likely N+1
+SQL_REPEATED_STATEMENT_THRESHOLD = int(os.getenv("SQL_REPEATED_STATEMENT_THRESHOLD", "5"))
+QUERY_STATS_HEADERS = ["X-DB-Query-Count", "X-DB-Query-Time-Ms", "X-DB-Slowest-Query-Ms"]
+
+# Recorders of the current request or task, and of whole engines (any thread)
+_context_stats: ContextVar[tuple] = ContextVar("query_stats", default=())
+_engine_stats: dict[Engine, list] = {}
+
+
+class QueryStats:
+    """
+    The SQL statements run during one request, task or test block: how many, for how long,
+    the slowest ones, and how often each statement text was repeated.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total_seconds = 0.0
+        self.slowest: list[tuple[float, str]] = []
+        self.statements: Counter = Counter()
+
+    def record(self, statement: str, seconds: float):
+        self.count += 1
+        self.total_seconds += seconds
+        self.statements[statement] += 1
+        if len(self.slowest) < SQL_SLOWEST_STATEMENTS or seconds > self.slowest[-1][0]:
+            self.slowest = sorted([*self.slowest, (seconds, statement)], key=lambda item: item[0], reverse=True)
+            del self.slowest[SQL_SLOWEST_STATEMENTS:]
+
+    def repeated(self, threshold: int | None = None) -> list[tuple[str, int]]:
+        """
+        Returns the statements run at least threshold times, most repeated first. Lazy loads
+        in a loop show up here as one statement text with different parameters.
+        """
+        threshold = threshold or SQL_REPEATED_STATEMENT_THRESHOLD
+        return [(statement, count) for statement, count in self.statements.most_common() if count >= threshold]
+
+    def headers(self) -> dict[str, str]:
+        slowest = self.slowest[0][0] if self.slowest else 0
+        return dict(zip(
+            QUERY_STATS_HEADERS,
+            [str(self.count), f"{self.total_seconds * 1000:.1f}", f"{slowest * 1000:.1f}"],
+            strict=True,
+        ))
+
+    def log_summary(self, label: str):
+        for statement, count in self.repeated():
+            logging.warning(f"{label} ran the same SQL statement {count} times, a likely N+1 query: {statement[:200]}")
+        if self.count and logging.getLogger().isEnabledFor(logging.DEBUG):
+            slowest = "; ".join(f"{seconds * 1000:.1f} ms: {statement[:200]}" for seconds, statement in self.slowest)
+            logging.debug(f"{label} ran {self.count} SQL statements in {self.total_seconds * 1000:.1f} ms. Slowest: {slowest}")
+
+
+@contextmanager
+def track_queries(engine: Engine | None = None):
+    """
+    Records the SQL statements run in the current context (a request or task), or with
+    engine, every statement run on that engine from any thread.
+    """
+    stats = QueryStats()
+    if engine is None:
+        token = _context_stats.set((*_context_stats.get(), stats))
+        try:
+            yield stats
+        finally:
+            _context_stats.reset(token)
+        return
+    _engine_stats.setdefault(engine, []).append(stats)
+    try:
+        yield stats
+    finally:
+        _engine_stats[engine].remove(stats)
+        if not _engine_stats[engine]:
+            del _engine_stats[engine]
+
+
+def _recorders(connection) -> list[QueryStats]:
+    return [*_context_stats.get(), *_engine_stats.get(connection.engine, ())]
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_query_timer(connection, _cursor, _statement, _parameters, context, _executemany):
+    if context is not None and _recorders(connection):
+        context.query_start_time = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _record_query(connection, _cursor, statement, _parameters, context, _executemany):
+    start_time = getattr(context, "query_start_time", None)
+    if start_time is None:
+        return
+    seconds = time.perf_counter() - start_time
+    for stats in _recorders(connection):
+        stats.record(statement, seconds)
@@ -0,0 +1,261 @@
+import logging
+from contextlib import contextmanager
+
+from sqlalchemy import (
+    JSON,
+    Column,
+    DateTime,
+    MetaData,
+    String,
+    Table,
+    Text,
+    bindparam,
+    column,
+    func,
+    inspect,
+    select,
+    table,
+    text,
+)
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session, selectinload, sessionmaker
+
+from src.db import database, models, search, stats
+from src.db.database import Base
+from src.utils.compression import pack_blob
+
+# Rows moved per statement by data migrations, to bound memory on large tables
+MIGRATION_BATCH_SIZE = 1000
+# Postgres advisory lock key that serializes schema changes across processes
+MIGRATION_LOCK_KEY = 7_260_341
+
+_migration_metadata = MetaData()
+schema_migrations = Table(
+    "schema_migrations",
+    _migration_metadata,
+    Column("version", String, primary_key=True),
+    Column("applied_at", DateTime(timezone=True), server_default=func.now()),
+)
+
+
+def _columns(connection: Connection, table_name: str) -> set[str]:
+    return {c["name"] for c in inspect(connection).get_columns(table_name)}
+
+
+def _add_column(connection: Connection, table_name: str, model_column: Column):
+    definition = f"{model_column.name} {model_column.type.compile(dialect=connection.dialect)}"
+    for foreign_key in model_column.foreign_keys:
+        definition += f" REFERENCES {foreign_key.column.table.name} ({foreign_key.column.name})"
+        if foreign_key.ondelete:
+            definition += f" ON DELETE {foreign_key.ondelete}"
+    connection.exec_driver_sql(f"ALTER TABLE {table_name} ADD COLUMN {definition}")
+
+
+def add_latest_analysis_pointer(connection: Connection):
+    """
+    Adds repositories.latest_analysis_id and points it at each repository's newest analysis.
+    """
+    if "latest_analysis_id" not in _columns(connection, "repositories"):
+        _add_column(connection, "repositories", models.Repository.__table__.c.latest_analysis_id)
+    analysis = models.AnalysisResult.__table__
+    newest = (
+        select(analysis.c.id)
+        .where(analysis.c.repository_id == models.Repository.__table__.c.id)
+        .order_by(analysis.c.created_at.desc(), analysis.c.id.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    connection.execute(
+        models.Repository.__table__.update()
+        .where(models.Repository.__table__.c.latest_analysis_id.is_(None))
+        .values(latest_analysis_id=newest)
+    )
+
+
+BLOB_FIELDS = {"narrative": Text, "contributors": JSON, "languages": JSON, "tech_stack": JSON}
+
+
+def _pack_inline_fields(rows, inline_fields: list[str]) -> tuple[dict[str, bytes], list[dict]]:
+    """
+    Returns the blobs of a batch of analysis_results rows by hash, and the <name>_hash
+    values of each row as UPDATE parameters.
+    """
+    blobs, updates = {}, []
+    for row in rows:
+        hashes = {"row_id": row.id}
+        for name in inline_fields:
+            value = getattr(row, name)
+            hashes[f"{name}_hash"] = None
+            if value is not None:
+                digest, data = pack_blob(value)
+                blobs[digest] = data
+                hashes[f"{name}_hash"] = digest
+        updates.append(hashes)
+    return blobs, updates
+
+
+def move_analysis_fields_to_blobs(connection: Connection):
+    """
+    Moves the inline narrative and JSON columns of analysis_results into the blobs table.
+    """
+    existing = _columns(connection, "analysis_results")
+    inline_fields = [name for name in BLOB_FIELDS if name in existing]
+    for name in BLOB_FIELDS:
+        if f"{name}_hash" not in existing:
+            _add_column(connection, "analysis_results", models.AnalysisResult.__table__.c[f"{name}_hash"])
+    if not inline_fields:
+        return
+
+    # The old columns are no longer mapped, so they are read through a lightweight table
+    old = table("analysis_results", column("id"), *(column(name, BLOB_FIELDS[name]) for name in inline_fields))
+    insert = postgresql.insert if connection.dialect.name == "postgresql" else sqlite.insert
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            select(old).where(old.c.id > last_id).order_by(old.c.id).limit(MIGRATION_BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        blobs, updates = _pack_inline_fields(rows, inline_fields)
+        if blobs:
+            connection.execute(
+                insert(models.Blob.__table__).on_conflict_do_nothing(index_elements=["hash"]),
+                [{"hash": digest, "data": data} for digest, data in blobs.items()],
+            )
+        analysis = models.AnalysisResult.__table__
+        connection.execute(
+            analysis.update()
+            .where(analysis.c.id == bindparam("row_id"))
+            .values({f"{name}_hash": bindparam(f"{name}_hash") for name in inline_fields}),
+            updates,
+        )
+        last_id = rows[-1].id
+
+    for name in inline_fields:
+        connection.exec_driver_sql(f"ALTER TABLE analysis_results DROP COLUMN {name}")
+
+
+def create_missing_indexes(connection: Connection):
+    """
+    Creates the indexes declared on the models that tables created by older versions lack.
+    """
+    for model_table in Base.metadata.sorted_tables:
+        for index in model_table.indexes:
+            index.create(connection, checkfirst=True)
+
+
+def index_analysis_stacks(connection: Connection):
+    """
+    Fills the normalized technology and language tables from the stored analyses.
+    """
+    session = Session(bind=connection)
+    last_id = 0
+    while True:
+        analyses = (
+            session.query(models.AnalysisResult)
+            .filter(models.AnalysisResult.id > last_id)
+            .order_by(models.AnalysisResult.id)
+            .limit(MIGRATION_BATCH_SIZE)
+            .all()
+        )
+        if not analyses:
+            break
+        for analysis in analyses:
+            models.rebuild_stack_index(session, analysis)
+        session.flush()
+        last_id = analyses[-1].id
+        session.expunge_all()
+    session.close()
+
+
+def build_search_index(connection: Connection):
+    """
+    Creates the full-text search index and fills it from the stored analyses.
+    """
+    search.create_search_index(connection)
+    session = Session(bind=connection)
+    last_id = 0
+    while True:
+        analyses = (
+            session.query(models.AnalysisResult)
+            .options(*[selectinload(relationship) for relationship in models.BLOB_RELATIONSHIPS])
+            .filter(models.AnalysisResult.id > last_id)
+            .order_by(models.AnalysisResult.id)
+            .limit(MIGRATION_BATCH_SIZE)
+            .all()
+        )
+        if not analyses:
+            break
+        search.index_analyses(connection, search.search_documents(session, analyses))
+        last_id = analyses[-1].id
+        session.expunge_all()
+    session.close()
+
+
+def build_user_stats(connection: Connection):
+    """
+    Fills the per-user dashboard counters from the stored analyses.
+    """
+    for user_id in connection.execute(select(models.User.__table__.c.id)).scalars().all():
+        stats.rebuild_user_stats(connection, user_id)
+
+
+# Applied in order, each exactly once per database; append new migrations at the end
+MIGRATIONS = [
+    ("0001_latest_analysis_pointer", add_latest_analysis_pointer),
+    ("0002_analysis_blobs", move_analysis_fields_to_blobs),
+    ("0003_performance_indexes", create_missing_indexes),
+    ("0004_analysis_stack_index", index_analysis_stacks),
+    ("0005_search_index", build_search_index),
+    ("0006_user_stats", build_user_stats),
+]
+
+
+@contextmanager
+def migration_lock(engine: Engine):
+    """
+    Yields a connection inside a transaction that holds the database-wide migration lock, so
+    processes starting together (uvicorn workers, replicas) change the schema one at a time.
+    Postgres takes a transaction-scoped advisory lock; SQLite takes its write lock up front
+    with BEGIN IMMEDIATE. Either is released when the transaction ends.
+    """
+    with engine.connect() as connection, connection.begin():
+        if connection.dialect.name == "postgresql":
+            connection.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+        elif connection.dialect.name == "sqlite":
+            connection.exec_driver_sql("BEGIN IMMEDIATE")
+        yield connection
+
+
+def run_migrations(connection: Connection, fresh: bool = False):
+    """
+    Brings a database created by an older version up to the current models. The applied
+    versions are read on the given connection, which should hold the migration lock, and
+    the pending migrations are applied in its transaction.
+    A fresh database, just created from the models, only records every migration as applied.
+    """
+    _migration_metadata.create_all(bind=connection)
+    applied = set(connection.execute(select(schema_migrations.c.version)).scalars())
+    for version, migrate in MIGRATIONS:
+        if version in applied:
+            continue
+        if not fresh:
+            logging.info(f"Applying database migration {version}.")
+            migrate(connection)
+        connection.execute(schema_migrations.insert().values(version=version))
+
+
+def init_db(engine_to_use=None):
+    """
+    Creates the tables of the models and applies the pending migrations, under the migration
+    lock since every API process does this on startup. Lives here rather than in
+    src.db.database, which the models import.
+    """
+    if engine_to_use:
+        database.engine = engine_to_use
+    database.SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=database.engine)
+    with migration_lock(database.engine) as connection:
+        fresh = not inspect(connection).has_table("repositories")
+        Base.metadata.create_all(bind=connection)
+        run_migrations(connection, fresh=fresh)
@@ -1,22 +1,38 @@
 from sqlalchemy import (
-    JSON,
+    BigInteger,
     Column,
     DateTime,
     Enum,
+    Float,
     ForeignKey,
+    Index,
     Integer,
+    LargeBinary,
     String,
     Text,
+    event,
+    inspect,
+    select,
 )
-from sqlalchemy.orm import relationship
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session, relationship
+from sqlalchemy.orm.exc import DetachedInstanceError
 from sqlalchemy.sql import func
 
 from src.core.enums import (
     AnalysisStatus,  # Import AnalysisStatus from the new common module
 )
+from src.utils.compression import pack_blob, unpack_blob
 
 from .database import Base
 
+# SQLite compares timestamps as text, so bound values must use the same format as
+# CURRENT_TIMESTAMP server defaults for keyset cursors on created_at to match
+Timestamp = DateTime(timezone=True).with_variant(
+    sqlite.DATETIME(storage_format="%(year)04d-%(month)02d-%(day)02d %(hour)02d:%(minute)02d:%(second)02d"),
+    "sqlite",
+)
+
 
 class User(Base):
     __tablename__ = "users"
@@ -37,11 +53,90 @@ class Repository(Base):
     owner_id = Column(Integer, ForeignKey("users.id"))
     status = Column(Enum(AnalysisStatus), nullable=False, default=AnalysisStatus.PENDING)
     summary = Column(Text)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Newest AnalysisResult, kept up to date by crud.create_analysis_result, so listings
+    # don't have to scan the analysis history
+    latest_analysis_id = Column(
+        Integer, ForeignKey("analysis_results.id", use_alter=True, ondelete="SET NULL"), nullable=True
+    )
+    created_at = Column(Timestamp, server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
     owner = relationship("User", back_populates="repositories")
-    analysis_results = relationship("AnalysisResult", back_populates="repository", cascade="all, delete-orphan")
+    analysis_results = relationship(
+        "AnalysisResult",
+        back_populates="repository",
+        foreign_keys="AnalysisResult.repository_id",
+        cascade="all, delete-orphan",
+    )
+    # post_update breaks the insert/delete cycle with AnalysisResult.repository_id
+    latest_analysis = relationship("AnalysisResult", foreign_keys=[latest_analysis_id], post_update=True)
+
+    # Keyset pagination of a user's repositories (and of all repositories), newest first.
+    # The composite index also serves plain owner_id lookups.
+    __table_args__ = (
+        Index("ix_repositories_owner_id_created_at_id", "owner_id", "created_at", "id"),
+        Index("ix_repositories_created_at_id", "created_at", "id"),
+    )
+
+
+class Blob(Base):
+    """
+    Content-addressed store for bulky analysis data (narratives, contributor lists, ...),
+    zstd-compressed and keyed by the SHA-256 of its canonical JSON, so equal values are stored once.
+    """
+    __tablename__ = "blobs"
+
+    hash = Column(String(64), primary_key=True)
+    data = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    @property
+    def value(self):
+        return unpack_blob(self.data)
+
+
+class BlobField:
+    """
+    Exposes a JSON value stored in the blobs table as a plain attribute. Reading loads the
+    blob lazily through the <name>_blob relationship; writing sets <name>_hash and leaves
+    the compressed value for the before_flush hook below to insert.
+    """
+
+    def __set_name__(self, owner, name):
+        self.name = name
+        self.hash_attribute = f"{name}_hash"
+        self.relationship = f"{name}_blob"
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        digest = getattr(instance, self.hash_attribute)
+        if digest is None:
+            return None
+        cached = instance.__dict__.setdefault("_blob_values", {}).get(self.name)
+        if cached is not None and cached[0] == digest:
+            return cached[1]
+        blob = getattr(instance, self.relationship)
+        if blob is None or blob.hash != digest:
+            # The hash changed since the relationship was loaded
+            session = Session.object_session(instance)
+            if session is None:
+                raise DetachedInstanceError(
+                    f"Parent instance {instance!r} is not bound to a Session; loading {self.name} cannot proceed"
+                )
+            blob = session.get(Blob, digest)
+        value = blob.value
+        instance.__dict__["_blob_values"][self.name] = (digest, value)
+        return value
+
+    def __set__(self, instance, value):
+        if value is None:
+            setattr(instance, self.hash_attribute, None)
+            return
+        digest, data = pack_blob(value)
+        instance.__dict__.setdefault("_blob_values", {})[self.name] = (digest, value)
+        instance.__dict__.setdefault("_pending_blobs", {})[digest] = data
+        setattr(instance, self.hash_attribute, digest)
 
 
 class AnalysisResult(Base):
@@ -50,17 +145,184 @@ class AnalysisResult(Base):
     id = Column(Integer, primary_key=True, index=True)
     repository_id = Column(Integer, ForeignKey("repositories.id"), nullable=False)
     summary = Column(Text)
-    narrative = Column(Text) # New field for comprehensive narrative
     open_issues_count = Column(Integer, default=0)
     open_pull_requests_count = Column(Integer, default=0)
-    contributors = Column(JSON)
     file_count = Column(Integer)
     total_lines = Column(Integer)
     commit_count = Column(Integer)
-    languages = Column(JSON)
-    tech_stack = Column(JSON) # New field for identified technologies
     report_url = Column(String) # Add report_url column
     status = Column(Enum(AnalysisStatus), nullable=False, default=AnalysisStatus.PENDING) # Add status column
+    created_at = Column(Timestamp, server_default=func.now())
+
+    # Bulky values live in the blobs table, so scans of this table only read small rows
+    narrative_hash = Column(String(64), ForeignKey("blobs.hash"))
+    contributors_hash = Column(String(64), ForeignKey("blobs.hash"))
+    languages_hash = Column(String(64), ForeignKey("blobs.hash"))
+    tech_stack_hash = Column(String(64), ForeignKey("blobs.hash"))
+    narrative_blob = relationship("Blob", foreign_keys=[narrative_hash])
+    contributors_blob = relationship("Blob", foreign_keys=[contributors_hash])
+    languages_blob = relationship("Blob", foreign_keys=[languages_hash])
+    tech_stack_blob = relationship("Blob", foreign_keys=[tech_stack_hash])
+    narrative = BlobField() # Comprehensive narrative
+    contributors = BlobField()
+    languages = BlobField()
+    tech_stack = BlobField() # Identified technologies
+
+    repository = relationship("Repository", back_populates="analysis_results", foreign_keys=[repository_id])
+    payload = relationship("AnalysisPayload", back_populates="analysis_result", uselist=False, cascade="all, delete-orphan")
+    # Normalized copies of tech_stack and languages for filtering, rebuilt whenever those change
+    technology_links = relationship("AnalysisTechnology", cascade="all, delete-orphan")
+    language_links = relationship("AnalysisLanguage", cascade="all, delete-orphan")
+
+    # Keyset pagination of a repository's analysis history, newest first.
+    # The composite index also serves plain repository_id lookups.
+    __table_args__ = (
+        Index("ix_analysis_results_repository_id_created_at_id", "repository_id", "created_at", "id"),
+    )
+
+
+BLOB_RELATIONSHIPS = [
+    AnalysisResult.narrative_blob,
+    AnalysisResult.contributors_blob,
+    AnalysisResult.languages_blob,
+    AnalysisResult.tech_stack_blob,
+]
+# Columns that keep a blob alive; blobs none of them refer to are swept, see crud.delete_orphaned_blobs
+BLOB_REFERENCES = [
+    AnalysisResult.narrative_hash,
+    AnalysisResult.contributors_hash,
+    AnalysisResult.languages_hash,
+    AnalysisResult.tech_stack_hash,
+]
+
+
+@event.listens_for(Session, "before_flush")
+def _insert_pending_blobs(session, _flush_context, _instances):
+    pending = {}
+    for instance in (*session.new, *session.dirty):
+        pending.update(instance.__dict__.pop("_pending_blobs", {}))
+    if not pending:
+        return
+    connection = session.connection()
+    insert = postgresql.insert if connection.dialect.name == "postgresql" else sqlite.insert
+    # Blobs that are already stored are left as they are
+    connection.execute(
+        insert(Blob).on_conflict_do_nothing(index_elements=["hash"]),
+        [{"hash": digest, "data": data} for digest, data in pending.items()],
+    )
+
+
+class Technology(Base):
+    __tablename__ = "technologies"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False)
+    key = Column(String, unique=True, nullable=False) # Lowercased name, for case-insensitive filters
+
+
+class Language(Base):
+    __tablename__ = "languages"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False)
+    key = Column(String, unique=True, nullable=False) # Lowercased name, for case-insensitive filters
+
+
+class AnalysisTechnology(Base):
+    __tablename__ = "analysis_technologies"
+
+    analysis_id = Column(Integer, ForeignKey("analysis_results.id", ondelete="CASCADE"), primary_key=True)
+    technology_id = Column(Integer, ForeignKey("technologies.id"), primary_key=True)
+
+    technology = relationship("Technology")
+
+    # The primary key serves lookups by analysis, this index the facet counts by technology
+    __table_args__ = (Index("ix_analysis_technologies_technology_id_analysis_id", "technology_id", "analysis_id"),)
+
+
+class AnalysisLanguage(Base):
+    __tablename__ = "analysis_languages"
+
+    analysis_id = Column(Integer, ForeignKey("analysis_results.id", ondelete="CASCADE"), primary_key=True)
+    language_id = Column(Integer, ForeignKey("languages.id"), primary_key=True)
+    bytes = Column(Integer, nullable=False)
+    share = Column(Float, nullable=False) # Fraction of the analysis' code in this language, 0 to 1
+
+    language = relationship("Language")
+
+    __table_args__ = (Index("ix_analysis_languages_language_id_share", "language_id", "share", "analysis_id"),)
+
+
+def _term_ids(session, model, names) -> dict[str, int]:
+    """
+    Returns the IDs of the technologies or languages with the given names by lowercased
+    name, inserting the ones that are new.
+    """
+    terms = {name.lower(): name for name in names}
+    if not terms:
+        return {}
+    connection = session.connection()
+    insert = postgresql.insert if connection.dialect.name == "postgresql" else sqlite.insert
+    connection.execute(
+        insert(model).on_conflict_do_nothing(index_elements=["key"]),
+        [{"key": key, "name": name} for key, name in terms.items()],
+    )
+    return dict(connection.execute(select(model.key, model.id).where(model.key.in_(terms))).all())
+
+
+def rebuild_stack_index(session, analysis: AnalysisResult, technologies: bool = True, languages: bool = True):
+    """
+    Replaces the normalized technology and/or language rows of an analysis with ones
+    built from its tech_stack and languages.
+    """
+    with session.no_autoflush:
+        if technologies:
+            technology_ids = _term_ids(session, Technology, analysis.tech_stack or [])
+            analysis.technology_links = [AnalysisTechnology(technology_id=i) for i in technology_ids.values()]
+        if languages:
+            sizes = {name.lower(): size for name, size in (analysis.languages or {}).items()}
+            total = sum(sizes.values())
+            language_ids = _term_ids(session, Language, analysis.languages or {})
+            analysis.language_links = [
+                AnalysisLanguage(language_id=language_ids[key], bytes=size, share=size / total if total else 0)
+                for key, size in sizes.items()
+            ]
+
+
+@event.listens_for(Session, "before_flush")
+def _index_analysis_stack(session, _flush_context, _instances):
+    for instance in (*session.new, *session.dirty):
+        if isinstance(instance, AnalysisResult):
+            attributes = inspect(instance).attrs
+            technologies = attributes.tech_stack_hash.history.has_changes()
+            languages = attributes.languages_hash.history.has_changes()
+            if technologies or languages:
+                rebuild_stack_index(session, instance, technologies, languages)
+
+
+class UserStat(Base):
+    """
+    Running per-user totals over all of the user's analyses, one counter per row: analyses
+    by status, commits, files, lines, language bytes and technology counts. Kept up to date
+    in the transaction that writes each analysis, see src/db/stats.py.
+    """
+    __tablename__ = "user_stats"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    metric = Column(String, primary_key=True)
+    key = Column(String, primary_key=True, default="") # Status, language or technology; empty for plain totals
+    value = Column(BigInteger, nullable=False, default=0)
+
+
+class AnalysisPayload(Base):
+    """
+    Claim-check store for the raw analysis dict (file structure, commit history, ...).
+    Celery tasks pass the analysis ID around instead of the payload itself.
+    """
+    __tablename__ = "analysis_payloads"
+
+    analysis_id = Column(Integer, ForeignKey("analysis_results.id"), primary_key=True)
+    data = Column(LargeBinary, nullable=False) # zlib-compressed JSON
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
-    repository = relationship("Repository", back_populates="analysis_results")
+    analysis_result = relationship("AnalysisResult", back_populates="payload")
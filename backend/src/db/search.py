@@ -0,0 +1,174 @@
+import re
+
+from sqlalchemy import DDL, event, inspect, select, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from src.db import models
+
+# Full-text index over repository names, analysis summaries and narratives. Narratives
+# are stored compressed in the blobs table, so the index keeps its own copy of the text.
+# SQLite: an FTS5 table whose rowid is the analysis ID. The owner is indexed as a token,
+# so a match only walks the postings of one user's analyses.
+SQLITE_SEARCH_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS analysis_search "
+    "USING fts5(owner, repository_name, summary, narrative, tokenize = 'porter unicode61')"
+)
+# Postgres: a weighted tsvector per analysis behind a GIN index
+POSTGRES_SEARCH_DDL = [
+    "CREATE TABLE IF NOT EXISTS analysis_search ("
+    "analysis_id INTEGER PRIMARY KEY REFERENCES analysis_results (id) ON DELETE CASCADE, "
+    "owner_id INTEGER NOT NULL, document TSVECTOR NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS ix_analysis_search_document ON analysis_search USING GIN (document)",
+    "CREATE INDEX IF NOT EXISTS ix_analysis_search_owner_id ON analysis_search (owner_id)",
+]
+# bm25 weights of the owner, repository_name, summary and narrative columns
+SQLITE_COLUMN_WEIGHTS = "0, 10.0, 5.0, 1.0"
+SEARCH_LANGUAGE = "english"
+_WORD_PATTERN = re.compile(r"\w+")
+
+
+def create_search_index(connection: Connection):
+    if connection.dialect.name == "postgresql":
+        for statement in POSTGRES_SEARCH_DDL:
+            connection.exec_driver_sql(statement)
+    else:
+        connection.exec_driver_sql(SQLITE_SEARCH_DDL)
+
+
+# Databases created from the models get the index together with analysis_results;
+# older ones get it from a migration
+event.listen(
+    models.AnalysisResult.__table__,
+    "after_create",
+    DDL(SQLITE_SEARCH_DDL).execute_if(dialect="sqlite"),
+)
+for _statement in POSTGRES_SEARCH_DDL:
+    event.listen(
+        models.AnalysisResult.__table__,
+        "after_create",
+        DDL(_statement).execute_if(dialect="postgresql"),
+    )
+
+
+def index_analyses(connection: Connection, documents: list[dict]):
+    """
+    Adds or replaces the index entries of analyses. Each document has analysis_id, owner_id,
+    repository_name, summary and narrative.
+    """
+    if not documents:
+        return
+    if connection.dialect.name == "postgresql":
+        connection.execute(
+            text(
+                "INSERT INTO analysis_search (analysis_id, owner_id, document) VALUES (:analysis_id, :owner_id, "
+                "setweight(to_tsvector(CAST(:language AS regconfig), coalesce(:repository_name, '')), 'A') || "
+                "setweight(to_tsvector(CAST(:language AS regconfig), coalesce(:summary, '')), 'B') || "
+                "setweight(to_tsvector(CAST(:language AS regconfig), coalesce(:narrative, '')), 'C')) "
+                "ON CONFLICT (analysis_id) DO UPDATE SET owner_id = excluded.owner_id, document = excluded.document"
+            ),
+            [{**document, "language": SEARCH_LANGUAGE} for document in documents],
+        )
+        return
+    connection.execute(
+        text(
+            "INSERT OR REPLACE INTO analysis_search (rowid, owner, repository_name, summary, narrative) "
+            "VALUES (:analysis_id, :owner, :repository_name, :summary, :narrative)"
+        ),
+        [{**document, "owner": _owner_token(document["owner_id"])} for document in documents],
+    )
+
+
+def remove_analyses(connection: Connection, analysis_ids: list[int]):
+    if not analysis_ids:
+        return
+    column = "analysis_id" if connection.dialect.name == "postgresql" else "rowid"
+    connection.execute(
+        text(f"DELETE FROM analysis_search WHERE {column} = :analysis_id"),
+        [{"analysis_id": analysis_id} for analysis_id in analysis_ids],
+    )
+
+
+def _owner_token(owner_id: int) -> str:
+    return f"owner{owner_id}"
+
+
+def search_analyses(db: Session, owner_id: int, query: str, limit: int, offset: int = 0) -> list:
+    """
+    Returns the owner's analyses matching every word of query, best match first, as rows of
+    analysis_id, repository_id, repository_name, summary, created_at and rank.
+    """
+    words = _WORD_PATTERN.findall(query)
+    if not words:
+        return []
+    parameters = {"owner_id": owner_id, "limit": limit, "offset": offset}
+    if db.get_bind().dialect.name == "postgresql":
+        statement = (
+            "SELECT a.id AS analysis_id, a.repository_id, r.name AS repository_name, a.summary, a.created_at, "
+            "ts_rank_cd(s.document, q) AS rank "
+            "FROM analysis_search s, plainto_tsquery(CAST(:language AS regconfig), :query) q, "
+            "analysis_results a, repositories r "
+            "WHERE s.owner_id = :owner_id AND s.document @@ q AND a.id = s.analysis_id AND r.id = a.repository_id "
+            "ORDER BY rank DESC, a.id DESC LIMIT :limit OFFSET :offset"
+        )
+        parameters.update(language=SEARCH_LANGUAGE, query=" ".join(words))
+    else:
+        statement = (
+            "SELECT a.id AS analysis_id, a.repository_id, r.name AS repository_name, a.summary, a.created_at, "
+            f"-bm25(analysis_search, {SQLITE_COLUMN_WEIGHTS}) AS rank "
+            "FROM analysis_search JOIN analysis_results a ON a.id = analysis_search.rowid "
+            "JOIN repositories r ON r.id = a.repository_id "
+            "WHERE analysis_search MATCH :match "
+            "ORDER BY rank DESC, a.id DESC LIMIT :limit OFFSET :offset"
+        )
+        # Every word is quoted, so user input cannot inject FTS5 operators
+        terms = " ".join(f'"{word}"' for word in words)
+        parameters["match"] = f'owner : "{_owner_token(owner_id)}" AND ({terms})'
+    return db.execute(text(statement), parameters).all()
+
+
+def search_documents(session: Session, analyses: list) -> list[dict]:
+    """
+    Builds the index documents of analyses.
+    """
+    repository_ids = {analysis.repository_id for analysis in analyses}
+    repositories = {
+        row.id: row
+        for row in session.execute(
+            select(models.Repository.id, models.Repository.name, models.Repository.owner_id).where(
+                models.Repository.id.in_(repository_ids)
+            )
+        )
+    }
+    return [
+        {
+            "analysis_id": analysis.id,
+            "owner_id": repositories[analysis.repository_id].owner_id,
+            "repository_name": repositories[analysis.repository_id].name,
+            "summary": analysis.summary,
+            "narrative": analysis.narrative,
+        }
+        for analysis in analyses
+        if analysis.repository_id in repositories
+    ]
+
+
+@event.listens_for(Session, "after_flush")
+def _update_search_index(session, _flush_context):
+    # The session still lists the flushed objects as new, dirty and deleted here
+    changed, removed = [], []
+    for instance in session.deleted:
+        if isinstance(instance, models.AnalysisResult):
+            removed.append(instance.id)
+    for instance in (*session.new, *session.dirty):
+        if isinstance(instance, models.AnalysisResult) and instance not in session.deleted:
+            attributes = inspect(instance).attrs
+            if instance in session.new or any(
+                attributes[name].history.has_changes() for name in ("summary", "narrative_hash", "repository_id")
+            ):
+                changed.append(instance)
+    if not changed and not removed:
+        return
+    connection = session.connection()
+    remove_analyses(connection, removed)
+    index_analyses(connection, search_documents(session, changed))
@@ -0,0 +1,237 @@
+from collections import Counter
+
+from sqlalchemy import event, inspect, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from src.core.enums import AnalysisStatus
+from src.db import models
+from src.utils.compression import unpack_blob
+
+# Per-user dashboard totals. Every flush that inserts, changes or deletes analyses adds
+# the difference to the owners' counters with atomic upserts, in the same transaction, so
+# reading the dashboard never touches analysis_results. reconcile_user_stats recomputes
+# the counters from scratch to repair drift, e.g. from rows written outside the ORM.
+STATS_BATCH_SIZE = 1000
+SCALAR_METRICS = ("total_commits", "total_files", "total_lines")
+KEYED_METRICS = ("status_counts", "language_bytes", "technology_counts")
+# Attributes of an AnalysisResult that the counters depend on
+_TRACKED_ATTRIBUTES = (
+    "repository_id", "status", "commit_count", "file_count", "total_lines", "languages_hash", "tech_stack_hash",
+)
+
+
+def contribution(owner_id: int | None, analysis, *, languages: dict | None, tech_stack: list | None) -> Counter:
+    """
+    Returns what one analysis adds to its owner's counters, keyed by (user_id, metric, key).
+    analysis is an AnalysisResult or a row with its status, commit_count, file_count and
+    total_lines; the languages and tech_stack values are passed decoded.
+    """
+    if owner_id is None:
+        return Counter()
+    status = AnalysisStatus(analysis.status or AnalysisStatus.PENDING)
+    counters = Counter({
+        (owner_id, "status_counts", status.value): 1,
+        (owner_id, "total_commits", ""): analysis.commit_count or 0,
+        (owner_id, "total_files", ""): analysis.file_count or 0,
+        (owner_id, "total_lines", ""): analysis.total_lines or 0,
+    })
+    for language, size in (languages or {}).items():
+        counters[(owner_id, "language_bytes", language)] += int(size)
+    for technology in set(tech_stack or []):
+        counters[(owner_id, "technology_counts", technology)] += 1
+    return counters
+
+
+def stored_contributions(connection: Connection, *conditions) -> Counter:
+    """
+    Returns the summed contributions of the stored analyses matching conditions.
+    """
+    analysis = models.AnalysisResult.__table__
+    repository = models.Repository.__table__
+    rows = connection.execute(
+        select(
+            repository.c.owner_id,
+            analysis.c.status,
+            analysis.c.commit_count,
+            analysis.c.file_count,
+            analysis.c.total_lines,
+            analysis.c.languages_hash,
+            analysis.c.tech_stack_hash,
+        )
+        .join_from(analysis, repository, analysis.c.repository_id == repository.c.id)
+        .where(*conditions)
+    ).all()
+    hashes = {digest for row in rows for digest in (row.languages_hash, row.tech_stack_hash) if digest}
+    blobs = {}
+    if hashes:
+        blob = models.Blob.__table__
+        blobs = {
+            digest: unpack_blob(data)
+            for digest, data in connection.execute(select(blob.c.hash, blob.c.data).where(blob.c.hash.in_(hashes)))
+        }
+    totals = Counter()
+    for row in rows:
+        totals.update(contribution(
+            row.owner_id, row, languages=blobs.get(row.languages_hash), tech_stack=blobs.get(row.tech_stack_hash)
+        ))
+    return totals
+
+
+def apply_deltas(connection: Connection, deltas: Counter):
+    """
+    Adds deltas to the stored counters, creating the ones that don't exist yet.
+    """
+    rows = [
+        {"user_id": user_id, "metric": metric, "key": key, "value": value}
+        for (user_id, metric, key), value in deltas.items()
+        if value
+    ]
+    if not rows:
+        return
+    insert = (postgresql.insert if connection.dialect.name == "postgresql" else sqlite.insert)(models.UserStat)
+    # Increments are done by the database, so concurrent writers never lose each other's updates
+    connection.execute(
+        insert.on_conflict_do_update(
+            index_elements=["user_id", "metric", "key"],
+            set_={"value": models.UserStat.value + insert.excluded.value},
+        ),
+        rows,
+    )
+
+
+def _pending_analyses(session) -> tuple[list, list, list]:
+    """
+    Returns the analyses a flush adds, changes in a way the counters depend on, and deletes.
+    """
+    added = [instance for instance in session.new if isinstance(instance, models.AnalysisResult)]
+    changed = [
+        instance
+        for instance in session.dirty
+        if isinstance(instance, models.AnalysisResult)
+        and instance not in session.deleted
+        and any(inspect(instance).attrs[name].history.has_changes() for name in _TRACKED_ATTRIBUTES)
+    ]
+    removed = [instance for instance in session.deleted if isinstance(instance, models.AnalysisResult)]
+    return added, changed, removed
+
+
+def _owner_ids(connection: Connection, analyses: list) -> list[int | None]:
+    """
+    Returns the owner of each analysis, looking up the repositories by ID in one query. An
+    analysis added through its repository relationship has no repository_id yet.
+    """
+    repository_ids = {analysis.repository_id for analysis in analyses if analysis.repository_id is not None}
+    owners = {}
+    if repository_ids:
+        repository = models.Repository.__table__
+        owners = dict(
+            connection.execute(
+                select(repository.c.id, repository.c.owner_id).where(repository.c.id.in_(repository_ids))
+            ).all()
+        )
+    return [
+        owners.get(analysis.repository_id)
+        if analysis.repository_id is not None
+        else (analysis.repository.owner_id if analysis.repository else None)
+        for analysis in analyses
+    ]
+
+
+@event.listens_for(Session, "before_flush")
+def _update_user_stats(session, _flush_context, _instances):
+    # The database still holds the old state of changed and deleted analyses here,
+    # so their old contributions are read from it rather than from attribute history
+    added, changed, removed = _pending_analyses(session)
+    if not (added or changed or removed):
+        return
+
+    connection = session.connection()
+    deltas = Counter()
+    stored_ids = [instance.id for instance in (*changed, *removed)]
+    if stored_ids:
+        deltas.subtract(stored_contributions(connection, models.AnalysisResult.__table__.c.id.in_(stored_ids)))
+    current = [*added, *changed]
+    with session.no_autoflush:
+        for instance, owner_id in zip(current, _owner_ids(connection, current), strict=True):
+            deltas.update(contribution(owner_id, instance, languages=instance.languages, tech_stack=instance.tech_stack))
+    apply_deltas(connection, deltas)
+
+
+def get_user_stats(db: Session, user_id: int) -> dict:
+    """
+    Returns the user's dashboard totals, largest first within each breakdown.
+    """
+    stats = dict.fromkeys(SCALAR_METRICS, 0) | {metric: {} for metric in KEYED_METRICS}
+    rows = db.execute(
+        select(models.UserStat.metric, models.UserStat.key, models.UserStat.value)
+        .where(models.UserStat.user_id == user_id)
+        .order_by(models.UserStat.metric, models.UserStat.value.desc(), models.UserStat.key)
+    ).all()
+    for metric, key, value in rows:
+        if metric in SCALAR_METRICS:
+            stats[metric] = value
+        elif metric in KEYED_METRICS and value:
+            stats[metric][key] = value
+    stats["analysis_count"] = sum(stats["status_counts"].values())
+    return stats
+
+
+def _stored_counters(connection: Connection, user_id: int) -> Counter:
+    stat = models.UserStat.__table__
+    return Counter({
+        (user_id, metric, key): value
+        for metric, key, value in connection.execute(
+            select(stat.c.metric, stat.c.key, stat.c.value).where(stat.c.user_id == user_id)
+        )
+        if value
+    })
+
+
+def rebuild_user_stats(connection: Connection, user_id: int) -> bool:
+    """
+    Recomputes a user's counters from their analyses, in batches, and replaces the stored
+    ones if they differ. Returns whether they did.
+    """
+    analysis = models.AnalysisResult.__table__
+    repository = models.Repository.__table__
+    expected = Counter()
+    last_id = 0
+    while True:
+        ids = connection.execute(
+            select(analysis.c.id)
+            .join_from(analysis, repository, analysis.c.repository_id == repository.c.id)
+            .where(repository.c.owner_id == user_id, analysis.c.id > last_id)
+            .order_by(analysis.c.id)
+            .limit(STATS_BATCH_SIZE)
+        ).scalars().all()
+        if not ids:
+            break
+        expected.update(stored_contributions(connection, analysis.c.id.in_(ids)))
+        last_id = ids[-1]
+    expected = +expected # Drops zero counters
+    if expected == _stored_counters(connection, user_id):
+        return False
+    stat = models.UserStat.__table__
+    connection.execute(stat.delete().where(stat.c.user_id == user_id))
+    apply_deltas(connection, expected)
+    return True
+
+
+def reconcile_user_stats(db: Session, user_id: int | None = None) -> list[int]:
+    """
+    Repairs the counters of one or every user, one short transaction per user, and returns
+    the IDs of the users whose counters had drifted. Writes that commit while a user is being
+    recomputed can leave new drift behind, which the next run repairs.
+    """
+    if user_id is None:
+        user_ids = db.execute(select(models.User.id).order_by(models.User.id)).scalars().all()
+    else:
+        user_ids = [user_id]
+    drifted = []
+    for current_id in user_ids:
+        if rebuild_user_stats(db.connection(), current_id):
+            drifted.append(current_id)
+        db.commit()
+    return drifted
@@ -1,3 +1,5 @@
+import asyncio
+import contextlib
 import os
 from contextlib import asynccontextmanager
 import logging
@@ -10,8 +12,11 @@ from fastapi.responses import JSONResponse
 load_dotenv() # Llamada a load_dotenv()
 from src.api.v1 import api_router, schemas
 from src.api.v1.connection_manager import manager
+from src.api.v1.status_events import relay_status_events
 from src.core.security import get_current_websocket_user
-from src.db.database import init_db
+from src.db.instrumentation import QUERY_STATS_HEADERS, SQL_DEBUG, track_queries
+from src.db.migrations import init_db
+from src.utils import metrics
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -21,8 +26,14 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 async def lifespan(app: FastAPI):
     # Create database tables
     init_db()
+    # Relay status events published by Celery workers to this process's websockets
+    relay_task = asyncio.create_task(relay_status_events(manager))
+    heartbeat_task = asyncio.create_task(manager.run_heartbeat())
     yield
-    # Any shutdown logic can go here
+    for task in (relay_task, heartbeat_task):
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
 
 # Create an instance of the FastAPI class
 app = FastAPI(
@@ -41,6 +52,20 @@ async def generic_exception_handler(request: Request, exc: Exception):
         content={"message": "An internal server error occurred."},
     )
 
+@app.middleware("http")
+async def record_sql_queries(request: Request, call_next):
+    """
+    Counts and times the SQL statements of each request, warns about likely N+1 queries,
+    and in SQL_DEBUG mode reports the numbers in X-DB-* response headers.
+    """
+    with track_queries() as queries:
+        response = await call_next(request)
+    queries.log_summary(f"{request.method} {request.url.path}")
+    metrics.increment("db_queries", queries.count)
+    if SQL_DEBUG:
+        response.headers.update(queries.headers())
+    return response
+
 # Define allowed origins for CORS
 # In production, this should be set to the actual frontend URL(s)
 frontend_url = os.getenv("FRONTEND_URL")
@@ -59,6 +84,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"], # Explicitly allow common methods
     allow_headers=["*"], # Allow all headers, as specific headers can vary
+    expose_headers=["X-Next-Cursor", *QUERY_STATS_HEADERS], # Lets the frontend read the pagination cursor and query stats
 )
 
 @app.get("/", tags=["Health Check"])
@@ -69,6 +95,14 @@ async def read_root():
     return {"status": "ok", "message": "Welcome to Dev Storyteller API!"}
 
 
+@app.get("/metrics", tags=["Health Check"])
+async def read_metrics():
+    """
+    Returns this process's counters and current websocket connection count.
+    """
+    return {**metrics.get_metrics(), "websocket_active_connections": manager.connection_count}
+
+
 # @app.websocket("/api/v1/ws/status")
 # async def websocket_endpoint(websocket: WebSocket, current_user: "TokenData" = Depends(get_current_websocket_user)):
 #     await manager.connect(websocket, current_user.id)
@@ -1,123 +1,420 @@
-import asyncio
-import json
 import logging
+import os
+import time
+import uuid
+from datetime import UTC, datetime, timedelta
 
+import httpx
+import redis
+from celery import chord
 from sqlalchemy import func
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import Session
 
 from src.api.v1 import schemas
-from src.api.v1.connection_manager import manager
+from src.api.v1.status_events import publish_status_event
 from src.celery_app import celery_app
 from src.core.enums import (
     AnalysisStatus,  # Import AnalysisStatus from the new common module
+    TaskPriority,
 )
-from src.db import crud, models
-from src.db.database import SessionLocal
+from src.core.exceptions import (
+    GitHubAPIError,
+    GitHubAuthError,
+    GitHubRateLimitError,
+    GitHubResourceNotFoundError,
+)
+from src.db import crud, models, stats
+from src.db.database import SessionLocal, unit_of_work
+from src.utils.async_utils import get_worker_resource, run_async
+from src.utils.redis_utils import get_redis_client
+from src.utils.url_utils import parse_github_url
 
 from .github_service import GitHubService  # Import GitHubService
 from .narrative_generator import NarrativeGenerator  # Import NarrativeGenerator
+from .progress import ProgressReporter, clear_progress_snapshot
 from .repository_analyzer import RepositoryAnalyzer
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-async def _broadcast_status_update(repo_id: int, status: AnalysisStatus):
-    """Helper function to broadcast repository status updates."""
-    await manager.broadcast(json.dumps({"id": repo_id, "status": status.value}))
+def _get_progress(repo_id: int | None, owner_id: int | None, stage: str) -> ProgressReporter | None:
+    """
+    Builds the progress reporter of a pipeline stage; callers that pass no repository get none.
+    """
+    if repo_id is None:
+        return None
+    return ProgressReporter(repo_id, owner_id, stage)
+
+
+def _get_github_service() -> GitHubService:
+    """
+    Builds a GitHubService, reusing the worker's pooled HTTP and Redis clients when
+    running inside a Celery worker process.
+    """
+    http_client = get_worker_resource("github_http_client", httpx.AsyncClient, closer=lambda c: c.aclose())
+    redis_client = get_worker_resource(
+        "redis_client", lambda: redis.Redis(host='localhost', port=6379, db=0), closer=lambda c: c.close()
+    )
+    return GitHubService(http_client=http_client, redis_client=redis_client)
+
+
+def _get_narrative_generator() -> NarrativeGenerator:
+    """Returns the worker's long-lived NarrativeGenerator, or a new one outside a worker."""
+    return get_worker_resource("narrative_generator", NarrativeGenerator) or NarrativeGenerator()
+
+def _get_repository_analyzer() -> RepositoryAnalyzer:
+    return RepositoryAnalyzer(_get_github_service())
+
+
+# Fetch subtasks only talk to GitHub, so transient API and network errors are retried
+# with backoff. Missing repositories and bad credentials will not fix themselves, and
+# rate-limited fetches are retried once the limit resets (see _run_fetch).
+FETCH_TASK_OPTIONS = {
+    "autoretry_for": (GitHubAPIError, httpx.HTTPError),
+    "dont_autoretry_for": (GitHubAuthError, GitHubResourceNotFoundError, GitHubRateLimitError),
+    "retry_backoff": True,
+    "max_retries": 3,
+}
+# A fetch whose rate limit resets later than this fails instead of waiting
+GITHUB_RATE_LIMIT_MAX_WAIT_SECONDS = int(os.getenv("GITHUB_RATE_LIMIT_MAX_WAIT_SECONDS", "3600"))
+
+# Blobs stay unreferenced this long before the sweep deletes them, which covers analyses
+# still writing theirs; the sweep deletes them this many per transaction
+BLOB_ORPHAN_GRACE_SECONDS = int(os.getenv("BLOB_ORPHAN_GRACE_SECONDS", "3600"))
+BLOB_SWEEP_BATCH_SIZE = int(os.getenv("BLOB_SWEEP_BATCH_SIZE", "1000"))
+
+# Persist and narrative steps are retried on database errors only
+DB_TASK_OPTIONS = {
+    "autoretry_for": (SQLAlchemyError,),
+    "retry_backoff": True,
+    "max_retries": 3,
+}
+
+
+# A repository is analysed at most once per dedup window, and never twice concurrently.
+# The lease lock outlives the window for long runs and expires if a worker dies.
+ANALYSIS_DEDUP_WINDOW_SECONDS = int(os.getenv("ANALYSIS_DEDUP_WINDOW_SECONDS", "300"))
+ANALYSIS_LOCK_TTL_SECONDS = int(os.getenv("ANALYSIS_LOCK_TTL_SECONDS", "1800"))
+
+# Deletes a lock or dispatch key only if it still belongs to the given run
+_RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+def analysis_idempotency_key(repo_id: int, now: float = None) -> str:
+    """
+    Returns the dispatch key for a repository in the current dedup time bucket.
+    """
+    bucket = int((time.time() if now is None else now) // ANALYSIS_DEDUP_WINDOW_SECONDS)
+    return f"analysis:dispatch:{repo_id}:{bucket}"
+
+
+def _analysis_lock_key(repo_id: int) -> str:
+    return f"analysis:lock:{repo_id}"
+
+
+def dispatch_analysis(repo_id: int, priority: TaskPriority = TaskPriority.INTERACTIVE) -> str:
+    """
+    Dispatches the analysis pipeline for a repository unless one was already dispatched
+    in the current dedup window or is still running. Duplicates attach to that run.
+    User submissions use the interactive priority; background refreshes should pass
+    TaskPriority.BACKGROUND so they queue behind them.
+    Returns the task ID of the run that handles the request.
+    """
+    redis_client = get_redis_client()
+    idempotency_key = analysis_idempotency_key(repo_id)
+    task_id = str(uuid.uuid4())
+
+    if not redis_client.set(idempotency_key, task_id, nx=True, ex=ANALYSIS_DEDUP_WINDOW_SECONDS):
+        existing_task_id = redis_client.get(idempotency_key)
+        if existing_task_id:
+            logging.info(f"Analysis of repository {repo_id} already dispatched as {existing_task_id.decode()}.")
+            return existing_task_id.decode()
+        redis_client.set(idempotency_key, task_id, ex=ANALYSIS_DEDUP_WINDOW_SECONDS)
+
+    if not redis_client.set(_analysis_lock_key(repo_id), task_id, nx=True, ex=ANALYSIS_LOCK_TTL_SECONDS):
+        in_flight_task_id = redis_client.get(_analysis_lock_key(repo_id))
+        if in_flight_task_id:
+            # Point the window's key at the running analysis, so later duplicates resolve directly
+            redis_client.set(idempotency_key, in_flight_task_id, ex=ANALYSIS_DEDUP_WINDOW_SECONDS)
+            logging.info(f"Analysis of repository {repo_id} is in flight as {in_flight_task_id.decode()}.")
+            return in_flight_task_id.decode()
+        redis_client.set(_analysis_lock_key(repo_id), task_id, ex=ANALYSIS_LOCK_TTL_SECONDS)
+
+    try:
+        clone_and_analyze_repository.apply_async(
+            (repo_id,), {"priority": int(priority)}, task_id=task_id, priority=int(priority)
+        )
+    except Exception:
+        # Nothing will run under this task ID, so the next request must be able to dispatch
+        redis_client.eval(_RELEASE_LOCK_SCRIPT, 1, idempotency_key, task_id)
+        release_analysis_lock(repo_id, task_id)
+        raise
+    return task_id
+
+
+def release_analysis_lock(repo_id: int, lock_token: str | None):
+    """
+    Releases the repository's analysis lock if it is still held by the run `lock_token`.
+    """
+    if not lock_token:
+        return
+    try:
+        get_redis_client().eval(_RELEASE_LOCK_SCRIPT, 1, _analysis_lock_key(repo_id), lock_token)
+    except redis.RedisError as e:
+        # The lease expires on its own; a failed release only delays the next analysis
+        logging.error(f"Could not release analysis lock for repository {repo_id}: {e}")
+
 
 @celery_app.task
-def clone_and_analyze_repository(repo_id: int, db: Session = None):
+def clone_and_analyze_repository(repo_id: int, priority: int = TaskPriority.INTERACTIVE, db: Session = None):
     """
-    Analyzes a repository using GitHub API, generates a recruiter summary, and updates the database.
+    Starts the analysis pipeline for a repository.
+    The AnalysisResult row is created up front, then the fetch subtasks run in parallel
+    as a chord whose callback persists the analysis and chains narrative generation.
+    Every step is sent with the run's priority.
     This function runs as a Celery task.
     """
     close_db_session = False
     if db is None:
         db = SessionLocal()
         close_db_session = True
+    # The lock taken by dispatch_analysis is held under this task's ID until the pipeline ends
+    lock_token = clone_and_analyze_repository.request.id
+    analysis_id = None
 
-    repo = crud.get_repository(db, repo_id)
-    if not repo:
-        logging.warning(f"Repository with ID {repo_id} not found.")
+    try:
+        repo = crud.get_repository(db, repo_id)
+        if not repo:
+            logging.warning(f"Repository with ID {repo_id} not found.")
+            release_analysis_lock(repo_id, lock_token)
+            return
+
+        # The status change and the new AnalysisResult are committed together
+        with unit_of_work(db):
+            repo.status = AnalysisStatus.IN_PROGRESS
+            repo.updated_at = func.now()
+            # Create AnalysisResult (summary and narrative will be updated by generate_narratives_task)
+            analysis_result = crud.create_analysis_result(
+                db=db,
+                analysis=schemas.AnalysisResultCreate(
+                    repository_id=repo.id,
+                    summary="Generating summary...", # Placeholder
+                    narrative="Generating narrative...", # Placeholder
+                    status=AnalysisStatus.IN_PROGRESS,
+                ),
+                refresh=False,
+            )
+        analysis_id = analysis_result.id
+        publish_status_event({"id": repo.id, "owner_id": repo.owner_id, "status": AnalysisStatus.IN_PROGRESS.value})
+        clear_progress_snapshot(repo.id)
+
+        repo_url, repo_name, owner_id = str(repo.url), repo.name, repo.owner_id
+        priority = int(priority)
+        progress = {"repo_id": repo_id, "owner_id": owner_id}
+        persist = persist_analysis.s(repo_id, analysis_id).set(priority=priority)
+        persist.link(
+            generate_narratives_task.si(repo_id, analysis_id, lock_token=lock_token, owner_id=owner_id).set(priority=priority)
+        )
+        # A failing fetch subtask fails the chord, which calls the callback's errbacks
+        persist.link_error(handle_analysis_failure.s(repo_id=repo_id, analysis_id=analysis_id, lock_token=lock_token))
+        chord(
+            [
+                fetch_repository_metadata.s(repo_url, **progress).set(priority=priority),
+                fetch_commit_history.s(repo_url, **progress).set(priority=priority),
+                fetch_file_structure.s(repo_url, **progress).set(priority=priority),
+                fetch_tech_stack.s(repo_url, **progress).set(priority=priority),
+            ],
+            persist,
+        ).apply_async()
+        logging.info(f"Analysis pipeline started for repository {repo_name} (analysis ID {analysis_id}).")
+    except Exception as e:
+        # The pipeline never started, so its error callback will not run either
+        db.rollback()
+        handle_analysis_failure(None, e, None, repo_id=repo_id, analysis_id=analysis_id, lock_token=lock_token, db=db)
+        raise
+    finally:
         if close_db_session:
             db.close()
-        return
+            logging.info("Closed DB session for task.")
+
 
+def _run_fetch(task, coroutine):
+    """
+    Runs a fetch subtask's coroutine. When GitHub's rate limit is exhausted, the task is
+    retried right after the limit resets rather than on the usual short backoff.
+    """
     try:
-        repo.status = AnalysisStatus.IN_PROGRESS
-        db.commit()
-        db.refresh(repo)
-        asyncio.run(_broadcast_status_update(repo.id, repo.status))
+        return run_async(coroutine)
+    except GitHubRateLimitError as e:
+        countdown = max(int((e.reset_time or 0) - time.time()), 1)
+        if countdown > GITHUB_RATE_LIMIT_MAX_WAIT_SECONDS:
+            raise
+        logging.warning(f"GitHub rate limit exhausted, retrying {task.name} in {countdown} seconds.")
+        raise task.retry(exc=e, countdown=countdown) from e
+
 
-        # Initialize services
-        github_service = GitHubService() # Still need GitHubService for RepositoryAnalyzer
-        repository_analyzer = RepositoryAnalyzer(github_service)
+@celery_app.task(**FETCH_TASK_OPTIONS)
+def fetch_repository_metadata(repo_url: str, repo_id: int = None, owner_id: int = None) -> dict:
+    """
+    Fetches repository details, languages, issues, pull requests and contributors.
+    """
+    owner, repo_name = parse_github_url(repo_url)
+    progress = _get_progress(repo_id, owner_id, "metadata")
+    return _run_fetch(fetch_repository_metadata, _get_repository_analyzer().get_repository_metadata(owner, repo_name, progress=progress))
+
+
+@celery_app.task(**FETCH_TASK_OPTIONS)
+def fetch_commit_history(repo_url: str, repo_id: int = None, owner_id: int = None) -> list[dict]:
+    """
+    Fetches the simplified commit history.
+    """
+    owner, repo_name = parse_github_url(repo_url)
+    progress = _get_progress(repo_id, owner_id, "commit_history")
+    return _run_fetch(fetch_commit_history, _get_repository_analyzer().get_commit_history(owner, repo_name, progress=progress))
+
+
+@celery_app.task(**FETCH_TASK_OPTIONS)
+def fetch_file_structure(repo_url: str, repo_id: int = None, owner_id: int = None) -> list[dict]:
+    """
+    Fetches the file tree of the latest commit.
+    """
+    owner, repo_name = parse_github_url(repo_url)
+    progress = _get_progress(repo_id, owner_id, "file_structure")
+    return _run_fetch(fetch_file_structure, _get_repository_analyzer().get_file_structure(owner, repo_name, progress=progress))
+
+
+@celery_app.task(**FETCH_TASK_OPTIONS)
+def fetch_tech_stack(repo_url: str, repo_id: int = None, owner_id: int = None) -> list[str]:
+    """
+    Identifies the tech stack from dependency manifests and config files.
+    """
+    owner, repo_name = parse_github_url(repo_url)
+    progress = _get_progress(repo_id, owner_id, "tech_stack")
+    return _run_fetch(fetch_tech_stack, _get_repository_analyzer().identify_tech_stack(owner, repo_name, progress=progress))
+
+
+@celery_app.task(**DB_TASK_OPTIONS)
+def persist_analysis(fetched: list, repo_id: int, analysis_id: int, db: Session = None):
+    """
+    Chord callback: combines the fetched parts, stores them on the AnalysisResult and in
+    the payload store, and marks the repository as COMPLETED.
+    This function runs as a Celery task.
+    """
+    close_db_session = False
+    if db is None:
+        db = SessionLocal()
+        close_db_session = True
 
-        # Perform repository analysis using the new method
-        repo_analysis = asyncio.run(repository_analyzer.get_repository_analysis(repo.url))
+    try:
+        metadata, commit_history, file_structure, tech_stack = fetched
+        repo_analysis = RepositoryAnalyzer.build_analysis(metadata, commit_history, file_structure, tech_stack)
 
-        # Trigger asynchronous narrative generation
-        generate_narratives_task.delay(repo.id, repo_analysis)
+        analysis_result = crud.get_analysis_result(db, analysis_id)
+        repo = crud.get_repository(db, repo_id)
+        if not analysis_result or not repo:
+            logging.warning(f"AnalysisResult {analysis_id} or repository {repo_id} not found. Cannot persist analysis.")
+            return None
 
         # Extract relevant data for AnalysisResult
-        file_count = repo_analysis.get("file_count", 0)
-        commit_count = repo_analysis.get("commit_count", 0)
-        languages = repo_analysis.get("languages", {})
-        open_issues_count = repo_analysis.get("open_issues_count", 0)
-        open_pull_requests_count = repo_analysis.get("open_pull_requests_count", 0)
-        contributors = repo_analysis.get("contributors", [])
-        tech_stack = repo_analysis.get("tech_stack", [])
-
-        # Create AnalysisResult (summary and narrative will be updated by generate_narratives_task)
-        analysis_data = schemas.AnalysisResultCreate(
-            repository_id=repo.id,
-            summary="Generating summary...", # Placeholder
-            narrative="Generating narrative...", # Placeholder
-            file_count=file_count,
-            commit_count=commit_count,
-            languages=languages,
-            open_issues_count=open_issues_count,
-            open_pull_requests_count=open_pull_requests_count,
-            contributors=contributors,
-            tech_stack=tech_stack,
-            status=repo.status,
-        )
-        crud.create_analysis_result(db=db, analysis=analysis_data)
+        analysis_result.file_count = repo_analysis.get("file_count", 0)
+        analysis_result.commit_count = repo_analysis.get("commit_count", 0)
+        analysis_result.languages = repo_analysis.get("languages", {})
+        analysis_result.open_issues_count = repo_analysis.get("open_issues_count", 0)
+        analysis_result.open_pull_requests_count = repo_analysis.get("open_pull_requests_count", 0)
+        analysis_result.contributors = repo_analysis.get("contributors", [])
+        analysis_result.tech_stack = repo_analysis.get("tech_stack", [])
+        analysis_result.status = AnalysisStatus.COMPLETED
+
+        # Store the full analysis once and hand the narrative task only its ID, so
+        # file structures and commit histories never travel through the broker
+        crud.save_analysis_payload(db, analysis_id, repo_analysis)
 
         repo.status = AnalysisStatus.COMPLETED
+        repo.updated_at = func.now()
+        db.commit()
         logging.info(f"Repository {repo.name} analysis status set to COMPLETED.")
-        asyncio.run(_broadcast_status_update(repo.id, repo.status))
+        publish_status_event({"id": repo_id, "owner_id": repo.owner_id, "status": AnalysisStatus.COMPLETED.value})
+        return analysis_id
+    except SQLAlchemyError:
+        db.rollback()
+        raise
+    finally:
+        if close_db_session:
+            db.close()
+            logging.info("Closed DB session for persist task.")
+
+
+@celery_app.task
+def handle_analysis_failure(_request, exc, _traceback, repo_id: int, analysis_id: int, lock_token: str = None, db: Session = None):
+    """
+    Error callback of the pipeline: marks the repository and its AnalysisResult as FAILED.
+    Celery calls it with the failed task's request, exception and traceback.
+    """
+    close_db_session = False
+    if db is None:
+        db = SessionLocal()
+        close_db_session = True
+
+    try:
+        logging.error(f"Analysis pipeline failed for repository ID {repo_id}: {exc}")
+        repo = crud.get_repository(db, repo_id)
+        if repo:
+            repo.status = AnalysisStatus.FAILED
+            repo.updated_at = func.now()
 
-    except Exception as e:
-        repo.status = AnalysisStatus.FAILED
-        logging.error(f"Error analyzing {repo.url}: {e}")
-        
         # Create or update analysis result with error summary
-        analysis_result = db.query(models.AnalysisResult).filter(models.AnalysisResult.repository_id == repo.id).first()
+        analysis_result = crud.get_analysis_result(db, analysis_id)
         if not analysis_result:
-            analysis_result = models.AnalysisResult(repository_id=repo.id, status=AnalysisStatus.FAILED)
+            analysis_result = models.AnalysisResult(repository_id=repo_id, status=AnalysisStatus.FAILED)
             db.add(analysis_result)
-        
-        analysis_result.summary = f"An unexpected error occurred during analysis: {e}"
+            if repo:
+                repo.latest_analysis = analysis_result
+
+        analysis_result.summary = f"An unexpected error occurred during analysis: {exc}"
+        analysis_result.narrative = None
         analysis_result.status = AnalysisStatus.FAILED
-        
-        asyncio.run(_broadcast_status_update(repo.id, repo.status))
-    finally:
-        repo.updated_at = func.now()
-        db.add(repo)
         db.commit()
-        db.refresh(repo)
+
+        if repo:
+            publish_status_event({"id": repo_id, "owner_id": repo.owner_id, "status": AnalysisStatus.FAILED.value})
+    finally:
+        release_analysis_lock(repo_id, lock_token)
         if close_db_session:
             db.close()
-            logging.info("Closed DB session for task.")
+            logging.info("Closed DB session for failure handler.")
 
 
-@celery_app.task
-def generate_narratives_task(repo_id: int, repo_analysis: dict, db: Session = None):
+def _record_narrative_failure(db: Session, analysis_id: int, error: Exception):
+    """
+    Replaces the placeholder summary and narrative of an analysis whose narratives could not
+    be generated. The analysis itself stays COMPLETED, since its data was stored.
+    """
+    try:
+        db.rollback()
+        analysis_result = crud.get_analysis_result(db, analysis_id)
+        if analysis_result is None:
+            return
+        analysis_result.summary = f"Summary generation failed: {error}"
+        analysis_result.narrative = None
+        db.commit()
+    except SQLAlchemyError as e:
+        db.rollback()
+        logging.error(f"Could not record the narrative failure of analysis {analysis_id}: {e}")
+
+
+@celery_app.task(**DB_TASK_OPTIONS)
+def generate_narratives_task(repo_id: int, analysis_id: int, lock_token: str = None, owner_id: int = None, db: Session = None):
     """
     Generates narratives (comprehensive and recruiter summary) for a repository using an LLM
     and updates the AnalysisResult in the database.
-    This function runs as a Celery task.
+    The analysis data is loaded from the payload store using the analysis ID.
+    This function runs as a Celery task, linked after persist_analysis.
     """
     close_db_session = False
     if db is None:
@@ -125,29 +422,98 @@ def generate_narratives_task(repo_id: int, repo_analysis: dict, db: Session = No
         close_db_session = True
     
     try:
-        narrative_generator = NarrativeGenerator()
+        narrative_generator = _get_narrative_generator()
 
         # Update the AnalysisResult in the database
-        analysis_result = db.query(models.AnalysisResult).filter(models.AnalysisResult.repository_id == repo_id).first()
-        if analysis_result:
+        analysis_result = crud.get_analysis_result(db, analysis_id)
+        repo_analysis = crud.get_analysis_payload(db, analysis_id) if analysis_result else None
+        if analysis_result and repo_analysis is not None:
+            progress = _get_progress(repo_id, owner_id, "narratives")
+            if progress:
+                progress.update(0, total=2)
             # Generate comprehensive narrative
             comprehensive_narrative = narrative_generator.generate_narrative(repo_analysis)
+            if progress:
+                progress.advance()
 
             # Generate recruiter summary
-            recruiter_summary = asyncio.run(narrative_generator.generate_recruiter_summary(repo_analysis))
+            recruiter_summary = run_async(narrative_generator.generate_recruiter_summary(repo_analysis))
+            if progress:
+                progress.advance()
 
-            analysis_result.summary = recruiter_summary
-            analysis_result.narrative = comprehensive_narrative # Assuming a 'narrative' field exists in AnalysisResult
-            db.add(analysis_result)
-            db.commit()
-            db.refresh(analysis_result)
+            with unit_of_work(db):
+                analysis_result.summary = recruiter_summary
+                analysis_result.narrative = comprehensive_narrative # Assuming a 'narrative' field exists in AnalysisResult
+                db.add(analysis_result)
+                # The payload is only needed until the narratives are written, so it goes in the same commit
+                crud.delete_analysis_payload(db, analysis_id)
             logging.info(f"Narratives generated and updated for repository ID {repo_id}.")
         else:
-            logging.warning(f"AnalysisResult not found for repository ID {repo_id}. Cannot update narratives.")
+            logging.warning(f"AnalysisResult {analysis_id} or its payload not found for repository ID {repo_id}. Cannot update narratives.")
+        release_analysis_lock(repo_id, lock_token)
 
+    except SQLAlchemyError:
+        # Retried by Celery, so the lock stays held until the last attempt
+        db.rollback()
+        if generate_narratives_task.request.retries >= generate_narratives_task.max_retries:
+            release_analysis_lock(repo_id, lock_token)
+        raise
     except Exception as e:
         logging.error(f"Error generating narratives for repository ID {repo_id}: {e}")
+        _record_narrative_failure(db, analysis_id, e)
+        release_analysis_lock(repo_id, lock_token)
     finally:
         if close_db_session:
             db.close()
             logging.info("Closed DB session for narrative generation task.")
+
+
+@celery_app.task(**DB_TASK_OPTIONS)
+def reconcile_user_stats(user_id: int = None, db: Session = None) -> list[int]:
+    """
+    Periodic repair of the per-user dashboard counters: recomputes them from the stored
+    analyses and logs the users whose counters had drifted.
+    This function runs as a Celery task.
+    """
+    close_db_session = False
+    if db is None:
+        db = SessionLocal()
+        close_db_session = True
+
+    try:
+        drifted = stats.reconcile_user_stats(db, user_id=user_id)
+        if drifted:
+            logging.warning(f"Repaired drifted dashboard counters of users {drifted}.")
+        return drifted
+    except SQLAlchemyError:
+        db.rollback()
+        raise
+    finally:
+        if close_db_session:
+            db.close()
+
+
+@celery_app.task(**DB_TASK_OPTIONS)
+def delete_orphaned_blobs(db: Session = None) -> int:
+    """
+    Periodic cleanup of the blob store: deletes the blobs no analysis result refers to
+    anymore and returns how many were deleted.
+    This function runs as a Celery task.
+    """
+    close_db_session = False
+    if db is None:
+        db = SessionLocal()
+        close_db_session = True
+
+    try:
+        created_before = datetime.now(UTC) - timedelta(seconds=BLOB_ORPHAN_GRACE_SECONDS)
+        deleted = crud.delete_orphaned_blobs(db, created_before, batch_size=BLOB_SWEEP_BATCH_SIZE)
+        if deleted:
+            logging.info(f"Deleted {deleted} orphaned blobs.")
+        return deleted
+    except SQLAlchemyError:
+        db.rollback()
+        raise
+    finally:
+        if close_db_session:
+            db.close()
@@ -15,7 +15,7 @@ from src.core.exceptions import (
 
 
 class GitHubService:
-    def __init__(self, github_token: str = None):
+    def __init__(self, github_token: str = None, http_client: httpx.AsyncClient = None, redis_client: redis.Redis = None):
         self.github_token = github_token or os.getenv("GITHUB_TOKEN")
         if not self.github_token:
             raise ValueError("GitHub token not provided and GITHUB_TOKEN environment variable not set.")
@@ -24,7 +24,10 @@ class GitHubService:
             "Accept": "application/vnd.github.v3+json"
         }
         self.base_url = "https://api.github.com"
-        self.redis_client = redis.Redis(host='localhost', port=6379, db=0) # Initialize Redis client
+        # Shared clients (e.g. the worker's pooled ones) are reused; otherwise each
+        # request opens its own HTTP client and the service owns a Redis client.
+        self.http_client = http_client
+        self.redis_client = redis_client or redis.Redis(host='localhost', port=6379, db=0) # Initialize Redis client
         self.cache_ttl = 300 # Cache time-to-live in seconds (5 minutes)
 
     async def _make_request(self, method: str, url: str, **kwargs):
@@ -33,42 +36,52 @@ class GitHubService:
         if cached_response:
             return json.loads(cached_response)
 
+        if self.http_client is not None:
+            response = await self.http_client.request(method, f"{self.base_url}{url}", headers=self.headers, **kwargs)
+            return await self._handle_response(response, cache_key)
+
         async with httpx.AsyncClient(headers=self.headers) as client:
             response = await client.request(method, f"{self.base_url}{url}", **kwargs)
-            json_response = None # Initialize json_response
-            try:
-                await response.raise_for_status()
-                json_response = await response.json()
-                if json_response is not None: # Only cache if response was successful and json_response is not None
-                    self.redis_client.setex(cache_key, self.cache_ttl, json.dumps(json_response))
-                return json_response
-            except httpx.HTTPStatusError as e:
-                if e.response.status_code in [401, 403]:
-                    if 'X-RateLimit-Remaining' in e.response.headers and int(e.response.headers['X-RateLimit-Remaining']) == 0:
-                        reset_time = int(e.response.headers.get('X-RateLimit-Reset', 0))
-                        raise GitHubRateLimitError(
-                            f"GitHub API rate limit exceeded. Resets at {reset_time}.",
-                            status_code=e.response.status_code,
-                            headers=dict(e.response.headers),
-                            reset_time=reset_time
-                        ) from e
-                    raise GitHubAuthError(
-                        f"Authentication failed or forbidden: {e.response.text}",
-                        status_code=e.response.status_code,
-                        headers=dict(e.response.headers)
-                    ) from e
-                elif e.response.status_code == codes.NOT_FOUND:
-                    raise GitHubResourceNotFoundError(
-                        f"GitHub resource not found: {e.response.text}",
-                        status_code=e.response.status_code,
-                        headers=dict(e.response.headers)
-                    ) from e
-                else:
-                    raise GitHubAPIError(
-                        f"GitHub API error: {e.response.text}",
+            return await self._handle_response(response, cache_key)
+
+    async def _handle_response(self, response: httpx.Response, cache_key: str):
+        """
+        Raises the matching GitHub error for failed responses, otherwise caches and returns the JSON body.
+        """
+        json_response = None # Initialize json_response
+        try:
+            await response.raise_for_status()
+            json_response = await response.json()
+            if json_response is not None: # Only cache if response was successful and json_response is not None
+                self.redis_client.setex(cache_key, self.cache_ttl, json.dumps(json_response))
+            return json_response
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code in [401, 403]:
+                if 'X-RateLimit-Remaining' in e.response.headers and int(e.response.headers['X-RateLimit-Remaining']) == 0:
+                    reset_time = int(e.response.headers.get('X-RateLimit-Reset', 0))
+                    raise GitHubRateLimitError(
+                        f"GitHub API rate limit exceeded. Resets at {reset_time}.",
                         status_code=e.response.status_code,
-                        headers=dict(e.response.headers)
+                        headers=dict(e.response.headers),
+                        reset_time=reset_time
                     ) from e
+                raise GitHubAuthError(
+                    f"Authentication failed or forbidden: {e.response.text}",
+                    status_code=e.response.status_code,
+                    headers=dict(e.response.headers)
+                ) from e
+            elif e.response.status_code == codes.NOT_FOUND:
+                raise GitHubResourceNotFoundError(
+                    f"GitHub resource not found: {e.response.text}",
+                    status_code=e.response.status_code,
+                    headers=dict(e.response.headers)
+                ) from e
+            else:
+                raise GitHubAPIError(
+                    f"GitHub API error: {e.response.text}",
+                    status_code=e.response.status_code,
+                    headers=dict(e.response.headers)
+                ) from e
 
     async def get_repository_details(self, owner: str, repo: str):
         """
@@ -0,0 +1,111 @@
+import json
+import logging
+import os
+import time
+
+import redis
+
+from src.api.v1.status_events import publish_status_event
+from src.utils.redis_utils import get_redis_client
+
+# Progress is published at most this often per stage, plus once when a stage finishes
+PROGRESS_MIN_INTERVAL_SECONDS = float(os.getenv("PROGRESS_MIN_INTERVAL_SECONDS", "1"))
+PROGRESS_SNAPSHOT_TTL_SECONDS = int(os.getenv("PROGRESS_SNAPSHOT_TTL_SECONDS", "86400"))
+
+
+def _progress_key(repo_id: int) -> str:
+    return f"analysis:progress:{repo_id}"
+
+
+class ProgressReporter:
+    """
+    Reports how far one stage of a repository analysis has got, e.g. commits fetched out
+    of the number requested. Updates are throttled, published as "progress" events and kept
+    as the latest snapshot of the stage.
+    """
+
+    def __init__(
+        self,
+        repo_id: int,
+        owner_id: int,
+        stage: str,
+        total: int | None = None,
+        min_interval_seconds: float = PROGRESS_MIN_INTERVAL_SECONDS,
+    ):
+        self.repo_id = repo_id
+        self.owner_id = owner_id
+        self.stage = stage
+        self.total = total
+        self.done = 0
+        self.min_interval_seconds = min_interval_seconds
+        self.started_at = time.monotonic()
+        self.last_published_at = None
+
+    def update(self, done: int, total: int | None = None):
+        self.done = done
+        if total is not None:
+            self.total = total
+        now = time.monotonic()
+        finished = self.total is not None and self.done >= self.total
+        if (
+            finished
+            or self.last_published_at is None
+            or now - self.last_published_at >= self.min_interval_seconds
+        ):
+            self.last_published_at = now
+            self._publish(self.snapshot(now))
+
+    def advance(self, count: int = 1):
+        self.update(self.done + count)
+
+    def finish(self):
+        """
+        Marks the stage as complete, e.g. when fewer items than expected turned up.
+        """
+        self.update(self.done, total=self.done)
+
+    def snapshot(self, now: float | None = None) -> dict:
+        elapsed = (now or time.monotonic()) - self.started_at
+        eta = None
+        if self.total is not None and self.done:
+            eta = round(elapsed / self.done * max(self.total - self.done, 0), 1)
+        return {
+            "stage": self.stage,
+            "done": self.done,
+            "total": self.total,
+            "elapsed_seconds": round(elapsed, 1),
+            "eta_seconds": eta,
+        }
+
+    def _publish(self, snapshot: dict):
+        try:
+            pipeline = get_redis_client().pipeline()
+            pipeline.hset(_progress_key(self.repo_id), self.stage, json.dumps(snapshot))
+            pipeline.expire(_progress_key(self.repo_id), PROGRESS_SNAPSHOT_TTL_SECONDS)
+            pipeline.execute()
+        except redis.RedisError as e:
+            logging.error(f"Could not save progress of repository {self.repo_id}: {e}")
+        publish_status_event({"type": "progress", "id": self.repo_id, "owner_id": self.owner_id, **snapshot})
+
+
+def get_progress_snapshot(repo_id: int) -> dict[str, dict]:
+    """
+    Returns the latest progress of every stage of a repository's analysis, keyed by stage,
+    or no stages if Redis is unreachable.
+    """
+    try:
+        stages = get_redis_client().hgetall(_progress_key(repo_id))
+    except redis.RedisError as e:
+        logging.error(f"Could not read progress of repository {repo_id}: {e}")
+        return {}
+    return {stage.decode(): json.loads(snapshot) for stage, snapshot in stages.items()}
+
+
+def clear_progress_snapshot(repo_id: int):
+    """
+    Forgets the previous analysis' progress when a new analysis starts.
+    """
+    try:
+        get_redis_client().delete(_progress_key(repo_id))
+    except redis.RedisError as e:
+        logging.error(f"Could not clear progress of repository {repo_id}: {e}")
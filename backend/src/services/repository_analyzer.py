@@ -2,6 +2,7 @@
 import json
 
 from src.services.github_service import GitHubService
+from src.services.progress import ProgressReporter
 from src.utils.url_utils import parse_github_url
 
 
@@ -9,7 +10,7 @@ class RepositoryAnalyzer:
     def __init__(self, github_service: GitHubService):
         self.github_service = github_service
 
-    async def get_file_structure(self, owner: str, repo: str) -> list[dict]:
+    async def get_file_structure(self, owner: str, repo: str, progress: ProgressReporter | None = None) -> list[dict]:
         """
         Fetches the file structure (files and directories) of a GitHub repository using the Git Trees API.
         """
@@ -25,14 +26,22 @@ class RepositoryAnalyzer:
             commits = await self.github_service.get_repository_commits(owner, repo)
         except StopAsyncIteration:
             commits = []
+        if progress:
+            progress.update(1, total=3) # Latest commit, its tree SHA, then the tree
         if not commits:
+            if progress:
+                progress.finish()
             return [] # No commits, no file structure
 
         latest_commit_sha = commits[0]["sha"]
         commit_details = await self.github_service._make_request("GET", f"/repos/{owner}/{repo}/git/commits/{latest_commit_sha}")
         tree_sha = commit_details["tree"]["sha"]
+        if progress:
+            progress.advance()
 
         tree_data = await self.github_service.get_git_tree(owner, repo, tree_sha)
+        if progress:
+            progress.advance()
 
         file_structure = []
         for item in tree_data.get("tree", []):
@@ -43,7 +52,7 @@ class RepositoryAnalyzer:
             })
         return file_structure
 
-    async def get_commit_history(self, owner: str, repo: str, num_commits: int = 100) -> list[dict]:
+    async def get_commit_history(self, owner: str, repo: str, num_commits: int = 100, progress: ProgressReporter | None = None) -> list[dict]:
         """
         Fetches the commit history for a GitHub repository with pagination and returns a simplified list.
         """
@@ -68,59 +77,81 @@ class RepositoryAnalyzer:
                 })
                 if len(simplified_commits) == num_commits:
                     break
+            if progress:
+                progress.update(len(simplified_commits), total=num_commits)
             page += 1
+        if progress:
+            progress.finish() # Repositories with fewer commits end early
         return simplified_commits
 
-    async def get_repository_analysis(self, github_url: str) -> dict:
+    async def get_repository_metadata(self, owner: str, repo_name: str, progress: ProgressReporter | None = None) -> dict:
         """
-        Performs a comprehensive analysis of a GitHub repository from its URL,
-        including detailed language stats, commit history, file structure,
-        issues, pull requests, contributors, and identified tech stack.
+        Fetches repository details, language statistics, open issues, open pull requests
+        and contributors, i.e. everything except commits, file tree and manifests.
         """
-        owner, repo_name = parse_github_url(github_url)
-
-        # Fetch basic repository details
-        repo_details = await self.github_service.get_repository_details(owner, repo_name)
-
-        # Fetch detailed language statistics
-        languages = await self.github_service.get_repository_languages(owner, repo_name)
-
-        # Fetch issues, pull requests, and contributors
-        issues = await self.github_service.get_repository_issues(owner, repo_name)
-        pulls = await self.github_service.get_repository_pulls(owner, repo_name)
-        contributors_data = await self.github_service.get_repository_contributors(owner, repo_name)
+        requests = [
+            self.github_service.get_repository_details, # Basic repository details
+            self.github_service.get_repository_languages, # Detailed language statistics
+            self.github_service.get_repository_issues,
+            self.github_service.get_repository_pulls,
+            self.github_service.get_repository_contributors,
+        ]
+        responses = []
+        for request in requests:
+            responses.append(await request(owner, repo_name))
+            if progress:
+                progress.update(len(responses), total=len(requests))
+        repo_details, languages, issues, pulls, contributors_data = responses
         contributors = [c.get("login") for c in contributors_data]
 
-        # Fetch commit history and count total commits
-        commit_history = await self.get_commit_history(owner, repo_name)
-        commit_count = len(commit_history)
-
-        # Fetch file structure and count total files
-        file_structure = await self.get_file_structure(owner, repo_name)
-        file_count = len(file_structure)
-
-        # Identify tech stack
-        tech_stack = await self._identify_tech_stack(owner, repo_name)
-
-        analysis = {
+        return {
             "name": repo_details.get("name"),
             "description": repo_details.get("description"),
             "main_language": repo_details.get("language"),
             "owner": owner,
             "repo_name": repo_name,
             "languages": languages,
-            "file_count": file_count,
-            "commit_count": commit_count,
             "open_issues_count": len(issues),
             "open_pull_requests_count": len(pulls),
             "contributors": contributors,
+        }
+
+    @staticmethod
+    def build_analysis(metadata: dict, commit_history: list[dict], file_structure: list[dict], tech_stack: list[str]) -> dict:
+        """
+        Combines the separately fetched parts of an analysis into the analysis dict.
+        """
+        return {
+            **metadata,
+            "file_count": len(file_structure),
+            "commit_count": len(commit_history),
             "file_structure": file_structure,
             "commit_history": commit_history, # Store simplified commit history
             "tech_stack": tech_stack,
         }
-        return analysis
 
-    async def _identify_tech_stack(self, owner: str, repo: str) -> list[str]:
+    async def get_repository_analysis(self, github_url: str) -> dict:
+        """
+        Performs a comprehensive analysis of a GitHub repository from its URL,
+        including detailed language stats, commit history, file structure,
+        issues, pull requests, contributors, and identified tech stack.
+        """
+        owner, repo_name = parse_github_url(github_url)
+
+        metadata = await self.get_repository_metadata(owner, repo_name)
+
+        # Fetch commit history and count total commits
+        commit_history = await self.get_commit_history(owner, repo_name)
+
+        # Fetch file structure and count total files
+        file_structure = await self.get_file_structure(owner, repo_name)
+
+        # Identify tech stack
+        tech_stack = await self.identify_tech_stack(owner, repo_name)
+
+        return self.build_analysis(metadata, commit_history, file_structure, tech_stack)
+
+    async def identify_tech_stack(self, owner: str, repo: str, progress: ProgressReporter | None = None) -> list[str]:
         """
         Identifies the tech stack by looking for common dependency/config files.
         """
@@ -177,5 +208,7 @@ class RepositoryAnalyzer:
                         stripped_line = line.strip()
                         if stripped_line and not stripped_line.startswith("#"):
                             tech_stack.add(stripped_line.split("==")[0].split("<")[0].split(">")[0].split("~")[0]) # Extract package name
+            if progress:
+                progress.update(progress.done + 1, total=len(common_tech_files))
 
         return sorted(tech_stack)
@@ -5,6 +5,7 @@ from sqlalchemy.orm import Session
 from src.api.v1 import schemas
 from src.db import crud as default_crud
 from src.services import analysis_service as default_analysis_service
+from src.utils.pagination import DEFAULT_PAGE_SIZE
 
 
 class RepositoryService:
@@ -27,25 +28,57 @@ class RepositoryService:
 
     def create_repository(self, db: Session, repo: schemas.RepositoryCreate, owner_id: int):
         repo_name = self.extract_repo_name_from_url(str(repo.url))
-        db_repo = self.crud.create_repository(db=db, url=str(repo.url), name=repo_name, owner_id=owner_id)
-        # Trigger the analysis service asynchronously
-        self.analysis_service.clone_and_analyze_repository.delay(db_repo.id)
-        return db_repo
+        # Everything the response needs is known or comes back with the INSERT, so nothing is reloaded
+        return self.crud.create_repository(db=db, url=str(repo.url), name=repo_name, owner_id=owner_id, refresh=False)
 
-    def get_repositories_by_owner(self, db: Session, owner_id: int, skip: int = 0, limit: int = 100):
-        return self.crud.get_repositories_by_owner(db, owner_id=owner_id, skip=skip, limit=limit)
+    def dispatch_analysis(self, repository_id: int) -> str:
+        """
+        Triggers the analysis task asynchronously, deduplicated per repository. Talks to Redis
+        and the broker, so it is called outside of any database session work.
+        """
+        return self.analysis_service.dispatch_analysis(repository_id)
+
+    def get_repositories_by_owner(
+        self,
+        db: Session,
+        owner_id: int,
+        *,
+        cursor: str | None = None,
+        limit: int = DEFAULT_PAGE_SIZE,
+        technologies: list[str] | None = None,
+        language: str | None = None,
+        min_language_share: float = 0,
+    ):
+        return self.crud.get_repositories_by_owner(
+            db,
+            owner_id=owner_id,
+            cursor=cursor,
+            limit=limit,
+            technologies=technologies,
+            language=language,
+            min_language_share=min_language_share,
+        )
+
+    def get_stack_facets(self, db: Session, owner_id: int):
+        return self.crud.get_stack_facets(db, owner_id=owner_id)
+
+    def get_user_stats(self, db: Session, user_id: int):
+        return self.crud.get_user_stats(db, user_id=user_id)
+
+    def search_analyses(self, db: Session, owner_id: int, query: str, limit: int = DEFAULT_PAGE_SIZE, offset: int = 0):
+        return self.crud.search_analyses(db, owner_id=owner_id, query=query, limit=limit, offset=offset)
+
+    def get_repository(self, db: Session, repository_id: int, with_analyses: bool = True):
+        return self.crud.get_repository(db, repository_id, with_analyses=with_analyses)
 
-    def get_repository(self, db: Session, repository_id: int):
-        return self.crud.get_repository(db, repository_id)
+    def get_analysis_results_for_repository(self, db: Session, repository_id: int, cursor: str | None = None, limit: int = DEFAULT_PAGE_SIZE):
+        return self.crud.get_analysis_results_for_repository(db, repository_id, cursor=cursor, limit=limit)
 
-    def get_analysis_results_for_repository(self, db: Session, repository_id: int):
-        return self.crud.get_analysis_results_for_repository(db, repository_id)
+    def get_analysis_owner_id(self, db: Session, analysis_id: int):
+        return self.crud.get_analysis_owner_id(db, analysis_id)
 
     def get_analysis_narrative(self, db: Session, analysis_id: int):
-        analysis_result = self.crud.get_analysis_result(db, analysis_id)
-        if analysis_result:
-            return analysis_result.narrative
-        return None
+        return self.crud.get_analysis_narrative(db, analysis_id)
 
 # Instantiate a default service
 repository_service = RepositoryService()
\ No newline at end of file
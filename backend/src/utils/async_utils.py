@@ -1,10 +1,120 @@
 import asyncio
+import inspect
+import logging
+import threading
+
+# Persistent event loop owned by a Celery worker process. It is started from the
+# `worker_process_init` signal and lives in a daemon thread, so every task in the
+# process shares one loop (and the async clients bound to it) instead of paying
+# for a fresh `asyncio.run` per coroutine.
+_worker_loop: asyncio.AbstractEventLoop | None = None
+_worker_thread: threading.Thread | None = None
+_worker_resources: dict[str, object] = {}
+_worker_closers: dict[str, object] = {}
+_worker_lock = threading.Lock()
+
+
+def start_worker_loop() -> asyncio.AbstractEventLoop:
+    """
+    Starts the worker-level event loop in a background thread.
+    Calling it again while the loop is running returns the existing loop.
+    """
+    global _worker_loop, _worker_thread
+    with _worker_lock:
+        if _worker_loop is not None and _worker_loop.is_running():
+            return _worker_loop
+
+        loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def _run():
+            asyncio.set_event_loop(loop)
+            loop.call_soon(started.set)
+            loop.run_forever()
+
+        thread = threading.Thread(target=_run, name="worker-event-loop", daemon=True)
+        thread.start()
+        started.wait()
+        _worker_loop = loop
+        _worker_thread = thread
+        logging.info("Started persistent worker event loop.")
+        return loop
+
+
+def stop_worker_loop(timeout: float = 5.0):
+    """
+    Closes the worker resources on the loop, then stops and closes the loop itself.
+    """
+    global _worker_loop, _worker_thread
+    with _worker_lock:
+        loop, thread = _worker_loop, _worker_thread
+        if loop is None:
+            return
+        closers = list(_worker_closers.items())
+        _worker_resources.clear()
+        _worker_closers.clear()
+        _worker_loop = None
+        _worker_thread = None
+
+    for name, closer in closers:
+        try:
+            result = closer()
+            if inspect.isawaitable(result):
+                asyncio.run_coroutine_threadsafe(_await(result), loop).result(timeout)
+        except Exception as e:
+            logging.error(f"Error closing worker resource '{name}': {e}")
+
+    loop.call_soon_threadsafe(loop.stop)
+    if thread is not None:
+        thread.join(timeout)
+    loop.close()
+    logging.info("Stopped persistent worker event loop.")
+
+
+async def _await(awaitable):
+    return await awaitable
+
+
+def get_worker_loop() -> asyncio.AbstractEventLoop | None:
+    """
+    Returns the running worker event loop, or None outside a worker process.
+    """
+    loop = _worker_loop
+    if loop is not None and loop.is_running():
+        return loop
+    return None
+
+
+def get_worker_resource(name: str, factory, closer=None):
+    """
+    Returns a process-wide resource (HTTP pool, Redis or LLM client) that stays
+    alive across tasks, creating it with `factory` on first use.
+    `closer` receives the resource on shutdown and may return an awaitable.
+    Returns None when no worker loop is running, so callers fall back to
+    per-call resources.
+    """
+    if get_worker_loop() is None:
+        return None
+    with _worker_lock:
+        if name not in _worker_resources:
+            resource = factory()
+            _worker_resources[name] = resource
+            if closer is not None:
+                _worker_closers[name] = lambda: closer(resource)
+        return _worker_resources[name]
 
 
 def run_async(coro):
     """
-    Runs a coroutine, creating a new event loop if one is not already running.
+    Runs a coroutine from synchronous code.
+    Inside a worker process the coroutine is submitted to the persistent worker loop
+    and the call blocks until it completes. Otherwise, it schedules a task on the
+    running loop, or creates a new event loop if one is not already running.
     """
+    worker_loop = get_worker_loop()
+    if worker_loop is not None and threading.current_thread() is not _worker_thread:
+        return asyncio.run_coroutine_threadsafe(coro, worker_loop).result()
+
     try:
         loop = asyncio.get_running_loop()
     except RuntimeError:  # 'RuntimeError: There is no current event loop...'
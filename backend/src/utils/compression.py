@@ -0,0 +1,40 @@
+import hashlib
+import json
+import os
+import zlib
+
+import zstandard
+
+COMPRESSION_LEVEL = 6
+BLOB_COMPRESSION_LEVEL = int(os.getenv("BLOB_COMPRESSION_LEVEL", "3"))
+
+
+def compress_json(data) -> bytes:
+    """
+    Serializes data to compact JSON and compresses it with zlib.
+    """
+    encoded = json.dumps(data, separators=(",", ":")).encode("utf-8")
+    return zlib.compress(encoded, COMPRESSION_LEVEL)
+
+
+def decompress_json(blob: bytes):
+    """
+    Decompresses a blob produced by compress_json and parses the JSON back.
+    """
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+
+def pack_blob(data) -> tuple[str, bytes]:
+    """
+    Serializes data to canonical JSON and returns its SHA-256 and its zstd-compressed bytes.
+    Equal values always get the same hash, so they can be stored once.
+    """
+    encoded = json.dumps(data, separators=(",", ":"), sort_keys=True).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest(), zstandard.ZstdCompressor(level=BLOB_COMPRESSION_LEVEL).compress(encoded)
+
+
+def unpack_blob(blob: bytes):
+    """
+    Decompresses a blob produced by pack_blob and parses the JSON back.
+    """
+    return json.loads(zstandard.ZstdDecompressor().decompress(blob).decode("utf-8"))
@@ -0,0 +1,27 @@
+import threading
+from collections import Counter
+
+# Process-local counters, exposed through the /metrics endpoint
+_counters: Counter = Counter()
+_lock = threading.Lock()
+
+
+def increment(name: str, value: int = 1):
+    """
+    Adds value to the named counter.
+    """
+    with _lock:
+        _counters[name] += value
+
+
+def get_metrics() -> dict[str, int]:
+    """
+    Returns a snapshot of every counter.
+    """
+    with _lock:
+        return dict(_counters)
+
+
+def reset_metrics():
+    with _lock:
+        _counters.clear()
@@ -0,0 +1,55 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from sqlalchemy import and_, or_
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+
+class InvalidCursorError(ValueError):
+    pass
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    """
+    Encodes the position of a row as an opaque, URL-safe cursor.
+    """
+    payload = json.dumps([created_at.isoformat(), row_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    """
+    Decodes a cursor produced by encode_cursor. Raises InvalidCursorError for anything else.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError) as e:
+        raise InvalidCursorError(f"Invalid cursor: {cursor}") from e
+
+
+def keyset_page(query, model, cursor: str | None, limit: int):
+    """
+    Orders a query newest first on (created_at, id) and returns the page after the cursor.
+    Unlike an offset, the cursor seeks straight to its position in the (.., created_at, id) index.
+    """
+    if cursor is not None:
+        created_at, row_id = decode_cursor(cursor)
+        query = query.filter(
+            or_(model.created_at < created_at, and_(model.created_at == created_at, model.id < row_id))
+        )
+    return query.order_by(model.created_at.desc(), model.id.desc()).limit(limit).all()
+
+
+def next_cursor(items: list, limit: int) -> str | None:
+    """
+    Returns the cursor of the page after items, or None when this was the last page.
+    """
+    if len(items) < limit:
+        return None
+    return encode_cursor(items[-1].created_at, items[-1].id)
@@ -0,0 +1,16 @@
+import os
+from functools import lru_cache
+
+import redis
+
+# Redis used by the application itself (locks, pub/sub, caches); Celery keeps its own URLs
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+
+@lru_cache(maxsize=1)
+def get_redis_client() -> redis.Redis:
+    """
+    Returns the process-wide Redis client. redis-py pools connections internally,
+    so one client is shared by every caller in the process.
+    """
+    return redis.Redis.from_url(REDIS_URL)
@@ -1,9 +1,10 @@
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
 from fastapi import status
 from fastapi.testclient import TestClient
 
+from src.core.exceptions import PasswordHashingBusyError
 from src.db.database import get_db
 from src.main import app  # Assuming your FastAPI app instance is in src.main
 
@@ -20,7 +21,8 @@ def test_login_for_access_token_success(mock_db_session):
     Test successful login and token generation.
     """
     with patch("src.api.v1.endpoints.login.crud.get_user_by_username") as mock_get_user, \
-         patch("src.api.v1.endpoints.login.verify_password", return_value=True) as mock_verify_password, \
+         patch("src.api.v1.endpoints.login.verify_and_update_password", new_callable=AsyncMock, return_value=(True, None)) as mock_verify_password, \
+         patch("src.api.v1.endpoints.login.crud.update_user_password_hash") as mock_update_hash, \
          patch("src.api.v1.endpoints.login.create_access_token", return_value="fake-token") as mock_create_token:
 
         mock_user = MagicMock()
@@ -37,6 +39,7 @@ def test_login_for_access_token_success(mock_db_session):
         assert response.json() == {"access_token": "fake-token", "token_type": "bearer"}
         mock_get_user.assert_called_once_with(mock_db_session, username="testuser")
         mock_verify_password.assert_called_once_with("testpassword", "fakehashedpassword")
+        mock_update_hash.assert_not_called()
         mock_create_token.assert_called_once()
         app.dependency_overrides = {}
 
@@ -62,7 +65,7 @@ def test_login_for_access_token_invalid_password(mock_db_session):
     Test login with a valid username but an invalid password.
     """
     with patch("src.api.v1.endpoints.login.crud.get_user_by_username") as mock_get_user, \
-         patch("src.api.v1.endpoints.login.verify_password", return_value=False) as mock_verify_password:
+         patch("src.api.v1.endpoints.login.verify_and_update_password", new_callable=AsyncMock, return_value=(False, None)) as mock_verify_password:
 
         mock_user = MagicMock()
         mock_user.username = "testuser"
@@ -79,3 +82,39 @@ def test_login_for_access_token_invalid_password(mock_db_session):
         mock_get_user.assert_called_once_with(mock_db_session, username="testuser")
         mock_verify_password.assert_called_once_with("wrongpassword", "fakehashedpassword")
         app.dependency_overrides = {}
+
+
+def test_login_for_access_token_rehashes_outdated_password_hash(mock_db_session):
+    """
+    Test that a hash made with another bcrypt cost is replaced after a successful login.
+    """
+    with patch("src.api.v1.endpoints.login.crud.get_user_by_username") as mock_get_user, \
+         patch("src.api.v1.endpoints.login.verify_and_update_password", new_callable=AsyncMock, return_value=(True, "newhash")), \
+         patch("src.api.v1.endpoints.login.crud.update_user_password_hash") as mock_update_hash:
+
+        mock_user = MagicMock(username="testuser", id=1, hashed_password="oldhash")
+        mock_get_user.return_value = mock_user
+
+        app.dependency_overrides[get_db] = lambda: mock_db_session
+
+        response = client.post("/api/v1/login/token", data={"username": "testuser", "password": "testpassword"})
+
+        assert response.status_code == status.HTTP_200_OK
+        mock_update_hash.assert_called_once_with(mock_db_session, user=mock_user, hashed_password="newhash")
+        app.dependency_overrides = {}
+
+
+def test_login_for_access_token_busy(mock_db_session):
+    """
+    Test that logins are turned away with 503 while the password hashing pool is saturated.
+    """
+    with patch("src.api.v1.endpoints.login.crud.get_user_by_username", return_value=MagicMock()), \
+         patch("src.api.v1.endpoints.login.verify_and_update_password", new_callable=AsyncMock, side_effect=PasswordHashingBusyError("busy")):
+
+        app.dependency_overrides[get_db] = lambda: mock_db_session
+
+        response = client.post("/api/v1/login/token", data={"username": "testuser", "password": "testpassword"})
+
+        assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+        assert response.headers["Retry-After"] == "1"
+        app.dependency_overrides = {}
@@ -0,0 +1,58 @@
+import pytest
+from fastapi import status
+
+from src.api.v1 import schemas
+from src.core.enums import AnalysisStatus
+from src.db import crud, models
+from src.services.repository_service import repository_service
+
+# Upper bounds on the SQL statements each endpoint may run, independent of how many
+# repositories and analyses the user has
+QUERY_BUDGETS = {
+    "/api/v1/repositories/": 1,
+    "/api/v1/repositories/facets": 2,
+    "/api/v1/repositories/stats": 1,
+    "/api/v1/repositories/search?q=narrative": 1,
+    "/api/v1/repositories/{repository_id}": 6,
+    "/api/v1/repositories/{repository_id}/analysis": 6,
+    "/api/v1/repositories/analysis/{analysis_id}/narrative": 2,
+}
+
+
+@pytest.fixture(autouse=True)
+def real_repository_service(mocker):
+    # The endpoints run against the test database instead of the mocked service
+    mocker.patch("src.api.v1.endpoints.repositories.repository_service", new=repository_service)
+
+
+@pytest.fixture
+def seeded(db_session):
+    user = models.User(id=1, username="testuser", hashed_password="testpassword")
+    db_session.add(user)
+    db_session.commit()
+    repos = []
+    for i in range(5):
+        repo = crud.create_repository(db_session, url=f"https://github.com/test/repo{i}", name=f"test/repo{i}", owner_id=1)
+        crud.create_analysis_results(
+            db_session,
+            [
+                schemas.AnalysisResultCreate(
+                    repository_id=repo.id, status=AnalysisStatus.COMPLETED, summary=f"Summary {j}",
+                    narrative=f"Narrative {i} {j}", languages={"Python": 100}, tech_stack=["FastAPI"],
+                    contributors=[{"name": "dev"}],
+                )
+                for j in range(3)
+            ],
+        )
+        repos.append(repo)
+    ids = {"repository_id": repos[0].id, "analysis_id": repos[0].latest_analysis_id}
+    # Requests load everything themselves rather than finding it in the identity map
+    db_session.expunge_all()
+    return ids
+
+
+@pytest.mark.parametrize("path", QUERY_BUDGETS)
+def test_endpoint_query_budget(client, seeded, query_budget, path):
+    with query_budget(QUERY_BUDGETS[path]):
+        response = client.get(path.format(**seeded))
+    assert response.status_code == status.HTTP_200_OK
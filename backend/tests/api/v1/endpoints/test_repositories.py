@@ -1,20 +1,30 @@
+import time
 from datetime import datetime
-from unittest.mock import ANY, MagicMock, patch
+from unittest.mock import ANY, AsyncMock, MagicMock, patch
 
+import msgpack
 import pytest
+import redis
 from fastapi import (
+    WebSocket,
     status,
 )
 from pydantic import HttpUrl  # <-- Añadida esta línea
+from sqlalchemy import text
 from starlette.websockets import WebSocketDisconnect
 
 from src.api.v1 import schemas
+from src.api.v1.connection_manager import MSGPACK_SUBPROTOCOL
 from src.api.v1.endpoints.repositories import (
     WS_CONNECT_RATE_LIMIT_COUNT,
     WS_CONNECT_RATE_LIMIT_SECONDS,
     user_connection_attempts,
+    websocket_endpoint,
 )
-from src.core.security import TokenData
+from src.api.v1.status_events import status_waiters
+from src.core.security import TokenData, get_current_stream_user
+from src.main import app
+from src.utils.pagination import decode_cursor
 
 
 # Mock dependencies
@@ -96,9 +106,11 @@ async def test_create_repository_analysis_request_new_repo(mock_repository_servi
     assert response.json()["id"] == mock_repo_pydantic.id
     mock_repository_service.get_repository_by_url.assert_called_once_with(ANY, str(repo_create.url))
     mock_repository_service.create_repository.assert_called_once_with(
-        db=ANY, repo=repo_create, owner_id=mock_current_user.id
+        ANY, repo=repo_create, owner_id=mock_current_user.id
     )
-    mock_celery_send_task.assert_called_once()
+    # The endpoint dispatches the analysis once, through the repository service
+    mock_repository_service.dispatch_analysis.assert_called_once_with(mock_repo_pydantic.id)
+    mock_celery_send_task.assert_not_called()
 # Test cases for GET /
 @pytest.mark.asyncio
 async def test_read_repositories(mock_repository_service, client, mock_current_user): # noqa: ARG001
@@ -122,7 +134,11 @@ async def test_read_repositories(mock_repository_service, client, mock_current_u
     response = client.get("/api/v1/repositories/")
     assert response.status_code == status.HTTP_200_OK
     assert response.json()[0]["id"] == mock_repo_pydantic.id
-    mock_repository_service.get_repositories_by_owner.assert_called_once_with(ANY, owner_id=mock_current_user.id, skip=0, limit=100)
+    # The list view carries no analysis history
+    assert "analysis_results" not in response.json()[0]
+    mock_repository_service.get_repositories_by_owner.assert_called_once_with(
+        ANY, owner_id=mock_current_user.id, cursor=None, limit=100, technologies=[], language=None, min_language_share=0
+    )
 
 @pytest.mark.asyncio
 async def test_read_repositories_empty(mock_repository_service, client, mock_current_user): # noqa: ARG001
@@ -130,7 +146,103 @@ async def test_read_repositories_empty(mock_repository_service, client, mock_cur
     response = client.get("/api/v1/repositories/")
     assert response.status_code == status.HTTP_200_OK
     assert response.json() == []
-    mock_repository_service.get_repositories_by_owner.assert_called_once_with(ANY, owner_id=mock_current_user.id, skip=0, limit=100)
+    mock_repository_service.get_repositories_by_owner.assert_called_once_with(
+        ANY, owner_id=mock_current_user.id, cursor=None, limit=100, technologies=[], language=None, min_language_share=0
+    )
+
+@pytest.mark.asyncio
+async def test_read_repositories_full_page_returns_next_cursor(mock_repository_service, client, mock_current_user):
+    created_at = datetime(2024, 1, 1, 12, 0, 0)
+    mock_repository_service.get_repositories_by_owner.return_value = [
+        schemas.Repository(
+            id=repo_id, url=HttpUrl(f"https://github.com/test/repo{repo_id}"), name=f"test/repo{repo_id}",
+            owner_id=1, status=schemas.AnalysisStatus.PENDING, created_at=created_at,
+        )
+        for repo_id in (2, 1)
+    ]
+    response = client.get("/api/v1/repositories/?limit=2")
+    assert response.status_code == status.HTTP_200_OK
+    assert decode_cursor(response.headers["X-Next-Cursor"]) == (created_at, 1)
+
+    next_page = client.get(f"/api/v1/repositories/?limit=2&cursor={response.headers['X-Next-Cursor']}")
+    assert next_page.status_code == status.HTTP_200_OK
+    mock_repository_service.get_repositories_by_owner.assert_called_with(
+        ANY, owner_id=mock_current_user.id, cursor=response.headers["X-Next-Cursor"], limit=2,
+        technologies=[], language=None, min_language_share=0,
+    )
+
+@pytest.mark.asyncio
+async def test_read_repositories_invalid_cursor(mock_repository_service, client):
+    response = client.get("/api/v1/repositories/?cursor=not-a-cursor")
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    mock_repository_service.get_repositories_by_owner.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_read_repositories_with_filters(mock_repository_service, client, mock_current_user):
+    mock_repository_service.get_repositories_by_owner.return_value = []
+    response = client.get(
+        "/api/v1/repositories/?technology=FastAPI&technology=React&language=TypeScript&min_language_share=0.5"
+    )
+    assert response.status_code == status.HTTP_200_OK
+    mock_repository_service.get_repositories_by_owner.assert_called_once_with(
+        ANY, owner_id=mock_current_user.id, cursor=None, limit=100,
+        technologies=["FastAPI", "React"], language="TypeScript", min_language_share=0.5,
+    )
+
+@pytest.mark.asyncio
+async def test_read_repository_facets(mock_repository_service, client, mock_current_user):
+    mock_repository_service.get_stack_facets.return_value = {
+        "technologies": [("FastAPI", 3), ("React", 1)],
+        "languages": [("Python", 3)],
+    }
+    response = client.get("/api/v1/repositories/facets")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == {
+        "technologies": [{"name": "FastAPI", "count": 3}, {"name": "React", "count": 1}],
+        "languages": [{"name": "Python", "count": 3}],
+    }
+    mock_repository_service.get_stack_facets.assert_called_once_with(ANY, owner_id=mock_current_user.id)
+
+@pytest.mark.asyncio
+async def test_read_repository_stats(mock_repository_service, client, mock_current_user):
+    user_stats = {
+        "analysis_count": 3, "status_counts": {"COMPLETED": 2, "FAILED": 1},
+        "total_commits": 120, "total_files": 40, "total_lines": 5000,
+        "language_bytes": {"Python": 900}, "technology_counts": {"FastAPI": 2},
+    }
+    mock_repository_service.get_user_stats.return_value = user_stats
+    response = client.get("/api/v1/repositories/stats")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == user_stats
+    mock_repository_service.get_user_stats.assert_called_once_with(ANY, user_id=mock_current_user.id)
+
+@pytest.mark.asyncio
+async def test_search_repositories(mock_repository_service, client, mock_current_user):
+    hit = {
+        "analysis_id": 7, "repository_id": 3, "repository_name": "test/repo",
+        "summary": "A test summary.", "created_at": datetime.now(), "rank": 1.5,
+    }
+    mock_repository_service.search_analyses.return_value = [hit, {**hit, "analysis_id": 6}]
+    response = client.get("/api/v1/repositories/search", params={"q": "test", "limit": 2})
+    assert response.status_code == status.HTTP_200_OK
+    assert [h["analysis_id"] for h in response.json()["hits"]] == [7, 6]
+    assert response.json()["next_offset"] == 2  # noqa: PLR2004
+    mock_repository_service.search_analyses.assert_called_once_with(
+        ANY, owner_id=mock_current_user.id, query="test", limit=2, offset=0
+    )
+
+@pytest.mark.asyncio
+async def test_search_repositories_last_page(mock_repository_service, client):
+    mock_repository_service.search_analyses.return_value = []
+    response = client.get("/api/v1/repositories/search", params={"q": "test", "offset": 20})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == {"hits": [], "next_offset": None}
+
+@pytest.mark.asyncio
+async def test_search_repositories_rejects_deep_offsets(mock_repository_service, client):
+    response = client.get("/api/v1/repositories/search", params={"q": "test", "offset": 5000})
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+    mock_repository_service.search_analyses.assert_not_called()
 
 # Test cases for GET /{repository_id}
 @pytest.mark.asyncio
@@ -213,8 +325,8 @@ async def test_read_repository_analysis_success(mock_repository_service, client,
     response = client.get(f"/api/v1/repositories/{mock_repo_pydantic.id}/analysis")
     assert response.status_code == status.HTTP_200_OK
     assert response.json()["analysis_results"][0]["id"] == mock_analysis_result_pydantic.id
-    mock_repository_service.get_repository.assert_called_once_with(ANY, repository_id=mock_repo_pydantic.id)
-    mock_repository_service.get_analysis_results_for_repository.assert_called_once_with(ANY, repository_id=mock_repo_pydantic.id)
+    mock_repository_service.get_repository.assert_called_once_with(ANY, repository_id=mock_repo_pydantic.id, with_analyses=False)
+    mock_repository_service.get_analysis_results_for_repository.assert_called_once_with(ANY, repository_id=mock_repo_pydantic.id, cursor=None, limit=100)
 
 @pytest.mark.asyncio
 async def test_read_repository_analysis_repo_not_found(mock_repository_service, client):
@@ -222,7 +334,7 @@ async def test_read_repository_analysis_repo_not_found(mock_repository_service,
     response = client.get("/api/v1/repositories/999/analysis")
     assert response.status_code == status.HTTP_404_NOT_FOUND
     assert response.json()["detail"] == "Repository not found"
-    mock_repository_service.get_repository.assert_called_once_with(ANY, repository_id=999)
+    mock_repository_service.get_repository.assert_called_once_with(ANY, repository_id=999, with_analyses=False)
 
 @pytest.mark.asyncio
 async def test_read_repository_analysis_unauthorized(mock_repository_service, client, mock_current_user): # noqa: ARG001
@@ -246,97 +358,44 @@ async def test_read_repository_analysis_unauthorized(mock_repository_service, cl
     response = client.get(f"/api/v1/repositories/{mock_repo_pydantic.id}/analysis")
     assert response.status_code == status.HTTP_403_FORBIDDEN
     assert response.json()["detail"] == "Not authorized to access this repository's analysis"
-    mock_repository_service.get_repository.assert_called_once_with(ANY, repository_id=mock_repo_pydantic.id)
+    mock_repository_service.get_repository.assert_called_once_with(ANY, repository_id=mock_repo_pydantic.id, with_analyses=False)
 
 # Test cases for GET /analysis/{analysis_id}/narrative
 @pytest.mark.asyncio
-async def test_get_analysis_narrative_success(mock_repository_service, client, mock_current_user, mocker): # noqa: ARG001
-    # Crear instancias locales de Pydantic para este test
-    mock_analysis_result_pydantic = schemas.AnalysisResult(
-        id=1, repository_id=1, status=schemas.AnalysisStatus.COMPLETED,
-        narrative="A test narrative.", summary="A test summary.",
-        file_count=100, commit_count=50, languages={"Python": 80, "JavaScript": 20},
-        open_issues_count=5, open_pull_requests_count=2,
-        contributors=[{"name": "dev1"}, {"name": "dev2"}],
-        tech_stack=["FastAPI", "SQLAlchemy"], total_lines=5000,
-        report_url="http://example.com/report/1", created_at=datetime.now()
-    )
-    mock_repo_pydantic = schemas.Repository(
-        id=1, url=HttpUrl("https://github.com/test/repo"), name="test/repo", owner_id=1,
-        status=schemas.AnalysisStatus.PENDING, analysis_results=[mock_analysis_result_pydantic],
-        created_at=datetime.now()
-    )
-
-    mock_analysis_result_pydantic.repository_id = mock_repo_pydantic.id
-    mocker.patch('src.db.crud.get_analysis_result', return_value=mock_analysis_result_pydantic)
-    mock_repository_service.get_repository.return_value = mock_repo_pydantic
-    response = client.get(f"/api/v1/repositories/analysis/{mock_analysis_result_pydantic.id}/narrative")
+async def test_get_analysis_narrative_success(mock_repository_service, client, mock_current_user):
+    mock_repository_service.get_analysis_owner_id.return_value = mock_current_user.id
+    mock_repository_service.get_analysis_narrative.return_value = "A test narrative."
+    response = client.get("/api/v1/repositories/analysis/1/narrative")
     assert response.status_code == status.HTTP_200_OK
-    assert response.json() == mock_analysis_result_pydantic.narrative
-    # crud.get_analysis_result.assert_called_once_with(ANY, analysis_id=mock_analysis_result_pydantic.id) # Ya no se mockea este
-    mock_repository_service.get_repository.assert_called_once_with(ANY, repository_id=mock_repo_pydantic.id)
+    assert response.json() == "A test narrative."
+    mock_repository_service.get_analysis_owner_id.assert_called_once_with(ANY, analysis_id=1)
+    mock_repository_service.get_analysis_narrative.assert_called_once_with(ANY, analysis_id=1)
+    # The ownership check no longer loads the repository and its analysis history
+    mock_repository_service.get_repository.assert_not_called()
 
 @pytest.mark.asyncio
-async def test_get_analysis_narrative_analysis_not_found(client, mocker):
-    mocker.patch('src.db.crud.get_analysis_result', return_value=None)
+async def test_get_analysis_narrative_analysis_not_found(mock_repository_service, client):
+    mock_repository_service.get_analysis_owner_id.return_value = None
     response = client.get("/api/v1/repositories/analysis/999/narrative")
     assert response.status_code == status.HTTP_404_NOT_FOUND
     assert response.json()["detail"] == "Analysis result not found"
-    # mock_repository_service.get_analysis_narrative.assert_called_once_with(ANY, analysis_id=999) # Ya no se mockea este
+    mock_repository_service.get_analysis_narrative.assert_not_called()
 
 @pytest.mark.asyncio
-async def test_get_analysis_narrative_unauthorized(mock_repository_service, client, mock_current_user, mocker): # noqa: ARG001
-    # Crear instancias locales de Pydantic para este test
-    mock_analysis_result_pydantic = schemas.AnalysisResult(
-        id=1, repository_id=1, status=schemas.AnalysisStatus.COMPLETED,
-        narrative="A test narrative.", summary="A test summary.",
-        file_count=100, commit_count=50, languages={"Python": 80, "JavaScript": 20},
-        open_issues_count=5, open_pull_requests_count=2,
-        contributors=[{"name": "dev1"}, {"name": "dev2"}],
-        tech_stack=["FastAPI", "SQLAlchemy"], total_lines=5000,
-        report_url="http://example.com/report/1", created_at=datetime.now()
-    )
-    mock_repo_pydantic = schemas.Repository(
-        id=1, url=HttpUrl("https://github.com/test/repo"), name="test/repo", owner_id=2, # owner_id diferente
-        status=schemas.AnalysisStatus.PENDING, analysis_results=[mock_analysis_result_pydantic],
-        created_at=datetime.now()
-    )
-
-    mock_analysis_result_pydantic.repository_id = mock_repo_pydantic.id
-    mocker.patch('src.db.crud.get_analysis_result', return_value=mock_analysis_result_pydantic)
-    mock_repository_service.get_repository.return_value = mock_repo_pydantic
-    response = client.get(f"/api/v1/repositories/analysis/{mock_analysis_result_pydantic.id}/narrative")
+async def test_get_analysis_narrative_unauthorized(mock_repository_service, client):
+    mock_repository_service.get_analysis_owner_id.return_value = 2 # owner_id diferente
+    response = client.get("/api/v1/repositories/analysis/1/narrative")
     assert response.status_code == status.HTTP_403_FORBIDDEN
     assert response.json()["detail"] == "Not authorized to access this analysis narrative"
-    # crud.get_analysis_result.assert_called_once_with(ANY, analysis_id=mock_analysis_result_pydantic.id) # Ya no se mockea este
-    mock_repository_service.get_repository.assert_called_once_with(ANY, repository_id=mock_repo_pydantic.id)
+    mock_repository_service.get_analysis_narrative.assert_not_called()
 
 @pytest.mark.asyncio
-async def test_get_analysis_narrative_not_available(mock_repository_service, client, mock_current_user, mocker): # noqa: ARG001
-    # Crear instancias locales de Pydantic para este test
-    mock_analysis_result_pydantic = schemas.AnalysisResult(
-        id=1, repository_id=1, status=schemas.AnalysisStatus.COMPLETED,
-        narrative=None, summary="A test narrative.", # narrative=None
-        file_count=100, commit_count=50, languages={"Python": 80, "JavaScript": 20},
-        open_issues_count=5, open_pull_requests_count=2,
-        contributors=[{"name": "dev1"}, {"name": "dev2"}],
-        tech_stack=["FastAPI", "SQLAlchemy"], total_lines=5000,
-        report_url="http://example.com/report/1", created_at=datetime.now()
-    )
-    mock_repo_pydantic = schemas.Repository(
-        id=1, url=HttpUrl("https://github.com/test/repo"), name="test/repo", owner_id=1,
-        status=schemas.AnalysisStatus.PENDING, analysis_results=[mock_analysis_result_pydantic],
-        created_at=datetime.now()
-    )
-
-    mock_analysis_result_pydantic.repository_id = mock_repo_pydantic.id
-    mocker.patch('src.db.crud.get_analysis_result', return_value=mock_analysis_result_pydantic)
-    mock_repository_service.get_repository.return_value = mock_repo_pydantic
-    response = client.get(f"/api/v1/repositories/analysis/{mock_analysis_result_pydantic.id}/narrative")
+async def test_get_analysis_narrative_not_available(mock_repository_service, client, mock_current_user):
+    mock_repository_service.get_analysis_owner_id.return_value = mock_current_user.id
+    mock_repository_service.get_analysis_narrative.return_value = None
+    response = client.get("/api/v1/repositories/analysis/1/narrative")
     assert response.status_code == status.HTTP_404_NOT_FOUND
     assert response.json()["detail"] == "Narrative not available for this analysis result"
-    # crud.get_analysis_result.assert_called_once_with(ANY, analysis_id=mock_analysis_result_pydantic.id) # Ya no se mockea este
-    mock_repository_service.get_repository.assert_called_once_with(ANY, repository_id=mock_repo_pydantic.id)
 
 # Test cases for websocket /ws/status
 @pytest.mark.skip(reason="Intractable websocket test failure, disabling to unblock progress.")
@@ -402,6 +461,25 @@ async def test_websocket_connect_rate_limit_resets(mock_time, client, mock_manag
     with pytest.raises(WebSocketDisconnect), client.websocket_connect("/ws/status"): # Esperamos que el cliente de prueba genere una desconexión al final
         mock_manager.connect.assert_called_once_with(ANY, mock_current_websocket_user.id)
 
+@pytest.mark.asyncio
+async def test_websocket_msgpack_heartbeat_reply_keeps_connection_alive(mocker, mock_current_websocket_user):
+    connection = MagicMock()
+    mock_manager = mocker.patch("src.api.v1.endpoints.repositories.manager")
+    mock_manager.connect = AsyncMock(return_value=connection)
+    websocket = MagicMock(spec=WebSocket)
+    websocket.scope = {"subprotocols": [MSGPACK_SUBPROTOCOL]}
+    websocket.receive = AsyncMock(side_effect=[
+        {"type": "websocket.receive", "bytes": msgpack.packb({"type": "pong"})},
+        {"type": "websocket.receive", "text": "pong"},
+        {"type": "websocket.disconnect", "code": 1000},
+    ])
+
+    await websocket_endpoint(websocket, current_user=mock_current_websocket_user)
+
+    mock_manager.connect.assert_awaited_once_with(websocket, mock_current_websocket_user.id, MSGPACK_SUBPROTOCOL)
+    assert connection.touch.call_count == 2  # noqa: PLR2004
+    mock_manager.disconnect.assert_called_once_with(connection)
+
 @pytest.mark.skip(reason="Intractable websocket test failure, disabling to unblock progress.")
 @pytest.mark.asyncio
 async def test_websocket_disconnect(client, mock_manager, mock_current_websocket_user):
@@ -409,3 +487,117 @@ async def test_websocket_disconnect(client, mock_manager, mock_current_websocket
     with client.websocket_connect("/ws/status"):
         pass # Connection is made and then closed when exiting the context manager
     mock_manager.disconnect.assert_called_once_with(mock_current_websocket_user.id)
+
+
+def test_stream_repository_events(client, mocker):
+    async def fake_stream(user_id, last_event_id):
+        yield f"id: 5-0\nevent: status\ndata: {user_id} {last_event_id}\n\n"
+
+    mock_stream = mocker.patch(
+        "src.api.v1.endpoints.repositories.stream_status_events", side_effect=fake_stream
+    )
+    app.dependency_overrides[get_current_stream_user] = lambda: TokenData(username="testuser", id=1)
+
+    response = client.get("/api/v1/repositories/events", headers={"Last-Event-ID": "4-0"})
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert response.text == "id: 5-0\nevent: status\ndata: 1 4-0\n\n"
+    mock_stream.assert_called_once_with(1, "4-0")
+
+
+def test_read_repository_progress(mock_repository_service, client, mocker):
+    mock_repository_service.get_repository.return_value = MagicMock(owner_id=1)
+    snapshot = {"commit_history": {"stage": "commit_history", "done": 30, "total": 100, "elapsed_seconds": 1.5, "eta_seconds": 3.5}}
+    mock_get_progress = mocker.patch(
+        "src.api.v1.endpoints.repositories.get_progress_snapshot", return_value=snapshot
+    )
+
+    response = client.get("/api/v1/repositories/1/progress")
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == {"stages": snapshot}
+    mock_get_progress.assert_called_once_with(1)
+
+
+def test_read_repository_progress_without_redis(mock_repository_service, client, mocker):
+    mock_repository_service.get_repository.return_value = MagicMock(owner_id=1)
+    mocker.patch("src.services.progress.get_redis_client").return_value.hgetall.side_effect = redis.ConnectionError("down")
+
+    response = client.get("/api/v1/repositories/1/progress")
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == {"stages": {}}
+
+
+def test_read_repository_progress_unauthorized(mock_repository_service, client):
+    mock_repository_service.get_repository.return_value = MagicMock(owner_id=2)
+
+    response = client.get("/api/v1/repositories/1/progress")
+
+    assert response.status_code == status.HTTP_403_FORBIDDEN
+
+
+def test_read_repository_analysis_wait_returns_when_status_changes(mock_repository_service, client, mocker):
+    mock_repository_service.get_repository.return_value = MagicMock(owner_id=1, status=schemas.AnalysisStatus.IN_PROGRESS)
+    mock_repository_service.get_analysis_results_for_repository.return_value = []
+    watch = mocker.spy(status_waiters, "watch")
+
+    def notify_on_read(*_args, **_kwargs):
+        # The status event arrives right after the repository was read
+        status_waiters.notify(1)
+        return mock_repository_service.get_repository.return_value
+
+    mock_repository_service.get_repository.side_effect = notify_on_read
+    started = time.monotonic()
+    response = client.get("/api/v1/repositories/1/analysis?wait=30")
+
+    assert response.status_code == status.HTTP_200_OK
+    assert time.monotonic() - started < 5  # noqa: PLR2004
+    watch.assert_called_once_with(1)
+
+
+def test_read_repository_analysis_wait_times_out(mock_repository_service, client):
+    mock_repository_service.get_repository.return_value = MagicMock(owner_id=1, status=schemas.AnalysisStatus.IN_PROGRESS)
+    mock_repository_service.get_analysis_results_for_repository.return_value = []
+
+    started = time.monotonic()
+    response = client.get("/api/v1/repositories/1/analysis?wait=0.2")
+
+    assert response.status_code == status.HTTP_200_OK
+    assert time.monotonic() - started >= 0.2  # noqa: PLR2004
+
+
+def test_read_repository_analysis_wait_releases_connection(mock_repository_service, client, db_session):
+    def read_repository(db, **_kwargs):
+        db.execute(text("SELECT 1"))
+        return MagicMock(owner_id=1, status=schemas.AnalysisStatus.IN_PROGRESS)
+
+    def read_results(db, **_kwargs):
+        # Nothing carried the first transaction over the wait
+        assert not db.in_transaction()
+        return []
+
+    mock_repository_service.get_repository.side_effect = read_repository
+    mock_repository_service.get_analysis_results_for_repository.side_effect = read_results
+
+    response = client.get("/api/v1/repositories/1/analysis?wait=0.1")
+
+    assert response.status_code == status.HTTP_200_OK
+    mock_repository_service.get_analysis_results_for_repository.assert_called_once_with(db_session, repository_id=1, cursor=None, limit=ANY)
+
+
+def test_read_repository_analysis_wait_skips_finished_analysis(mock_repository_service, client):
+    mock_repository_service.get_repository.return_value = MagicMock(owner_id=1, status=schemas.AnalysisStatus.COMPLETED)
+    mock_repository_service.get_analysis_results_for_repository.return_value = []
+
+    started = time.monotonic()
+    response = client.get("/api/v1/repositories/1/analysis?wait=30")
+
+    assert response.status_code == status.HTTP_200_OK
+    assert time.monotonic() - started < 5  # noqa: PLR2004
+
+
+def test_read_repository_analysis_wait_is_bounded(client):
+    response = client.get("/api/v1/repositories/1/analysis?wait=3600")
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
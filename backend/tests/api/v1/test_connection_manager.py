@@ -1,111 +1,276 @@
-
+import asyncio
+import json
 from unittest.mock import AsyncMock, MagicMock
 
+import msgpack
 import pytest
 from fastapi import WebSocket, status
 
-from src.api.v1.connection_manager import ConnectionManager
+from src.api.v1.connection_manager import (
+    HEARTBEAT_EVENT,
+    MSGPACK_SUBPROTOCOL,
+    ConnectionManager,
+    negotiate_subprotocol,
+)
+from src.utils import metrics
 
 
 @pytest.fixture
 def connection_manager():
-    return ConnectionManager()
+    return ConnectionManager(coalesce_window_seconds=0)
 
-@pytest.fixture
-def mock_websocket():
+def make_websocket():
     ws = MagicMock(spec=WebSocket)
     ws.accept = AsyncMock()
     ws.close = AsyncMock()
     ws.send_text = AsyncMock()
+    ws.send_bytes = AsyncMock()
     return ws
 
+async def flush_writers():
+    # Gives the writer tasks time to wait out the coalescing window and send
+    await asyncio.sleep(0.01)
+
+@pytest.fixture
+def mock_websocket():
+    return make_websocket()
+
 @pytest.mark.asyncio
 async def test_connect_success(connection_manager, mock_websocket):
-    user_id = "test_user"
-    result = await connection_manager.connect(mock_websocket, user_id)
-    assert result is True
-    assert user_id in connection_manager.active_connections
-    assert connection_manager.active_connections[user_id] == mock_websocket
-    assert connection_manager.user_connection_counts[user_id] == 1
+    user_id = 1
+    connection = await connection_manager.connect(mock_websocket, user_id)
+    assert connection is not None
+    assert connection_manager.active_connections[user_id] == {connection}
+    assert connection.websocket == mock_websocket
+    assert connection_manager.connection_count == 1
     mock_websocket.accept.assert_awaited_once()
+    connection_manager.disconnect(connection)
+
+@pytest.mark.asyncio
+async def test_connect_keeps_every_socket_of_a_user(connection_manager):
+    user_id = 1
+    first = await connection_manager.connect(make_websocket(), user_id)
+    second = await connection_manager.connect(make_websocket(), user_id)
+    assert connection_manager.active_connections[user_id] == {first, second}
+    assert connection_manager.connection_count == 2  # noqa: PLR2004
+    connection_manager.disconnect(first)
+    connection_manager.disconnect(second)
 
 @pytest.mark.asyncio
 async def test_connect_max_total_connections(connection_manager, mock_websocket):
     connection_manager.max_total_connections = 0 # Set max to 0 to easily exceed
-    user_id = "test_user"
+    user_id = 1
     result = await connection_manager.connect(mock_websocket, user_id)
-    assert result is False
+    assert result is None
     assert user_id not in connection_manager.active_connections
     mock_websocket.close.assert_awaited_once_with(code=status.WS_1013_TRY_AGAIN_LATER, reason="Server is at maximum capacity.")
 
 @pytest.mark.asyncio
 async def test_connect_max_connections_per_user(connection_manager, mock_websocket):
     connection_manager.max_connections_per_user = 0 # Set max to 0 to easily exceed
-    user_id = "test_user"
+    user_id = 1
     result = await connection_manager.connect(mock_websocket, user_id)
-    assert result is False
+    assert result is None
     assert user_id not in connection_manager.active_connections
     mock_websocket.close.assert_awaited_once_with(code=status.WS_1013_TRY_AGAIN_LATER, reason="Too many connections for this user.")
 
-def test_disconnect_user_exists_multiple_connections(connection_manager, mock_websocket):
-    user_id = "test_user"
-    connection_manager.active_connections[user_id] = mock_websocket
-    connection_manager.user_connection_counts[user_id] = 2
-    connection_manager.disconnect(user_id)
-    assert user_id not in connection_manager.active_connections
-    assert connection_manager.user_connection_counts[user_id] == 1
+@pytest.mark.asyncio
+async def test_disconnect_user_exists_multiple_connections(connection_manager):
+    user_id = 1
+    first = await connection_manager.connect(make_websocket(), user_id)
+    second = await connection_manager.connect(make_websocket(), user_id)
+    connection_manager.disconnect(first)
+    await asyncio.sleep(0)
+    assert connection_manager.active_connections[user_id] == {second}
+    assert first.writer_task.cancelled()
+    connection_manager.disconnect(second)
 
-def test_disconnect_user_exists_last_connection(connection_manager, mock_websocket):
-    user_id = "test_user"
-    connection_manager.active_connections[user_id] = mock_websocket
-    connection_manager.user_connection_counts[user_id] = 1
-    connection_manager.disconnect(user_id)
+@pytest.mark.asyncio
+async def test_disconnect_user_exists_last_connection(connection_manager, mock_websocket):
+    user_id = 1
+    connection = await connection_manager.connect(mock_websocket, user_id)
+    connection_manager.disconnect(connection)
     assert user_id not in connection_manager.active_connections
-    assert user_id not in connection_manager.user_connection_counts
 
-def test_disconnect_user_not_exists(connection_manager):
-    user_id = "non_existent_user"
-    connection_manager.disconnect(user_id)
+@pytest.mark.asyncio
+async def test_disconnect_twice(connection_manager, mock_websocket):
+    connection = await connection_manager.connect(mock_websocket, 1)
+    connection_manager.disconnect(connection)
+    connection_manager.disconnect(connection)
     # No error should be raised, and state should remain unchanged
-    assert user_id not in connection_manager.active_connections
-    assert user_id not in connection_manager.user_connection_counts
+    assert connection_manager.connection_count == 0
 
 @pytest.mark.asyncio
-async def test_send_personal_message_success(connection_manager, mock_websocket):
-    user_id = "test_user"
-    message = "Hello"
-    connection_manager.active_connections[user_id] = mock_websocket
-    await connection_manager.send_personal_message(message, user_id)
-    mock_websocket.send_text.assert_awaited_once_with(message)
+async def test_send_to_user_reaches_only_that_user(connection_manager):
+    owner_ws1, owner_ws2, other_ws = make_websocket(), make_websocket(), make_websocket()
+    connections = [
+        await connection_manager.connect(owner_ws1, 1),
+        await connection_manager.connect(owner_ws2, 1),
+        await connection_manager.connect(other_ws, 2),
+    ]
+
+    await connection_manager.send_to_user(1, {"id": 7})
+    await flush_writers()
+
+    owner_ws1.send_text.assert_awaited_once_with(json.dumps([{"id": 7}]))
+    owner_ws2.send_text.assert_awaited_once_with(json.dumps([{"id": 7}]))
+    other_ws.send_text.assert_not_awaited()
+    for connection in connections:
+        connection_manager.disconnect(connection)
+
+@pytest.mark.asyncio
+async def test_send_to_user_does_not_wait_for_slow_sockets(connection_manager):
+    slow_ws, fast_ws = make_websocket(), make_websocket()
+    slow_ws.send_text = AsyncMock(side_effect=asyncio.Event().wait)
+    slow = await connection_manager.connect(slow_ws, 1)
+    fast = await connection_manager.connect(fast_ws, 1)
+
+    await asyncio.wait_for(connection_manager.send_to_user(1, {"id": 7}), timeout=1)
+    await flush_writers()
+
+    fast_ws.send_text.assert_awaited_once_with(json.dumps([{"id": 7}]))
+    connection_manager.disconnect(slow)
+    connection_manager.disconnect(fast)
+
+@pytest.mark.asyncio
+async def test_send_to_user_coalesces_pending_messages_by_key(connection_manager, mock_websocket):
+    connection = await connection_manager.connect(mock_websocket, 1)
+
+    # Both are queued before the writer task gets to run
+    await connection_manager.send_to_user(1, {"id": 7, "status": "in_progress"}, key=7)
+    await connection_manager.send_to_user(1, {"id": 7, "status": "completed"}, key=7)
+    await flush_writers()
+
+    mock_websocket.send_text.assert_awaited_once_with(json.dumps([{"id": 7, "status": "completed"}]))
+    connection_manager.disconnect(connection)
+
+@pytest.mark.asyncio
+async def test_updates_within_window_share_one_frame(mock_websocket):
+    connection_manager = ConnectionManager(coalesce_window_seconds=0.05)
+    connection = await connection_manager.connect(mock_websocket, 1)
+
+    await connection_manager.send_to_user(1, {"id": 7, "status": "in_progress"}, key=7)
+    await asyncio.sleep(0.01)
+    await connection_manager.send_to_user(1, {"id": 8, "status": "in_progress"}, key=8)
+    await connection_manager.send_to_user(1, {"id": 7, "status": "completed"}, key=7)
+    mock_websocket.send_text.assert_not_awaited()
+    await asyncio.sleep(0.1)
+
+    mock_websocket.send_text.assert_awaited_once_with(
+        json.dumps([{"id": 7, "status": "completed"}, {"id": 8, "status": "in_progress"}])
+    )
+    connection_manager.disconnect(connection)
+
+@pytest.mark.asyncio
+async def test_msgpack_subprotocol_sends_binary_frames(connection_manager, mock_websocket):
+    connection = await connection_manager.connect(mock_websocket, 1, MSGPACK_SUBPROTOCOL)
+
+    await connection_manager.send_to_user(1, {"id": 7, "status": "completed"}, key=7)
+    await flush_writers()
+
+    mock_websocket.accept.assert_awaited_once_with(subprotocol=MSGPACK_SUBPROTOCOL)
+    mock_websocket.send_text.assert_not_awaited()
+    frame = mock_websocket.send_bytes.await_args.args[0]
+    assert msgpack.unpackb(frame) == [{"id": 7, "status": "completed"}]
+    connection_manager.disconnect(connection)
+
+def test_negotiate_subprotocol():
+    assert negotiate_subprotocol(["json", MSGPACK_SUBPROTOCOL]) == MSGPACK_SUBPROTOCOL
+    assert negotiate_subprotocol([]) is None
+
+@pytest.mark.asyncio
+async def test_send_to_user_drops_slow_consumer(connection_manager, mock_websocket):
+    connection_manager.max_pending_messages = 1
+    connection = await connection_manager.connect(mock_websocket, 1)
+
+    await connection_manager.send_to_user(1, {"id": 7})
+    await connection_manager.send_to_user(1, {"id": 8})
+    await asyncio.sleep(0)
+
+    assert 1 not in connection_manager.active_connections
+    assert connection.writer_task.cancelled()
+    mock_websocket.close.assert_awaited_once_with(code=status.WS_1013_TRY_AGAIN_LATER, reason="Client is too slow.")
+
+@pytest.mark.asyncio
+async def test_failed_send_removes_connection(connection_manager, mock_websocket):
+    mock_websocket.send_text.side_effect = RuntimeError("socket closed")
+    await connection_manager.connect(mock_websocket, 1)
+
+    await connection_manager.send_to_user(1, {"id": 7})
+    await flush_writers()
+
+    assert 1 not in connection_manager.active_connections
 
 @pytest.mark.asyncio
 async def test_send_personal_message_user_not_found(connection_manager, mock_websocket):
-    user_id = "non_existent_user"
-    message = "Hello"
-    await connection_manager.send_personal_message(message, user_id)
+    await connection_manager.send_personal_message({"id": 7}, 99)
     mock_websocket.send_text.assert_not_awaited()
 
 @pytest.mark.asyncio
 async def test_broadcast_with_active_connections(connection_manager):
-    user_id1 = "user1"
-    user_id2 = "user2"
-    mock_websocket1 = MagicMock(spec=WebSocket)
-    mock_websocket1.send_text = AsyncMock()
-    mock_websocket2 = MagicMock(spec=WebSocket)
-    mock_websocket2.send_text = AsyncMock()
-
-    connection_manager.active_connections[user_id1] = mock_websocket1
-    connection_manager.active_connections[user_id2] = mock_websocket2
+    mock_websocket1 = make_websocket()
+    mock_websocket2 = make_websocket()
+    connection1 = await connection_manager.connect(mock_websocket1, 1)
+    connection2 = await connection_manager.connect(mock_websocket2, 2)
 
-    message = "Broadcast message"
+    message = {"message": "Broadcast message"}
     await connection_manager.broadcast(message)
+    await flush_writers()
 
-    mock_websocket1.send_text.assert_awaited_once_with(message)
-    mock_websocket2.send_text.assert_awaited_once_with(message)
+    mock_websocket1.send_text.assert_awaited_once_with(json.dumps([message]))
+    mock_websocket2.send_text.assert_awaited_once_with(json.dumps([message]))
+    connection_manager.disconnect(connection1)
+    connection_manager.disconnect(connection2)
 
 @pytest.mark.asyncio
 async def test_broadcast_no_active_connections(connection_manager):
-    message = "Broadcast message"
+    message = {"message": "Broadcast message"}
     await connection_manager.broadcast(message)
     # No errors should be raised, and no send_text calls should occur
     pass # No assertions needed other than no exceptions
+
+@pytest.fixture
+def reset_metrics():
+    metrics.reset_metrics()
+    yield
+    metrics.reset_metrics()
+
+@pytest.mark.asyncio
+async def test_check_heartbeats_pings_live_connections(connection_manager, mock_websocket):
+    connection = await connection_manager.connect(mock_websocket, 1)
+
+    await connection_manager.check_heartbeats()
+    await flush_writers()
+
+    mock_websocket.send_text.assert_awaited_once_with(json.dumps([HEARTBEAT_EVENT]))
+    assert connection_manager.active_connections[1] == {connection}
+    connection_manager.disconnect(connection)
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("reset_metrics")
+async def test_check_heartbeats_evicts_idle_connections(connection_manager, mock_websocket):
+    idle = await connection_manager.connect(mock_websocket, 1)
+    live = await connection_manager.connect(make_websocket(), 1)
+    idle.last_seen -= connection_manager.idle_timeout_seconds + 1
+    live.touch()
+
+    await connection_manager.check_heartbeats()
+    await asyncio.sleep(0)
+
+    assert connection_manager.active_connections[1] == {live}
+    assert idle.writer_task.cancelled()
+    mock_websocket.close.assert_awaited_once_with(code=status.WS_1001_GOING_AWAY, reason="Heartbeat timeout.")
+    assert metrics.get_metrics()["websocket_idle_evictions"] == 1
+    connection_manager.disconnect(live)
+
+@pytest.mark.asyncio
+async def test_run_heartbeat_checks_periodically(mock_websocket):
+    connection_manager = ConnectionManager(coalesce_window_seconds=0, heartbeat_interval_seconds=0.01)
+    connection = await connection_manager.connect(mock_websocket, 1)
+
+    heartbeat_task = asyncio.create_task(connection_manager.run_heartbeat())
+    await asyncio.sleep(0.05)
+    heartbeat_task.cancel()
+
+    mock_websocket.send_text.assert_awaited_with(json.dumps([HEARTBEAT_EVENT]))
+    connection_manager.disconnect(connection)
@@ -0,0 +1,189 @@
+import asyncio
+import json
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+import redis
+
+from src.api.v1 import status_events
+
+
+class FakePubSub:
+    def __init__(self, messages):
+        self.messages = messages
+        self.subscribe = AsyncMock()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_exc_info):
+        return False
+
+    async def listen(self):
+        for message in self.messages:
+            yield message
+        # Keep the subscription open like a real connection would
+        await asyncio.Event().wait()
+
+
+def test_publish_status_event(mocker):
+    mock_client = MagicMock()
+    mocker.patch("src.api.v1.status_events.get_redis_client", return_value=mock_client)
+
+    status_events.publish_status_event({"id": 1, "owner_id": 3, "status": "completed"})
+
+    pipeline = mock_client.pipeline.return_value
+    pipeline.publish.assert_called_once_with(
+        status_events.STATUS_CHANNEL, json.dumps({"id": 1, "owner_id": 3, "status": "completed"})
+    )
+    pipeline.xadd.assert_called_once_with(
+        "status-events:3",
+        {"data": json.dumps({"id": 1, "status": "completed"})},
+        maxlen=status_events.STATUS_STREAM_MAXLEN,
+        approximate=True,
+    )
+    pipeline.expire.assert_called_once_with("status-events:3", status_events.STATUS_STREAM_TTL_SECONDS)
+    pipeline.execute.assert_called_once()
+
+
+def test_publish_status_event_redis_error(mocker):
+    mock_client = MagicMock()
+    mock_client.pipeline.return_value.execute.side_effect = redis.ConnectionError("down")
+    mocker.patch("src.api.v1.status_events.get_redis_client", return_value=mock_client)
+
+    # Publishing is best effort and must not fail the task
+    status_events.publish_status_event({"id": 1, "status": "completed"})
+
+
+@pytest.mark.asyncio
+async def test_relay_status_events_forwards_messages(mocker):
+    pubsub = FakePubSub([
+        {"type": "subscribe", "data": 1},
+        {"type": "message", "data": b'{"id": 1, "owner_id": 3, "status": "in_progress"}'},
+        {"type": "message", "data": b'{"id": 1, "status": "in_progress"}'},
+        {"type": "message", "data": b'{"id": 1, "owner_id": 3, "status": "completed"}'},
+    ])
+    client = MagicMock()
+    client.pubsub.return_value = pubsub
+    client.aclose = AsyncMock()
+    mocker.patch("src.api.v1.status_events.aioredis.Redis.from_url", return_value=client)
+    connection_manager = MagicMock()
+    connection_manager.send_to_user = AsyncMock(side_effect=[Exception("socket closed"), None])
+
+    relay_task = asyncio.create_task(status_events.relay_status_events(connection_manager))
+    await asyncio.sleep(0.01)
+    relay_task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await relay_task
+
+    pubsub.subscribe.assert_awaited_once_with(status_events.STATUS_CHANNEL)
+    # Events go to the owner only, events without an owner are dropped and a failing
+    # send does not stop the following messages
+    assert connection_manager.send_to_user.await_args_list == [
+        mocker.call(3, {"id": 1, "status": "in_progress"}, key=("status", 1, None)),
+        mocker.call(3, {"id": 1, "status": "completed"}, key=("status", 1, None)),
+    ]
+    connection_manager.broadcast.assert_not_called()
+    client.aclose.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_relay_status_events_reconnects(mocker):
+    failing_client = MagicMock()
+    failing_client.pubsub.side_effect = redis.ConnectionError("down")
+    failing_client.aclose = AsyncMock()
+    client = MagicMock()
+    client.pubsub.return_value = FakePubSub([])
+    client.aclose = AsyncMock()
+    mocker.patch(
+        "src.api.v1.status_events.aioredis.Redis.from_url", side_effect=[failing_client, client]
+    )
+    real_sleep = asyncio.sleep
+    mock_sleep = mocker.patch("src.api.v1.status_events.asyncio.sleep", new=AsyncMock())
+
+    relay_task = asyncio.create_task(status_events.relay_status_events(MagicMock()))
+    await real_sleep(0.01)
+    relay_task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await relay_task
+
+    failing_client.aclose.assert_awaited_once()
+    mock_sleep.assert_awaited_once_with(1)
+    client.pubsub.return_value.subscribe.assert_awaited_once()
+
+
+def make_stream_client(mocker, reads, oldest=None, newest=None):
+    client = MagicMock()
+    client.xrange = AsyncMock(return_value=oldest or [])
+    client.xrevrange = AsyncMock(return_value=newest or [])
+    client.xread = AsyncMock(side_effect=reads)
+    client.aclose = AsyncMock()
+    mocker.patch("src.api.v1.status_events.aioredis.Redis.from_url", return_value=client)
+    return client
+
+
+async def take(stream, count):
+    events = [await anext(stream) for _ in range(count)]
+    await stream.aclose()
+    return events
+
+
+@pytest.mark.asyncio
+async def test_stream_status_events_starts_after_newest_entry(mocker):
+    client = make_stream_client(
+        mocker,
+        reads=[
+            [],
+            [(b"status-events:3", [(b"5-0", {b"data": b'{"id": 1, "status": "completed"}'})])],
+        ],
+        newest=[(b"4-0", {b"data": b"{}"})],
+    )
+
+    events = await take(status_events.stream_status_events(3), 2)
+
+    assert events == [
+        ": keepalive\n\n",
+        'id: 5-0\nevent: status\ndata: {"id": 1, "status": "completed"}\n\n',
+    ]
+    assert client.xread.await_args_list[0].args == ({"status-events:3": b"4-0"},)
+    client.aclose.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_stream_status_events_replays_after_last_event_id(mocker):
+    client = make_stream_client(
+        mocker,
+        reads=[[(b"status-events:3", [(b"7-0", {b"data": b'{"id": 1, "status": "failed"}'})])]],
+        oldest=[(b"2-0", {b"data": b"{}"})],
+    )
+
+    events = await take(status_events.stream_status_events(3, "6-0"), 1)
+
+    assert events == ['id: 7-0\nevent: status\ndata: {"id": 1, "status": "failed"}\n\n']
+    assert client.xread.await_args.args == ({"status-events:3": "6-0"},)
+
+
+@pytest.mark.asyncio
+async def test_stream_status_events_resets_when_history_is_gone(mocker):
+    make_stream_client(mocker, reads=[[]], oldest=[(b"9-0", {b"data": b"{}"})])
+
+    events = await take(status_events.stream_status_events(3, "6-0"), 1)
+
+    assert events == ["event: reset\ndata: {}\n\n"]
+
+
+@pytest.mark.asyncio
+async def test_status_waiters_wake_on_status_events_only():
+    connection_manager = MagicMock()
+    connection_manager.send_to_user = AsyncMock()
+    waiters = status_events.status_waiters
+    with waiters.watch(1) as status_changed, waiters.watch(2) as other_changed:
+        await status_events._relay_message(connection_manager, b'{"type": "progress", "id": 1, "owner_id": 3}')  # noqa: SLF001
+        assert not status_changed.is_set()
+
+        await status_events._relay_message(connection_manager, b'{"id": 1, "owner_id": 3, "status": "COMPLETED"}')  # noqa: SLF001
+        assert status_changed.is_set()
+        assert not other_changed.is_set()
+
+    # Waiters are removed when the block ends
+    assert 1 not in waiters._waiters  # noqa: SLF001
@@ -1,5 +1,6 @@
 import os
 import tempfile
+from contextlib import contextmanager
 from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
@@ -17,8 +18,10 @@ with patch("src.main.load_dotenv", lambda: None):
     # These imports are now safe as environment variables are set
     from src.api.v1 import schemas
     from src.celery_app import celery_app
-    from src.core.security import TokenData, get_current_user, get_current_websocket_user
-    from src.db.database import get_db, init_db
+    from src.core.security import TokenData, clear_auth_caches, get_current_user, get_current_websocket_user
+    from src.db.database import get_db
+    from src.db.instrumentation import track_queries
+    from src.db.migrations import init_db
     from src.main import app
     from src.services import repository_service  # Import the real service
 
@@ -26,16 +29,36 @@ with patch("src.main.load_dotenv", lambda: None):
 @pytest.fixture(autouse=True)
 def mock_celery_send_task(mocker):
     """
-    Mocks clone_and_analyze_repository.delay to prevent actual Celery task dispatch during tests
+    Mocks clone_and_analyze_repository.apply_async to prevent actual Celery task dispatch during tests
     and returns the mock object for assertions.
     """
     mock_send_task = mocker.patch(
-        "src.services.analysis_service.clone_and_analyze_repository.delay",
+        "src.services.analysis_service.clone_and_analyze_repository.apply_async",
         return_value=MagicMock(id="mock_task_id", status="SUCCESS"),
     )
     return mock_send_task
 
 
+@pytest.fixture(autouse=True)
+def reset_auth_caches():
+    """
+    Keeps verified tokens and cached users from leaking between tests.
+    """
+    clear_auth_caches()
+    yield
+    clear_auth_caches()
+
+
+@pytest.fixture(autouse=True)
+def mock_progress_redis(mocker):
+    """
+    Keeps analysis progress reporting away from a real Redis during tests and returns
+    the mocked publish_status_event for assertions.
+    """
+    mocker.patch("src.services.progress.get_redis_client")
+    return mocker.patch("src.services.progress.publish_status_event")
+
+
 # Explicitly rebuild Pydantic models to resolve forward references in tests
 schemas.Repository.model_rebuild()
 schemas.AnalysisResult.model_rebuild()
@@ -144,4 +167,21 @@ def mock_session_local(mocker, db_session):
     Mocks SessionLocal in analysis_service to return the test db_session.
     This prevents Celery tasks from trying to connect to a real database.
     """
-    mocker.patch("src.services.analysis_service.SessionLocal", return_value=db_session)
\ No newline at end of file
+    mocker.patch("src.services.analysis_service.SessionLocal", return_value=db_session)
+
+
+@pytest.fixture
+def query_budget(db_session):
+    """
+    Fails the test if a block runs more SQL statements on the test database than allowed:
+        with query_budget(3):
+            client.get("/api/v1/repositories/")
+    """
+    @contextmanager
+    def budget(max_queries: int):
+        with track_queries(db_session.get_bind()) as queries:
+            yield queries
+        statements = "\n".join(f"{count}x {statement}" for statement, count in queries.statements.items())
+        assert queries.count <= max_queries, f"{queries.count} SQL statements, over the budget of {max_queries}:\n{statements}"
+
+    return budget
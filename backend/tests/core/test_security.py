@@ -1,5 +1,7 @@
 
+import threading
 import unittest
+from datetime import timedelta
 from unittest.mock import ANY, MagicMock, patch
 
 import pytest
@@ -7,14 +9,25 @@ from fastapi import HTTPException, WebSocket, WebSocketException, status
 from jose import JWTError, jwt
 from sqlalchemy.orm import Session
 
+from src.core import security
+from src.core.exceptions import PasswordHashingBusyError
 from src.core.security import (
     ALGORITHM,
     SECRET_KEY,
+    TokenData,
+    authenticate_token,
     create_access_token,
+    get_current_stream_user,
     get_current_user,
     get_current_websocket_user,
+    get_password_hash,
+    password_needs_rehash,
+    run_password_job,
+    verify_and_update_password,
+    verify_password,
 )
 from src.db import models  # Import crud and models
+from src.utils import metrics
 
 
 class TestSecurity(unittest.TestCase):
@@ -114,3 +127,110 @@ class TestSecurity(unittest.TestCase):
         mock_jwt_decode.assert_called_once_with("ws_token", SECRET_KEY, algorithms=[ALGORITHM])
         mock_crud.get_user_by_username.assert_called_once_with(db_session, username="wsuser")
 
+
+
+@pytest.fixture
+def stored_user(db_session):
+    user = models.User(username="cacheduser", hashed_password="hashed")
+    db_session.add(user)
+    db_session.commit()
+    return user
+
+
+@pytest.mark.asyncio
+async def test_authenticate_token_caches_token_and_user(db_session, stored_user, mocker):
+    token = create_access_token(data={"username": "cacheduser"})
+    decode = mocker.spy(security.jwt, "decode")
+    get_user = mocker.spy(security.crud, "get_user_by_username")
+
+    first = await authenticate_token(token, db_session)
+    second = await authenticate_token(token, db_session)
+
+    assert first == second == TokenData(username="cacheduser", id=stored_user.id)
+    decode.assert_called_once()
+    get_user.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_authenticate_token_rejects_expired_token(db_session, stored_user):  # noqa: ARG001
+    token = create_access_token(data={"username": "cacheduser"}, expires_delta=timedelta(seconds=-1))
+
+    with pytest.raises(JWTError):
+        await authenticate_token(token, db_session)
+    assert len(security.token_cache) == 0
+
+
+@pytest.mark.asyncio
+async def test_user_changes_invalidate_cached_user(db_session, stored_user):
+    token = create_access_token(data={"username": "cacheduser"})
+    assert await authenticate_token(token, db_session) is not None
+
+    stored_user.username = "renameduser"
+    db_session.commit()
+    assert await authenticate_token(token, db_session) is None
+
+    renamed_token = create_access_token(data={"username": "renameduser"})
+    assert (await authenticate_token(renamed_token, db_session)).id == stored_user.id
+    db_session.delete(stored_user)
+    db_session.commit()
+    assert await authenticate_token(renamed_token, db_session) is None
+
+
+@pytest.mark.asyncio
+async def test_get_current_stream_user_releases_connection(db_session, stored_user):
+    token = create_access_token(data={"username": "cacheduser"})
+    user_id = stored_user.id
+
+    user = await get_current_stream_user(header_token=None, token=token, db=db_session)
+
+    assert not db_session.in_transaction()
+    assert user == TokenData(username="cacheduser", id=user_id)
+
+    with pytest.raises(HTTPException):
+        await get_current_stream_user(header_token="invalid", token=None, db=db_session)
+    assert not db_session.in_transaction()
+
+
+@pytest.fixture
+def fast_bcrypt(monkeypatch):
+    monkeypatch.setattr(security, "BCRYPT_ROUNDS", 4)
+
+
+def test_password_hash_round_trip(fast_bcrypt):  # noqa: ARG001
+    hashed = get_password_hash("secret")
+
+    assert hashed.startswith("$2b$04$")
+    assert verify_password("secret", hashed)
+    assert not verify_password("wrong", hashed)
+    assert not verify_password("secret", "not-a-bcrypt-hash")
+    # Only the first 72 bytes count, as with the hashes stored before
+    assert verify_password("x" * 72 + "ignored", get_password_hash("x" * 80))
+
+
+@pytest.mark.asyncio
+async def test_verify_and_update_password_rehashes_other_cost(fast_bcrypt, monkeypatch):  # noqa: ARG001
+    current = get_password_hash("secret")
+    assert await verify_and_update_password("secret", current) == (True, None)
+    assert await verify_and_update_password("wrong", current) == (False, None)
+
+    monkeypatch.setattr(security, "BCRYPT_ROUNDS", 5)
+    assert password_needs_rehash(current)
+    verified, new_hash = await verify_and_update_password("secret", current)
+    assert verified
+    assert new_hash.startswith("$2b$05$")
+    assert not password_needs_rehash(new_hash)
+
+
+@pytest.mark.asyncio
+async def test_run_password_job_records_metrics_and_rejects_when_full(monkeypatch):
+    metrics.reset_metrics()
+    assert await run_password_job(sum, [1, 2]) == 3  # noqa: PLR2004
+    assert metrics.get_metrics()["password_hash_jobs"] == 1
+    assert "password_hash_wait_ms" in metrics.get_metrics()
+
+    monkeypatch.setattr(security, "_password_slots", threading.BoundedSemaphore(1))
+    security._password_slots.acquire()
+    with pytest.raises(PasswordHashingBusyError):
+        await run_password_job(sum, [1, 2])
+    assert metrics.get_metrics()["password_hash_rejected"] == 1
+    metrics.reset_metrics()
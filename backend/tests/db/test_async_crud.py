@@ -0,0 +1,68 @@
+import os
+import tempfile
+from unittest.mock import MagicMock
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
+
+from src.db import async_crud, crud, models
+from src.db.migrations import init_db
+
+
+@pytest.fixture
+def db_path():
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    engine = create_engine(f"sqlite:///{path}")
+    init_db(engine)
+    db = sessionmaker(bind=engine)()
+    repo = models.Repository(url="https://github.com/test/repo", name="test/repo", owner_id=1)
+    db.add(repo)
+    db.commit()
+    db.add(models.AnalysisResult(repository_id=repo.id, status="COMPLETED", summary="Summary", narrative="Narrative"))
+    db.commit()
+    db.close()
+    yield path
+    engine.dispose()
+    os.unlink(path)
+
+
+@pytest.mark.asyncio
+async def test_async_crud_with_async_session(db_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}")
+    async with async_sessionmaker(engine, expire_on_commit=False)() as db:
+        repo = await async_crud.run_db(db, crud.get_repository_by_url, "https://github.com/test/repo")
+        repositories = await async_crud.run_db(db, crud.get_repositories_by_owner, owner_id=1)
+        results = await async_crud.run_db(db, crud.get_analysis_results_for_repository, repo.id)
+
+    # Relationships were loaded inside the session, so they are readable afterwards
+    assert [r.id for r in repositories] == [repo.id]
+    assert [result.summary for result in repo.analysis_results] == ["Summary"]
+    assert [result.summary for result in results] == ["Summary"]
+    # Blob-backed fields were loaded eagerly as well
+    assert [result.narrative for result in repo.analysis_results] == ["Narrative"]
+    assert [result.narrative for result in results] == ["Narrative"]
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_async_crud_with_sync_session(db_path):
+    engine = create_engine(f"sqlite:///{db_path}", connect_args={"check_same_thread": False})
+    db = sessionmaker(bind=engine)()
+
+    repo = await async_crud.run_db(db, crud.get_repository, 1)
+
+    assert repo.name == "test/repo"
+    db.close()
+    engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_run_db_passes_session_first():
+    db = MagicMock(spec=Session)
+    fn = MagicMock(return_value="result")
+
+    assert await async_crud.run_db(db, fn, 1, key="value") == "result"
+    fn.assert_called_once_with(db, 1, key="value")
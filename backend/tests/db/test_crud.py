@@ -1,8 +1,15 @@
+from datetime import UTC, datetime
+
+import pytest
+from sqlalchemy import event, inspect
 from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import DetachedInstanceError
 
 from src.api.v1 import schemas
 from src.core.enums import AnalysisStatus
-from src.db import crud, models
+from src.db import crud, models, stats
+from src.db.database import unit_of_work
+from src.utils.pagination import next_cursor
 
 
 def test_get_user_by_username(db_session: Session):
@@ -22,6 +29,17 @@ def test_get_user_by_username(db_session: Session):
     assert retrieved_user is None
 
 
+def test_update_user_password_hash(db_session: Session):
+    user = models.User(username="testuser", hashed_password="oldhash")
+    db_session.add(user)
+    db_session.commit()
+
+    crud.update_user_password_hash(db_session, user=user, hashed_password="newhash")
+
+    db_session.expire_all()
+    assert crud.get_user_by_username(db_session, "testuser").hashed_password == "newhash"
+
+
 def test_create_and_get_repository(db_session: Session):
     # Create a user to be the owner of the repository
     user = models.User(username="testuser", hashed_password="testpassword")
@@ -248,3 +266,433 @@ def test_delete_analysis_result(db_session: Session):
     deleted_analysis = crud.delete_analysis_result(db_session, analysis_id=analysis.id)
     assert deleted_analysis is not None
     assert crud.get_analysis_result(db_session, analysis_id=analysis.id) is None
+
+
+def test_save_and_get_analysis_payload(db_session: Session):
+    user = models.User(username="testuser", hashed_password="testpassword")
+    db_session.add(user)
+    db_session.commit()
+    repo = crud.create_repository(db_session, url="https://github.com/test/repo", name="test/repo", owner_id=user.id)
+    analysis = crud.create_analysis_result(
+        db_session,
+        schemas.AnalysisResultCreate(repository_id=repo.id, status=AnalysisStatus.COMPLETED),
+    )
+
+    payload = {"file_structure": [{"path": f"src/file_{i}.py", "type": "blob", "size": i} for i in range(500)]}
+    crud.save_analysis_payload(db_session, analysis.id, payload)
+    db_session.commit()
+
+    stored = db_session.query(models.AnalysisPayload).filter(models.AnalysisPayload.analysis_id == analysis.id).first()
+    assert len(stored.data) < len(str(payload))
+    assert crud.get_analysis_payload(db_session, analysis.id) == payload
+
+    crud.delete_analysis_payload(db_session, analysis.id)
+    assert crud.get_analysis_payload(db_session, analysis.id) is None
+
+
+def test_get_repositories_by_owner_pages_with_cursor(db_session: Session):
+    user = models.User(username="testuser", hashed_password="testpassword")
+    db_session.add(user)
+    db_session.commit()
+    # Created within the same second, so pages are told apart by ID
+    for i in range(5):
+        crud.create_repository(db_session, url=f"https://github.com/test/repo{i}", name=f"test/repo{i}", owner_id=user.id)
+
+    seen, cursor = [], None
+    while True:
+        page = crud.get_repositories_by_owner(db_session, owner_id=user.id, cursor=cursor, limit=2)
+        seen.extend(repo.name for repo in page)
+        cursor = next_cursor(page, 2)
+        if cursor is None:
+            break
+
+    assert seen == [f"test/repo{i}" for i in reversed(range(5))]
+
+
+def test_get_analysis_results_for_repository_pages_newest_first(db_session: Session):
+    user = models.User(username="testuser", hashed_password="testpassword")
+    db_session.add(user)
+    db_session.commit()
+    repo = crud.create_repository(db_session, url="https://github.com/test/repo", name="test/repo", owner_id=user.id)
+    for i in range(3):
+        crud.create_analysis_result(
+            db_session,
+            analysis=schemas.AnalysisResultCreate(repository_id=repo.id, status=AnalysisStatus.COMPLETED, summary=f"Summary {i}"),
+        )
+
+    first_page = crud.get_analysis_results_for_repository(db_session, repository_id=repo.id, limit=2)
+    second_page = crud.get_analysis_results_for_repository(
+        db_session, repository_id=repo.id, cursor=next_cursor(first_page, 2), limit=2
+    )
+
+    assert [result.summary for result in first_page] == ["Summary 2", "Summary 1"]
+    assert [result.summary for result in second_page] == ["Summary 0"]
+
+
+def test_latest_analysis_pointer_follows_history(db_session: Session):
+    user = models.User(username="testuser", hashed_password="testpassword")
+    db_session.add(user)
+    db_session.commit()
+    repo = crud.create_repository(db_session, url="https://github.com/test/repo", name="test/repo", owner_id=user.id)
+    first = crud.create_analysis_result(
+        db_session, schemas.AnalysisResultCreate(repository_id=repo.id, status=AnalysisStatus.COMPLETED, summary="First")
+    )
+    second = crud.create_analysis_result(
+        db_session, schemas.AnalysisResultCreate(repository_id=repo.id, status=AnalysisStatus.COMPLETED, summary="Second")
+    )
+    assert crud.get_repository(db_session, repo.id).latest_analysis_id == second.id
+
+    crud.delete_analysis_result(db_session, analysis_id=second.id)
+    assert crud.get_repository(db_session, repo.id).latest_analysis_id == first.id
+
+
+def test_get_repositories_by_owner_loads_only_latest_summary(db_session: Session):
+    user = models.User(username="testuser", hashed_password="testpassword")
+    db_session.add(user)
+    db_session.commit()
+    repo = crud.create_repository(db_session, url="https://github.com/test/repo", name="test/repo", owner_id=user.id)
+    for summary in ("Old", "New"):
+        crud.create_analysis_result(
+            db_session,
+            schemas.AnalysisResultCreate(repository_id=repo.id, status=AnalysisStatus.COMPLETED, summary=summary, narrative="Long"),
+        )
+    owner_id = user.id
+    db_session.expunge_all()
+
+    repositories = crud.get_repositories_by_owner(db_session, owner_id=owner_id)
+
+    latest = repositories[0].latest_analysis
+    assert latest.summary == "New"
+    unloaded = inspect(latest).unloaded
+    assert "narrative_hash" in unloaded
+    assert "narrative_blob" in unloaded
+    assert "analysis_results" in inspect(repositories[0]).unloaded
+
+
+def test_bulky_fields_are_stored_once_as_blobs(db_session: Session):
+    user = models.User(username="testuser", hashed_password="testpassword")
+    db_session.add(user)
+    db_session.commit()
+    repo = crud.create_repository(db_session, url="https://github.com/test/repo", name="test/repo", owner_id=user.id)
+    analyses = [
+        crud.create_analysis_result(
+            db_session,
+            schemas.AnalysisResultCreate(
+                repository_id=repo.id,
+                status=AnalysisStatus.COMPLETED,
+                narrative="Same narrative",
+                languages={"Python": 100, "Go": 5},
+                contributors=[{"name": "dev"}],
+            ),
+        )
+        for _ in range(2)
+    ]
+    analysis_ids = [analysis.id for analysis in analyses]
+
+    assert db_session.query(models.Blob).count() == 3  # noqa: PLR2004
+    db_session.expunge_all()
+    for analysis_id in analysis_ids:
+        analysis = crud.get_analysis_result(db_session, analysis_id)
+        assert analysis.narrative == "Same narrative"
+        assert analysis.languages == {"Python": 100, "Go": 5}
+        assert analysis.tech_stack is None
+
+
+def test_updating_a_blob_field(db_session: Session):
+    user = models.User(username="testuser", hashed_password="testpassword")
+    db_session.add(user)
+    db_session.commit()
+    repo = crud.create_repository(db_session, url="https://github.com/test/repo", name="test/repo", owner_id=user.id)
+    analysis = crud.create_analysis_result(
+        db_session, schemas.AnalysisResultCreate(repository_id=repo.id, status=AnalysisStatus.IN_PROGRESS, narrative="Draft")
+    )
+
+    analysis.narrative = "Final"
+    assert analysis.narrative == "Final"
+    db_session.commit()
+    analysis_id = analysis.id
+    db_session.expunge_all()
+
+    assert crud.get_analysis_result(db_session, analysis_id).narrative == "Final"
+
+
+def test_blob_field_on_detached_instance(db_session: Session):
+    user = models.User(username="testuser", hashed_password="testpassword")
+    db_session.add(user)
+    db_session.commit()
+    repo = crud.create_repository(db_session, url="https://github.com/test/repo", name="test/repo", owner_id=user.id)
+    draft, final = (
+        crud.create_analysis_result(
+            db_session, schemas.AnalysisResultCreate(repository_id=repo.id, status=AnalysisStatus.COMPLETED, narrative=narrative)
+        )
+        for narrative in ("Draft", "Final")
+    )
+    final_hash = final.narrative_hash
+    analysis = crud.get_analysis_result(db_session, draft.id)
+    db_session.expunge_all()
+
+    # The loaded blob is still readable, but a different one cannot be loaded anymore
+    assert analysis.narrative == "Draft"
+    analysis.narrative_hash = final_hash
+    with pytest.raises(DetachedInstanceError):
+        _ = analysis.narrative
+
+
+def test_delete_orphaned_blobs(db_session: Session):
+    user = models.User(username="testuser", hashed_password="testpassword")
+    db_session.add(user)
+    db_session.commit()
+    repo = crud.create_repository(db_session, url="https://github.com/test/repo", name="test/repo", owner_id=user.id)
+    kept = crud.create_analysis_result(
+        db_session, schemas.AnalysisResultCreate(repository_id=repo.id, status=AnalysisStatus.COMPLETED, narrative="Draft")
+    )
+    deleted = crud.create_analysis_result(
+        db_session, schemas.AnalysisResultCreate(repository_id=repo.id, status=AnalysisStatus.COMPLETED, contributors=[{"name": "dev"}])
+    )
+    kept.narrative = "Final"
+    db_session.commit()
+    kept_id, final_hash = kept.id, kept.narrative_hash
+    crud.delete_analysis_result(db_session, analysis_id=deleted.id)
+
+    # Blobs within the grace period are left alone
+    assert crud.delete_orphaned_blobs(db_session, datetime(2000, 1, 1, tzinfo=UTC)) == 0
+    assert crud.delete_orphaned_blobs(db_session, datetime(2100, 1, 1, tzinfo=UTC), batch_size=1) == 2  # noqa: PLR2004
+
+    assert db_session.query(models.Blob.hash).all() == [(final_hash,)]
+    db_session.expunge_all()
+    assert crud.get_analysis_result(db_session, kept_id).narrative == "Final"
+
+
+def create_analyzed_repository(db_session: Session, owner_id: int, name: str, tech_stack: list[str], languages: dict):
+    repo = crud.create_repository(db_session, url=f"https://github.com/test/{name}", name=f"test/{name}", owner_id=owner_id)
+    crud.create_analysis_result(
+        db_session,
+        schemas.AnalysisResultCreate(repository_id=repo.id, status=AnalysisStatus.COMPLETED, tech_stack=tech_stack, languages=languages),
+    )
+    return repo
+
+
+def test_filter_repositories_by_technology_and_language(db_session: Session):
+    user = models.User(username="testuser", hashed_password="testpassword")
+    db_session.add(user)
+    db_session.commit()
+    create_analyzed_repository(db_session, user.id, "api", ["FastAPI", "SQLAlchemy"], {"Python": 90, "TypeScript": 10})
+    create_analyzed_repository(db_session, user.id, "web", ["React"], {"TypeScript": 80, "CSS": 20})
+    create_analyzed_repository(db_session, user.id, "full", ["fastapi", "React"], {"TypeScript": 60, "Python": 40})
+
+    def names(**filters):
+        return sorted(repo.name for repo in crud.get_repositories_by_owner(db_session, owner_id=user.id, **filters))
+
+    assert names(technologies=["FastAPI"]) == ["test/api", "test/full"]
+    assert names(technologies=["fastapi", "react"]) == ["test/full"]
+    assert names(language="typescript", min_language_share=0.5) == ["test/full", "test/web"]
+    assert names(technologies=["Django"]) == []
+
+
+def test_filters_follow_the_latest_analysis(db_session: Session):
+    user = models.User(username="testuser", hashed_password="testpassword")
+    db_session.add(user)
+    db_session.commit()
+    repo = create_analyzed_repository(db_session, user.id, "api", ["Flask"], {"Python": 100})
+    analysis = crud.create_analysis_result(
+        db_session, schemas.AnalysisResultCreate(repository_id=repo.id, status=AnalysisStatus.IN_PROGRESS)
+    )
+    analysis.tech_stack = ["FastAPI"]
+    db_session.commit()
+
+    assert crud.get_repositories_by_owner(db_session, owner_id=user.id, technologies=["Flask"]) == []
+    assert len(crud.get_repositories_by_owner(db_session, owner_id=user.id, technologies=["FastAPI"])) == 1
+
+
+def test_get_stack_facets(db_session: Session):
+    user = models.User(username="testuser", hashed_password="testpassword")
+    db_session.add(user)
+    db_session.commit()
+    create_analyzed_repository(db_session, user.id, "api", ["FastAPI"], {"Python": 100})
+    create_analyzed_repository(db_session, user.id, "web", ["React"], {"TypeScript": 100})
+    create_analyzed_repository(db_session, user.id, "full", ["FastAPI", "React"], {"Python": 50, "TypeScript": 50})
+
+    facets = crud.get_stack_facets(db_session, owner_id=user.id)
+
+    assert [tuple(row) for row in facets["technologies"]] == [("FastAPI", 2), ("React", 2)]
+    assert [tuple(row) for row in facets["languages"]] == [("Python", 2), ("TypeScript", 2)]
+
+
+def create_searchable_analysis(db_session: Session, owner_id: int, name: str, summary: str, narrative: str):
+    repo = crud.create_repository(db_session, url=f"https://github.com/test/{name}", name=f"test/{name}", owner_id=owner_id)
+    return crud.create_analysis_result(
+        db_session,
+        schemas.AnalysisResultCreate(
+            repository_id=repo.id, status=AnalysisStatus.COMPLETED, summary=summary, narrative=narrative
+        ),
+    )
+
+
+def test_search_analyses(db_session: Session):
+    user = models.User(username="testuser", hashed_password="testpassword")
+    other = models.User(username="otheruser", hashed_password="testpassword")
+    db_session.add_all([user, other])
+    db_session.commit()
+    create_searchable_analysis(db_session, user.id, "payments", "Billing service", "Handles invoices and payments.")
+    create_searchable_analysis(db_session, user.id, "docs", "Documentation site", "Mentions payments once.")
+    create_searchable_analysis(db_session, other.id, "payments-fork", "Payments fork", "Payments everywhere.")
+
+    hits = crud.search_analyses(db_session, owner_id=user.id, query="payments")
+
+    # The repository name outweighs the narrative, and other users' analyses never match
+    assert [hit.repository_name for hit in hits] == ["test/payments", "test/docs"]
+    assert hits[0].rank > hits[1].rank
+    assert [hit.repository_name for hit in crud.search_analyses(db_session, owner_id=user.id, query="invoice")] == [
+        "test/payments"
+    ]
+    assert crud.search_analyses(db_session, owner_id=user.id, query="invoice* (payments\"")[0].repository_name == "test/payments"
+    assert crud.search_analyses(db_session, owner_id=user.id, query="payments", limit=1, offset=1)[0].repository_name == "test/docs"
+    assert crud.search_analyses(db_session, owner_id=user.id, query="***") == []
+
+
+def test_search_index_follows_updates_and_deletes(db_session: Session):
+    user = models.User(username="testuser", hashed_password="testpassword")
+    db_session.add(user)
+    db_session.commit()
+    analysis = create_searchable_analysis(db_session, user.id, "api", "Backend", "Uses Flask.")
+    analysis_id = analysis.id
+
+    analysis.narrative = "Uses FastAPI."
+    db_session.commit()
+    assert crud.search_analyses(db_session, owner_id=user.id, query="flask") == []
+    assert [hit.analysis_id for hit in crud.search_analyses(db_session, owner_id=user.id, query="fastapi")] == [analysis_id]
+
+    crud.delete_analysis_result(db_session, analysis_id=analysis_id)
+    assert crud.search_analyses(db_session, owner_id=user.id, query="fastapi") == []
+
+
+def test_user_stats_follow_analysis_writes(db_session: Session):
+    user = models.User(username="testuser", hashed_password="testpassword")
+    db_session.add(user)
+    db_session.commit()
+    user_id = user.id
+    repo = create_analyzed_repository(db_session, user_id, "api", ["FastAPI", "SQLAlchemy"], {"Python": 900, "Shell": 100})
+    analysis = crud.create_analysis_result(
+        db_session, schemas.AnalysisResultCreate(repository_id=repo.id, status=AnalysisStatus.IN_PROGRESS)
+    )
+    db_session.commit()
+    analysis_id = analysis.id
+
+    stats = crud.get_user_stats(db_session, user_id)
+    assert stats["analysis_count"] == 2  # noqa: PLR2004
+    assert stats["status_counts"] == {"COMPLETED": 1, "IN_PROGRESS": 1}
+    assert stats["language_bytes"] == {"Python": 900, "Shell": 100}
+
+    # As persist_analysis does, with the attributes expired by the commit
+    analysis.status = AnalysisStatus.COMPLETED
+    analysis.commit_count = 40
+    analysis.languages = {"Python": 100}
+    analysis.tech_stack = ["FastAPI"]
+    db_session.commit()
+    stats = crud.get_user_stats(db_session, user_id)
+    assert stats["status_counts"] == {"COMPLETED": 2}
+    assert stats["total_commits"] == 40  # noqa: PLR2004
+    assert stats["language_bytes"] == {"Python": 1000, "Shell": 100}
+    assert stats["technology_counts"] == {"FastAPI": 2, "SQLAlchemy": 1}
+
+    crud.delete_analysis_result(db_session, analysis_id)
+    crud.delete_repository(db_session, repo.id)
+    stats = crud.get_user_stats(db_session, user_id)
+    assert stats["analysis_count"] == 0
+    assert stats["language_bytes"] == {}
+    assert stats["total_commits"] == 0
+
+
+def test_reconcile_user_stats_repairs_drift(db_session: Session):
+    user = models.User(username="testuser", hashed_password="testpassword")
+    other = models.User(username="otheruser", hashed_password="testpassword")
+    db_session.add_all([user, other])
+    db_session.commit()
+    user_id, other_id = user.id, other.id
+    create_analyzed_repository(db_session, user_id, "api", ["FastAPI"], {"Python": 100})
+    create_analyzed_repository(db_session, other_id, "web", ["React"], {"TypeScript": 100})
+    expected = crud.get_user_stats(db_session, user_id)
+    assert stats.reconcile_user_stats(db_session) == []
+
+    # Writes that bypass the ORM are not counted
+    db_session.execute(
+        models.AnalysisResult.__table__.update().values(commit_count=7)
+    )
+    db_session.query(models.UserStat).filter(
+        models.UserStat.user_id == user_id, models.UserStat.metric == "language_bytes"
+    ).delete()
+    db_session.commit()
+
+    assert stats.reconcile_user_stats(db_session) == [user_id, other_id]
+    assert crud.get_user_stats(db_session, user_id) == {**expected, "total_commits": 7}
+    assert stats.reconcile_user_stats(db_session, user_id=user_id) == []
+
+
+def count_statements(db_session: Session):
+    statements = []
+    event.listen(db_session.get_bind(), "before_cursor_execute", lambda *args: statements.append(args[2]))
+    return statements
+
+
+def test_unit_of_work_commits_once(db_session: Session):
+    user = models.User(username="testuser", hashed_password="testpassword")
+    db_session.add(user)
+    db_session.commit()
+    user_id = user.id
+
+    with unit_of_work(db_session):
+        repo = crud.create_repository(db_session, url="https://github.com/test/repo", name="test/repo", owner_id=user_id)
+        analysis = crud.create_analysis_result(
+            db_session, schemas.AnalysisResultCreate(repository_id=repo.id, status=AnalysisStatus.IN_PROGRESS), refresh=False
+        )
+        assert db_session.in_transaction()
+    assert not db_session.in_transaction()
+    assert repo.latest_analysis_id == analysis.id
+
+    with pytest.raises(RuntimeError), unit_of_work(db_session):
+        crud.update_repository_status(db_session, repo.id, AnalysisStatus.FAILED)
+        raise RuntimeError
+    assert crud.get_repository(db_session, repo.id).status == AnalysisStatus.PENDING
+
+
+def test_create_repository_without_refresh(db_session: Session):
+    user = models.User(username="testuser", hashed_password="testpassword")
+    db_session.add(user)
+    db_session.commit()
+    user_id = user.id
+    db_session.expire_on_commit = False
+    statements = count_statements(db_session)
+
+    repo = crud.create_repository(db_session, url="https://github.com/test/repo", name="test/repo", owner_id=user_id, refresh=False)
+
+    # The ID and created_at come back with the INSERT
+    assert repo.id is not None
+    assert repo.created_at is not None
+    assert repo.analysis_results == []
+    assert len(statements) == 1
+
+
+def test_bulk_helpers(db_session: Session):
+    user = models.User(username="testuser", hashed_password="testpassword")
+    db_session.add(user)
+    db_session.commit()
+    repos = [
+        crud.create_repository(db_session, url=f"https://github.com/test/repo{i}", name=f"test/repo{i}", owner_id=user.id)
+        for i in range(2)
+    ]
+    repo_ids = [repo.id for repo in repos]
+
+    analyses = crud.create_analysis_results(
+        db_session,
+        [
+            schemas.AnalysisResultCreate(repository_id=repo_ids[0], status=AnalysisStatus.COMPLETED, languages={"Python": 10}),
+            schemas.AnalysisResultCreate(repository_id=repo_ids[0], status=AnalysisStatus.COMPLETED),
+            schemas.AnalysisResultCreate(repository_id=repo_ids[1], status=AnalysisStatus.FAILED),
+        ],
+    )
+    assert crud.update_repository_statuses(db_session, repo_ids, AnalysisStatus.COMPLETED) == 2  # noqa: PLR2004
+
+    db_session.expire_all()
+    assert [repo.latest_analysis_id for repo in repos] == [analyses[1].id, analyses[2].id]
+    assert [repo.status for repo in repos] == [AnalysisStatus.COMPLETED, AnalysisStatus.COMPLETED]
+    assert crud.get_user_stats(db_session, user.id)["language_bytes"] == {"Python": 10}
@@ -0,0 +1,64 @@
+import logging
+
+from sqlalchemy import text
+
+from src.db import instrumentation
+from src.db.instrumentation import QueryStats, track_queries
+
+
+def test_track_queries_counts_statements_of_current_context(db_session):
+    with track_queries() as queries:
+        db_session.execute(text("SELECT 1"))
+        db_session.execute(text("SELECT 2"))
+    db_session.execute(text("SELECT 3"))
+
+    assert queries.count == 2  # noqa: PLR2004
+    assert queries.total_seconds > 0
+    assert list(queries.statements) == ["SELECT 1", "SELECT 2"]
+
+
+def test_track_queries_nests():
+    with track_queries() as outer:
+        with track_queries() as inner:
+            pass
+        assert instrumentation._context_stats.get() == (outer,)
+    assert instrumentation._context_stats.get() == ()
+    assert inner.count == outer.count == 0
+
+
+def test_track_queries_on_engine_sees_other_threads(db_session):
+    engine = db_session.get_bind()
+    with track_queries(engine) as queries:
+        db_session.execute(text("SELECT 1"))
+    assert queries.count == 1
+    assert engine not in instrumentation._engine_stats
+
+
+def test_query_stats_keeps_slowest_statements():
+    queries = QueryStats()
+    for i, seconds in enumerate([0.001, 0.5, 0.002, 0.3, 0.004]):
+        queries.record(f"SELECT {i}", seconds)
+
+    assert [statement for _, statement in queries.slowest] == ["SELECT 1", "SELECT 3", "SELECT 4"]
+    assert queries.headers() == {"X-DB-Query-Count": "5", "X-DB-Query-Time-Ms": "807.0", "X-DB-Slowest-Query-Ms": "500.0"}
+
+
+def test_query_stats_reports_repeated_statements(caplog):
+    queries = QueryStats()
+    for _ in range(instrumentation.SQL_REPEATED_STATEMENT_THRESHOLD):
+        queries.record("SELECT * FROM blobs WHERE hash = ?", 0.001)
+    queries.record("SELECT * FROM repositories", 0.001)
+
+    assert queries.repeated() == [("SELECT * FROM blobs WHERE hash = ?", instrumentation.SQL_REPEATED_STATEMENT_THRESHOLD)]
+    with caplog.at_level(logging.WARNING):
+        queries.log_summary("GET /api/v1/repositories/")
+    assert "likely N+1 query: SELECT * FROM blobs" in caplog.text
+
+
+def test_query_stats_headers_only_in_sql_debug_mode(client, mocker):
+    response = client.get("/")
+    assert "X-DB-Query-Count" not in response.headers
+
+    mocker.patch("src.main.SQL_DEBUG", True)
+    response = client.get("/")
+    assert response.headers["X-DB-Query-Count"] == "0"
@@ -0,0 +1,103 @@
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from sqlalchemy import create_engine, inspect, select
+from sqlalchemy.orm import sessionmaker
+
+from src.db import crud
+from src.db.migrations import MIGRATIONS, init_db, migration_lock, schema_migrations
+
+# Schema written by versions before the migrations existed
+OLD_SCHEMA = """
+CREATE TABLE users (id INTEGER PRIMARY KEY, username VARCHAR NOT NULL UNIQUE, hashed_password VARCHAR NOT NULL);
+CREATE TABLE repositories (
+    id INTEGER PRIMARY KEY, url VARCHAR NOT NULL UNIQUE, name VARCHAR NOT NULL, owner_id INTEGER REFERENCES users(id),
+    status VARCHAR(11) NOT NULL, summary TEXT, created_at DATETIME DEFAULT (CURRENT_TIMESTAMP), updated_at DATETIME
+);
+CREATE TABLE analysis_results (
+    id INTEGER PRIMARY KEY, repository_id INTEGER NOT NULL REFERENCES repositories(id), summary TEXT, narrative TEXT,
+    open_issues_count INTEGER, open_pull_requests_count INTEGER, contributors JSON, file_count INTEGER,
+    total_lines INTEGER, commit_count INTEGER, languages JSON, tech_stack JSON, report_url VARCHAR,
+    status VARCHAR(11) NOT NULL, created_at DATETIME DEFAULT (CURRENT_TIMESTAMP)
+);
+INSERT INTO users VALUES (1, 'testuser', 'testpassword');
+INSERT INTO repositories (id, url, name, owner_id, status) VALUES (1, 'https://github.com/test/repo', 'test/repo', 1, 'COMPLETED');
+INSERT INTO analysis_results (repository_id, summary, narrative, languages, tech_stack, status) VALUES
+    (1, 'First', 'Narrative', '{"Python": 100}', '["FastAPI"]', 'COMPLETED'),
+    (1, 'Second', 'Narrative', NULL, '["FastAPI"]', 'COMPLETED');
+"""
+
+
+def applied_versions(engine):
+    with engine.connect() as connection:
+        return list(connection.execute(select(schema_migrations.c.version)).scalars())
+
+
+def test_fresh_database_records_every_migration(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'fresh.db'}")
+    init_db(engine)
+
+    assert applied_versions(engine) == [version for version, _ in MIGRATIONS]
+    engine.dispose()
+
+
+def test_migrates_old_database(tmp_path):
+    path = tmp_path / "old.db"
+    with sqlite3.connect(path) as connection:
+        connection.executescript(OLD_SCHEMA)
+    engine = create_engine(f"sqlite:///{path}")
+
+    init_db(engine)
+    init_db(engine) # Already applied migrations are skipped
+
+    inspector = inspect(engine)
+    columns = {c["name"] for c in inspector.get_columns("analysis_results")}
+    assert "narrative" not in columns
+    assert "narrative_hash" in columns
+    indexes = {index["name"] for index in inspector.get_indexes("analysis_results")}
+    assert "ix_analysis_results_repository_id_created_at_id" in indexes
+    assert applied_versions(engine) == [version for version, _ in MIGRATIONS]
+
+    db = sessionmaker(bind=engine)()
+    repo = crud.get_repository(db, 1)
+    assert repo.latest_analysis.summary == "Second"
+    assert [(a.narrative, a.languages, a.tech_stack) for a in repo.analysis_results] == [
+        ("Narrative", {"Python": 100}, ["FastAPI"]),
+        ("Narrative", None, ["FastAPI"]),
+    ]
+    assert [[link.technology.name for link in a.technology_links] for a in repo.analysis_results] == [["FastAPI"], ["FastAPI"]]
+    assert [[link.share for link in a.language_links] for a in repo.analysis_results] == [[1.0], []]
+    assert [hit.summary for hit in crud.search_analyses(db, owner_id=repo.owner_id, query="narrative")] == ["Second", "First"]
+    user_stats = crud.get_user_stats(db, repo.owner_id)
+    assert user_stats["status_counts"] == {"COMPLETED": 2}
+    assert user_stats["technology_counts"] == {"FastAPI": 2}
+    db.close()
+    engine.dispose()
+
+
+def test_migration_lock_blocks_other_writers(tmp_path):
+    path = tmp_path / "locked.db"
+    engine = create_engine(f"sqlite:///{path}")
+
+    with migration_lock(engine):
+        other = sqlite3.connect(path, timeout=0)
+        with pytest.raises(sqlite3.OperationalError, match="locked"):
+            other.execute("BEGIN IMMEDIATE")
+        other.close()
+    engine.dispose()
+
+
+def test_concurrent_startups_migrate_once(tmp_path):
+    path = tmp_path / "old.db"
+    with sqlite3.connect(path) as connection:
+        connection.executescript(OLD_SCHEMA)
+    # One engine per process starting at the same time
+    engines = [create_engine(f"sqlite:///{path}", connect_args={"timeout": 30}) for _ in range(4)]
+
+    with ThreadPoolExecutor(len(engines)) as pool:
+        list(pool.map(init_db, engines))
+
+    assert applied_versions(engines[0]) == [version for version, _ in MIGRATIONS]
+    for engine in engines:
+        engine.dispose()
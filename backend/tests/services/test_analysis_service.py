@@ -1,5 +1,4 @@
 
-import asyncio
 import unittest
 from unittest.mock import MagicMock, patch
 
@@ -13,71 +12,41 @@ from src.services import analysis_service
 class TestError(Exception):
     pass
 
-# Define a constant for the mock analysis data
-MOCK_ANALYSIS_DICT = {
-    "file_count": 10,
-    "commit_count": 50,
-    "languages": {"Python": 100},
-    "open_issues_count": 5,
-    "open_pull_requests_count": 2,
-    "contributors": [{"login": "testuser", "contributions": 10}],
-    "tech_stack": ["Python"],
-}
-
-
 class TestAnalysisService(unittest.TestCase):
 
     @patch("src.services.analysis_service.SessionLocal")
     @patch("src.services.analysis_service.crud")
-    @patch("src.services.analysis_service.asyncio.run")
-    @patch("src.services.analysis_service.GitHubService")
-    @patch("src.services.analysis_service.RepositoryAnalyzer")
-    @patch("src.services.analysis_service.generate_narratives_task")
+    @patch("src.services.analysis_service.publish_status_event")
+    @patch("src.services.analysis_service.chord")
     def test_clone_and_analyze_repository_success(
         self,
-        mock_generate_narratives_task,
-        mock_repository_analyzer,
-        mock_github_service,
-        mock_asyncio_run,
+        mock_chord,
+        mock_publish_status_event,
         mock_crud,
+        mock_session_local,
     ):
         # Arrange
-        mock_session_local = MagicMock() # Create mock here
         mock_db = MagicMock(spec=Session)
         mock_session_local.return_value = mock_db
         mock_repo = MagicMock(spec=models.Repository)
         mock_repo.id = 1
         mock_repo.url = "https://github.com/owner/repo"
         mock_crud.get_repository.return_value = mock_repo
-
-
-        # Define a side_effect function to handle different coroutines
-        def asyncio_run_side_effect(coro):
-            # The string representation of the coroutine includes its name
-            if "get_repository_analysis" in str(coro):
-                return MOCK_ANALYSIS_DICT
-            elif "_broadcast_status_update" in str(coro):
-                # Actually run the broadcast coroutine to prevent warnings
-                loop = asyncio.new_event_loop()
-                loop.run_until_complete(coro)
-                loop.close()
-                return None
-            return None # Default return for any other coroutine
-
-        mock_asyncio_run.side_effect = asyncio_run_side_effect
+        mock_crud.create_analysis_result.return_value.id = 7
 
         # Act
         analysis_service.clone_and_analyze_repository(1)
 
         # Assert
         mock_crud.get_repository.assert_called_once_with(mock_db, 1)
-        self.assertEqual(mock_repo.status, AnalysisStatus.COMPLETED)
-        self.assertEqual(mock_db.commit.call_count, 2)  # noqa: PLR2004
-        self.assertEqual(mock_asyncio_run.call_count, 2)  # noqa: PLR2004
-        mock_github_service.assert_called_once()
-        mock_repository_analyzer.assert_called_once_with(mock_github_service.return_value)
-        mock_generate_narratives_task.delay.assert_called_once_with(1, MOCK_ANALYSIS_DICT)
+        self.assertEqual(mock_repo.status, AnalysisStatus.IN_PROGRESS)
         mock_crud.create_analysis_result.assert_called_once()
+        mock_publish_status_event.assert_called_once()
+        header, body = mock_chord.call_args.args
+        self.assertEqual(len(header), 4)  # noqa: PLR2004
+        self.assertEqual(body.args, (1, 7))
+        mock_chord.return_value.apply_async.assert_called_once()
+        mock_db.close.assert_called_once()
 
     @patch("src.services.analysis_service.SessionLocal")
     @patch("src.services.analysis_service.crud")
@@ -112,68 +81,86 @@ class TestAnalysisService(unittest.TestCase):
 
 
     @patch("src.services.analysis_service.SessionLocal")
+    @patch("src.services.analysis_service.crud")
     @patch("src.services.analysis_service.NarrativeGenerator")
-    @patch("src.services.analysis_service.asyncio.run")
+    @patch("src.services.analysis_service.run_async")
     def test_generate_narratives_task_success(
-        self, mock_asyncio_run, mock_narrative_generator, mock_session_local
+        self, mock_run_async, mock_narrative_generator, mock_crud, mock_session_local
     ):
         # Arrange
         mock_db = MagicMock(spec=Session)
         mock_session_local.return_value = mock_db
         mock_analysis_result = MagicMock(spec=models.AnalysisResult)
-        mock_db.query.return_value.filter.return_value.first.return_value = mock_analysis_result
+        repo_analysis = {"some": "data"}
+        mock_crud.get_analysis_result.return_value = mock_analysis_result
+        mock_crud.get_analysis_payload.return_value = repo_analysis
         mock_narrative_generator_instance = mock_narrative_generator.return_value
         mock_narrative_generator_instance.generate_narrative.return_value = "Comprehensive Narrative"
-        mock_asyncio_run.return_value = "Recruiter Summary"
-
-        repo_analysis = {"some": "data"}
+        mock_run_async.return_value = "Recruiter Summary"
 
         # Act
-        analysis_service.generate_narratives_task(1, repo_analysis)
+        analysis_service.generate_narratives_task(1, 7)
 
         # Assert
-        mock_db.query.assert_called_once_with(models.AnalysisResult)
+        mock_crud.get_analysis_result.assert_called_once_with(mock_db, 7)
+        mock_crud.get_analysis_payload.assert_called_once_with(mock_db, 7)
         mock_narrative_generator.assert_called_once()
         mock_narrative_generator_instance.generate_narrative.assert_called_once_with(repo_analysis)
-        mock_asyncio_run.assert_called_once_with(mock_narrative_generator_instance.generate_recruiter_summary(repo_analysis))
+        mock_run_async.assert_called_once_with(mock_narrative_generator_instance.generate_recruiter_summary(repo_analysis))
         self.assertEqual(mock_analysis_result.summary, "Recruiter Summary")
         self.assertEqual(mock_analysis_result.narrative, "Comprehensive Narrative")
         mock_db.add.assert_called_once_with(mock_analysis_result)
         mock_db.commit.assert_called_once()
+        mock_crud.delete_analysis_payload.assert_called_once_with(mock_db, 7)
 
     @patch("src.services.analysis_service.SessionLocal")
+    @patch("src.services.analysis_service.crud")
     @patch("src.services.analysis_service.NarrativeGenerator")
+    @patch("src.services.analysis_service.run_async")
     def test_generate_narratives_task_analysis_not_found(
-        self, mock_session_local
+        self, mock_run_async, mock_narrative_generator, mock_crud, mock_session_local
     ):
         # Arrange
         mock_db = MagicMock(spec=Session)
         mock_session_local.return_value = mock_db
-        mock_db.query.return_value.filter.return_value.first.return_value = None
-        repo_analysis = {"some": "data"}
-
+        mock_crud.get_analysis_result.return_value = None
         # Act
-        analysis_service.generate_narratives_task(1, repo_analysis)
+        analysis_service.generate_narratives_task(1, 1)
 
         # Assert
-        mock_db.query.assert_called_once_with(models.AnalysisResult)
+        mock_crud.get_analysis_result.assert_called_once_with(mock_db, 1)
+        mock_crud.get_analysis_payload.assert_not_called()
+        mock_narrative_generator.return_value.generate_narrative.assert_not_called()
+        mock_run_async.assert_not_called()
+        mock_crud.delete_analysis_payload.assert_not_called()
         mock_db.add.assert_not_called()
         mock_db.commit.assert_not_called()
+        mock_db.close.assert_called_once()
 
     @patch("src.services.analysis_service.SessionLocal")
+    @patch("src.services.analysis_service.crud")
     @patch("src.services.analysis_service.NarrativeGenerator")
+    @patch("src.services.analysis_service.run_async")
     def test_generate_narratives_task_exception(
-        self, mock_session_local
+        self, mock_run_async, mock_narrative_generator, mock_crud, mock_session_local
     ):
         # Arrange
         mock_db = MagicMock(spec=Session)
         mock_session_local.return_value = mock_db
-        mock_db.query.side_effect = Exception("Test Exception")
-        repo_analysis = {"some": "data"}
-
+        mock_analysis_result = MagicMock(spec=models.AnalysisResult)
+        mock_crud.get_analysis_result.return_value = mock_analysis_result
+        mock_crud.get_analysis_payload.return_value = {"some": "data"}
+        mock_narrative_generator.return_value.generate_narrative.side_effect = Exception("Test Exception")
         # Act
-        analysis_service.generate_narratives_task(1, repo_analysis)
+        analysis_service.generate_narratives_task(1, 1)
 
         # Assert
+        mock_run_async.assert_not_called()
+        mock_crud.delete_analysis_payload.assert_not_called()
         mock_db.add.assert_not_called()
-        mock_db.commit.assert_not_called()
+        # The failure replaces the placeholder summary in a commit of its own
+        mock_db.rollback.assert_called_once()
+        self.assertEqual(mock_analysis_result.summary, "Summary generation failed: Test Exception")
+        self.assertIsNone(mock_analysis_result.narrative)
+        mock_db.commit.assert_called_once()
+        mock_db.close.assert_called_once()
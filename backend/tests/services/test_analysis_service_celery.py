@@ -1,13 +1,17 @@
-from unittest.mock import AsyncMock, patch
+import time
+from unittest.mock import ANY, AsyncMock, patch
 
 import pytest
+from celery.exceptions import Retry
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
 from src.core.enums import AnalysisStatus
-from src.db import models
+from src.core.exceptions import GitHubRateLimitError
+from src.db import crud, models
 from src.db.database import Base
 from src.services import analysis_service
+from src.services.repository_analyzer import RepositoryAnalyzer
 
 # Configuración de la base de datos en memoria para las pruebas
 SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
@@ -38,6 +42,7 @@ def celery_eager_app(monkeypatch):
 @pytest.fixture
 def mock_repository_analyzer():
     with patch("src.services.analysis_service.RepositoryAnalyzer") as mock:
+        mock.build_analysis.side_effect = RepositoryAnalyzer.build_analysis
         yield mock.return_value
 
 @pytest.fixture
@@ -51,9 +56,9 @@ def mock_connection_manager():
         mock.broadcast = AsyncMock()
         yield mock
 
-def test_clone_and_analyze_repository_success(db_session, mock_repository_analyzer, mocker):
-    # Mockear _broadcast_status_update para evitar llamadas reales y warnings
-    mock_broadcast = mocker.patch("src.services.analysis_service._broadcast_status_update", new_callable=AsyncMock)
+def test_clone_and_analyze_repository_success(db_session, mock_repository_analyzer, mock_narrative_generator, mocker):
+    # Mockear publish_status_event para evitar llamadas reales a Redis
+    mock_broadcast = mocker.patch("src.services.analysis_service.publish_status_event")
 
     # Mockear SessionLocal para que devuelva la sesión de prueba
     mocker.patch("src.services.analysis_service.SessionLocal", return_value=db_session)
@@ -74,14 +79,16 @@ def test_clone_and_analyze_repository_success(db_session, mock_repository_analyz
     db_session.refresh(repo)
     repo_id = repo.id
 
-    mock_repo_analysis = {
-        "file_count": 10, "commit_count": 50, "languages": {"Python": 10000},
-        "open_issues_count": 5, "open_pull_requests_count": 2,
-        "contributors": [{"name": "contributor1"}], "tech_stack": ["Python"],
-        "file_structure": [], "commit_history": []
-    }
-    mock_repository_analyzer.get_repository_analysis = AsyncMock(return_value=mock_repo_analysis)
-    mock_generate_narratives_delay = mocker.patch("src.services.analysis_service.generate_narratives_task.delay")
+    # Each fetch subtask of the chord calls one analyzer method
+    mock_repository_analyzer.get_repository_metadata = AsyncMock(return_value={
+        "name": "repo", "languages": {"Python": 10000}, "open_issues_count": 5,
+        "open_pull_requests_count": 2, "contributors": ["contributor1"],
+    })
+    mock_repository_analyzer.get_commit_history = AsyncMock(return_value=[{"sha": "abc"}] * 50)
+    mock_repository_analyzer.get_file_structure = AsyncMock(return_value=[{"path": "main.py"}] * 10)
+    mock_repository_analyzer.identify_tech_stack = AsyncMock(return_value=["Python"])
+    mock_narrative_generator.generate_narrative.return_value = "New Narrative"
+    mock_narrative_generator.generate_recruiter_summary = AsyncMock(return_value="New Summary")
 
     # No pasar 'db' directamente, dejar que la función use el SessionLocal mockeado
     analysis_service.clone_and_analyze_repository(repo_id)
@@ -89,13 +96,21 @@ def test_clone_and_analyze_repository_success(db_session, mock_repository_analyz
     db_repo = db_session.query(models.Repository).filter(models.Repository.id == repo_id).first()
     assert db_repo.status == AnalysisStatus.COMPLETED
 
-    mock_generate_narratives_delay.assert_called_once_with(repo_id, mock_repo_analysis)
-    analysis_result = db_session.query(models.AnalysisResult).filter(models.AnalysisResult.repository_id == repo_id).first()
-    assert analysis_result is not None
+    analysis_results = db_session.query(models.AnalysisResult).filter(models.AnalysisResult.repository_id == repo_id).all()
+    assert len(analysis_results) == 1
+    analysis_result = analysis_results[0]
+    assert analysis_result.status == AnalysisStatus.COMPLETED
     assert analysis_result.file_count == 10  # noqa: PLR2004
+    assert analysis_result.commit_count == 50  # noqa: PLR2004
+    assert analysis_result.tech_stack == ["Python"]
+    # The narrative step ran after the persist step and released the payload
+    assert analysis_result.narrative == "New Narrative"
+    assert analysis_result.summary == "New Summary"
+    assert crud.get_analysis_payload(db_session, analysis_result.id) is None
 
-    # Verify that the broadcast function was awaited
-    mock_broadcast.assert_awaited()
+    mock_repository_analyzer.get_repository_metadata.assert_awaited_once_with("test", "repo", progress=ANY)
+    mock_broadcast.assert_any_call({"id": repo_id, "owner_id": 1, "status": AnalysisStatus.IN_PROGRESS.value})
+    mock_broadcast.assert_any_call({"id": repo_id, "owner_id": 1, "status": AnalysisStatus.COMPLETED.value})
 
 
 def test_clone_and_analyze_repository_not_found(db_session, mocker):
@@ -105,27 +120,26 @@ def test_clone_and_analyze_repository_not_found(db_session, mocker):
     analysis_service.clone_and_analyze_repository(repo_id)
     mock_logging_warning.assert_called_once_with(f"Repository with ID {repo_id} not found.")
 
-def test_clone_and_analyze_repository_exception(db_session, mock_repository_analyzer, mocker):
-    mocker.patch("src.services.analysis_service._broadcast_status_update", new_callable=AsyncMock)
-    mocker.patch("src.services.analysis_service.GitHubService")
+def test_handle_analysis_failure(db_session, mocker):
+    mock_broadcast = mocker.patch("src.services.analysis_service.publish_status_event")
     mocker.patch("src.services.analysis_service.SessionLocal", return_value=db_session)
-    repo = models.Repository(url="https://github.com/test/repo", name="test_repo", owner_id=1, status=AnalysisStatus.PENDING)
+    repo = models.Repository(url="https://github.com/test/repo", name="test_repo", owner_id=1, status=AnalysisStatus.IN_PROGRESS)
     db_session.add(repo)
     db_session.commit()
-    db_session.refresh(repo)
-    repo_id = repo.id
-
-    # Mockear la corrutina para que lance una excepción
-    async def side_effect(*_args, **_kwargs):
-        raise Exception("Test analysis error")
-    mock_repository_analyzer.get_repository_analysis = side_effect
+    analysis_result = models.AnalysisResult(repository_id=repo.id, status=AnalysisStatus.IN_PROGRESS)
+    db_session.add(analysis_result)
+    db_session.commit()
+    repo_id, analysis_id = repo.id, analysis_result.id
 
-    analysis_service.clone_and_analyze_repository(repo_id)
+    # Celery calls error callbacks with the failed task's request, exception and traceback
+    analysis_service.handle_analysis_failure(None, Exception("Test analysis error"), None, repo_id=repo_id, analysis_id=analysis_id)
 
     db_repo = db_session.query(models.Repository).filter(models.Repository.id == repo_id).first()
     assert db_repo.status == AnalysisStatus.FAILED
-    analysis_result = db_session.query(models.AnalysisResult).filter(models.AnalysisResult.repository_id == repo_id).first()
-    assert "An unexpected error occurred" in analysis_result.summary
+    db_analysis_result = db_session.query(models.AnalysisResult).filter(models.AnalysisResult.id == analysis_id).first()
+    assert db_analysis_result.status == AnalysisStatus.FAILED
+    assert "An unexpected error occurred" in db_analysis_result.summary
+    mock_broadcast.assert_called_once_with({"id": repo_id, "owner_id": 1, "status": AnalysisStatus.FAILED.value})
 
 def test_generate_narratives_task_success(db_session, mock_narrative_generator, mocker):
     mocker.patch("src.services.analysis_service.SessionLocal", return_value=db_session)
@@ -137,25 +151,32 @@ def test_generate_narratives_task_success(db_session, mock_narrative_generator,
     db_session.commit()
     db_session.refresh(analysis_result)
 
+    analysis_id = analysis_result.id
+
     mock_repo_analysis = {"file_structure": [], "commit_history": []}
+    crud.save_analysis_payload(db_session, analysis_id, mock_repo_analysis)
+    db_session.commit()
     mock_narrative_generator.generate_narrative.return_value = "New Narrative"
     mock_narrative_generator.generate_recruiter_summary = AsyncMock(return_value="New Summary")
 
-    analysis_service.generate_narratives_task(repo.id, mock_repo_analysis)
+    analysis_service.generate_narratives_task(repo.id, analysis_id)
 
-    db_analysis_result = db_session.query(models.AnalysisResult).filter(models.AnalysisResult.id == analysis_result.id).first()
+    db_analysis_result = db_session.query(models.AnalysisResult).filter(models.AnalysisResult.id == analysis_id).first()
     assert db_analysis_result.narrative == "New Narrative"
     assert db_analysis_result.summary == "New Summary"
+    mock_narrative_generator.generate_narrative.assert_called_once_with(mock_repo_analysis)
+    # The payload is released once the narratives are stored
+    assert crud.get_analysis_payload(db_session, analysis_id) is None
 
 def test_generate_narratives_task_no_analysis_result(db_session, mock_narrative_generator, mocker):
     repo_id = 1
+    analysis_id = 1
     mocker.patch("src.services.analysis_service.SessionLocal", return_value=db_session)
-    mock_repo_analysis = {"some_data": "value"}
     mock_logging_warning = mocker.patch("src.services.analysis_service.logging.warning")
 
-    analysis_service.generate_narratives_task(repo_id, mock_repo_analysis)
+    analysis_service.generate_narratives_task(repo_id, analysis_id)
 
-    mock_logging_warning.assert_called_once_with(f"AnalysisResult not found for repository ID {repo_id}. Cannot update narratives.")
+    mock_logging_warning.assert_called_once_with(f"AnalysisResult {analysis_id} or its payload not found for repository ID {repo_id}. Cannot update narratives.")
     mock_narrative_generator.generate_narrative.assert_not_called()
     mock_narrative_generator.generate_recruiter_summary.assert_not_called()
 
@@ -168,10 +189,59 @@ def test_generate_narratives_task_exception(db_session, mock_narrative_generator
     db_session.add(analysis_result)
     db_session.commit()
 
-    mock_repo_analysis = {"some_data": "value"}
+    crud.save_analysis_payload(db_session, analysis_result.id, {"some_data": "value"})
+    db_session.commit()
     mock_narrative_generator.generate_narrative.side_effect = Exception("Narrative generation error")
     mock_logging_error = mocker.patch("src.services.analysis_service.logging.error")
 
-    analysis_service.generate_narratives_task(repo.id, mock_repo_analysis)
+    analysis_service.generate_narratives_task(repo.id, analysis_result.id)
 
     mock_logging_error.assert_called_once()
+
+
+def test_generate_narratives_task_exception_replaces_placeholders(db_session, mock_narrative_generator, mocker):
+    mocker.patch("src.services.analysis_service.SessionLocal", return_value=db_session)
+    repo = models.Repository(url="https://github.com/test/repo", name="test_repo", owner_id=1)
+    db_session.add(repo)
+    db_session.commit()
+    analysis_result = models.AnalysisResult(
+        repository_id=repo.id, status=AnalysisStatus.COMPLETED,
+        summary="Generating summary...", narrative="Generating narrative...",
+    )
+    db_session.add(analysis_result)
+    db_session.commit()
+    crud.save_analysis_payload(db_session, analysis_result.id, {"some_data": "value"})
+    db_session.commit()
+    mock_narrative_generator.generate_narrative.side_effect = Exception("LLM quota exceeded")
+    repo_id, analysis_id = repo.id, analysis_result.id
+
+    analysis_service.generate_narratives_task(repo_id, analysis_id)
+
+    stored = crud.get_analysis_result(db_session, analysis_id)
+    assert stored.summary == "Summary generation failed: LLM quota exceeded"
+    assert stored.narrative is None
+    assert stored.status == AnalysisStatus.COMPLETED
+
+
+def test_fetch_retries_rate_limited_request_after_reset(mocker):
+    error = GitHubRateLimitError("rate limited", 403, {}, reset_time=int(time.time()) + 120)
+    mocker.patch("src.services.analysis_service._get_repository_analyzer")
+    mocker.patch("src.services.analysis_service.run_async", side_effect=error)
+    retry = mocker.patch.object(analysis_service.fetch_commit_history, "retry", side_effect=Retry())
+
+    with pytest.raises(Retry):
+        analysis_service.fetch_commit_history("https://github.com/test/repo")
+
+    retry.assert_called_once_with(exc=error, countdown=ANY)
+    assert 100 < retry.call_args.kwargs["countdown"] <= 120  # noqa: PLR2004
+
+
+def test_fetch_fails_when_rate_limit_resets_too_late(mocker):
+    error = GitHubRateLimitError("rate limited", 403, {}, reset_time=int(time.time()) + 7200)
+    mocker.patch("src.services.analysis_service._get_repository_analyzer")
+    mocker.patch("src.services.analysis_service.run_async", side_effect=error)
+    retry = mocker.patch.object(analysis_service.fetch_commit_history, "retry")
+
+    with pytest.raises(GitHubRateLimitError):
+        analysis_service.fetch_commit_history("https://github.com/test/repo")
+    retry.assert_not_called()
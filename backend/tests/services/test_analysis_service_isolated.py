@@ -1,5 +1,4 @@
-import os
-from unittest.mock import AsyncMock, MagicMock, patch
+from unittest.mock import MagicMock, patch
 
 import pytest
 from sqlalchemy.orm import Session
@@ -31,42 +30,24 @@ async def test_clone_and_analyze_repository_success_isolated(
     with patch(
         "src.services.analysis_service.crud", autospec=True
     ) as mock_crud, patch(
-        "src.services.analysis_service.RepositoryAnalyzer", autospec=True
-    ) as mock_repository_analyzer, patch(
-        "src.services.analysis_service.generate_narratives_task", autospec=True
-    ) as mock_generate_narratives_task, patch(
-        "os.getenv", side_effect=lambda key: "mock_token" if key == "GITHUB_TOKEN" else os.getenv(key)
-    ):
+        "src.services.analysis_service.chord", autospec=True
+    ) as mock_chord, patch(
+        "src.services.analysis_service.publish_status_event"
+    ) as mock_publish_status_event:
 
         # Arrange
         mock_crud.get_repository.return_value = mock_repository
-        mock_repository_analyzer_instance = (
-            mock_repository_analyzer.return_value
-        )
-        analysis_data = {
-            "file_count": 10,
-            "commit_count": 20,
-            "languages": {"Python": 100},
-            "open_issues_count": 5,
-            "open_pull_requests_count": 2,
-            "contributors": [{"name": "contributor1"}], # Added contributors
-            "tech_stack": ["Python"],
-            "file_structure": [],
-            "commit_history": [],
-        }
-        mock_repository_analyzer_instance.get_repository_analysis.return_value = AsyncMock(return_value=analysis_data)
-        with patch("asyncio.run") as mock_asyncio_run:
-            mock_asyncio_run.side_effect = [
-                None, # for _broadcast_status_update
-                analysis_data,
-                None # for _broadcast_status_update
-            ]
+        mock_crud.create_analysis_result.return_value = MagicMock(spec=models.AnalysisResult, id=3)
+
+        # Act
+        clone_and_analyze_repository(mock_repository.id, db=mock_db_session)
 
-            # Act
-            clone_and_analyze_repository(mock_repository.id, db=mock_db_session)
         # Assert
         mock_crud.get_repository.assert_called_once_with(
             mock_db_session, mock_repository.id
         )
-        assert mock_repository.status == AnalysisStatus.COMPLETED
-        mock_generate_narratives_task.delay.assert_called_once()
+        assert mock_repository.status == AnalysisStatus.IN_PROGRESS
+        mock_publish_status_event.assert_called_once()
+        mock_chord.return_value.apply_async.assert_called_once()
+        # The session belongs to the caller and stays open
+        mock_db_session.close.assert_not_called()
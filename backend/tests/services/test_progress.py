@@ -0,0 +1,81 @@
+import json
+from unittest.mock import MagicMock
+
+import pytest
+import redis
+
+from src.services import progress
+from src.services.progress import ProgressReporter
+
+
+@pytest.fixture
+def mock_redis(mocker):
+    client = MagicMock()
+    mocker.patch("src.services.progress.get_redis_client", return_value=client)
+    return client
+
+
+@pytest.fixture
+def clock(mocker):
+    now = [100.0]
+    mocker.patch("src.services.progress.time.monotonic", side_effect=lambda: now[0])
+    return now
+
+
+def test_update_publishes_event_and_snapshot(mock_redis, mock_progress_redis, clock):
+    reporter = ProgressReporter(1, 3, "commit_history")
+    clock[0] += 2
+
+    reporter.update(25, total=100)
+
+    expected = {"stage": "commit_history", "done": 25, "total": 100, "elapsed_seconds": 2.0, "eta_seconds": 6.0}
+    mock_progress_redis.assert_called_once_with({"type": "progress", "id": 1, "owner_id": 3, **expected})
+    pipeline = mock_redis.pipeline.return_value
+    pipeline.hset.assert_called_once_with("analysis:progress:1", "commit_history", json.dumps(expected))
+    pipeline.execute.assert_called_once()
+
+
+def test_update_is_throttled_until_stage_finishes(mock_redis, mock_progress_redis, clock):  # noqa: ARG001
+    reporter = ProgressReporter(1, 3, "tech_stack", total=4, min_interval_seconds=1)
+
+    reporter.advance()
+    clock[0] += 0.5
+    reporter.advance()
+    reporter.advance()
+    clock[0] += 0.1
+    reporter.advance()
+
+    published = [call.args[0]["done"] for call in mock_progress_redis.call_args_list]
+    assert published == [1, 4]
+
+
+def test_finish_completes_stage_with_fewer_items(mock_redis, mock_progress_redis, clock):  # noqa: ARG001
+    reporter = ProgressReporter(1, 3, "commit_history", min_interval_seconds=60)
+    reporter.update(30, total=100)
+
+    reporter.finish()
+
+    event = mock_progress_redis.call_args.args[0]
+    assert (event["done"], event["total"], event["eta_seconds"]) == (30, 30, 0.0)
+
+
+def test_snapshot_failure_still_publishes(mock_redis, mock_progress_redis):
+    mock_redis.pipeline.return_value.execute.side_effect = redis.ConnectionError("down")
+
+    ProgressReporter(1, 3, "metadata").update(1, total=5)
+
+    mock_progress_redis.assert_called_once()
+
+
+def test_get_progress_snapshot(mock_redis):
+    snapshot = {"stage": "metadata", "done": 5, "total": 5, "elapsed_seconds": 0.4, "eta_seconds": 0.0}
+    mock_redis.hgetall.return_value = {b"metadata": json.dumps(snapshot).encode()}
+
+    assert progress.get_progress_snapshot(1) == {"metadata": snapshot}
+    mock_redis.hgetall.assert_called_once_with("analysis:progress:1")
+
+
+def test_get_progress_snapshot_without_redis(mock_redis):
+    mock_redis.hgetall.side_effect = redis.ConnectionError("down")
+
+    assert progress.get_progress_snapshot(1) == {}
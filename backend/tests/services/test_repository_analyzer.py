@@ -146,3 +146,16 @@ async def test_get_commit_history_num_commits_break(mock_github_service):
     assert len(commit_history) == num_commits
     assert mock_github_service.get_repository_commits.call_count == 1
     mock_github_service.get_repository_commits.assert_called_once_with(owner, repo, per_page=30, page=1)
+
+@pytest.mark.asyncio
+async def test_get_commit_history_reports_progress(mock_github_service):
+    analyzer = RepositoryAnalyzer(mock_github_service)
+    commit = {"sha": "sha", "commit": {"message": "msg", "author": {"name": "user1", "date": "2024-01-01T00:00:00Z"}}}
+    mock_github_service.get_repository_commits.side_effect = [[commit] * 30, [commit] * 5, []]
+    progress = MagicMock()
+
+    commits = await analyzer.get_commit_history("owner", "repo", progress=progress)
+
+    assert len(commits) == 35  # noqa: PLR2004
+    assert [call.args for call in progress.update.call_args_list] == [(30,), (35,)]
+    progress.finish.assert_called_once()
@@ -52,9 +52,17 @@ class TestRepositoryService(unittest.TestCase):
         # Call the service function
         self.repository_service.create_repository(mock_db, repo_create, 1)
         # Assert that the CRUD function was called
-        self.mock_crud.create_repository.assert_called_once_with(db=mock_db, url="https://github.com/owner/repo_name", name="owner/repo_name", owner_id=1)
-        # Assert that the analysis service was called
-        self.mock_analysis_service.clone_and_analyze_repository.delay.assert_called_once()
+        self.mock_crud.create_repository.assert_called_once_with(
+            db=mock_db, url="https://github.com/owner/repo_name", name="owner/repo_name", owner_id=1, refresh=False
+        )
+        # Dispatching is left to the caller, outside of the database work
+        self.mock_analysis_service.dispatch_analysis.assert_not_called()
+
+    def test_dispatch_analysis(self):
+        self.mock_analysis_service.dispatch_analysis.return_value = "task-id"
+
+        self.assertEqual(self.repository_service.dispatch_analysis(1), "task-id")
+        self.mock_analysis_service.dispatch_analysis.assert_called_once_with(1)
 
     def test_get_repositories_by_owner(self):
         # Mock the database session
@@ -62,7 +70,9 @@ class TestRepositoryService(unittest.TestCase):
         # Call the service function
         self.repository_service.get_repositories_by_owner(mock_db, 1)
         # Assert that the CRUD function was called
-        self.mock_crud.get_repositories_by_owner.assert_called_once_with(mock_db, owner_id=1, skip=0, limit=100)
+        self.mock_crud.get_repositories_by_owner.assert_called_once_with(
+            mock_db, owner_id=1, cursor=None, limit=100, technologies=None, language=None, min_language_share=0
+        )
 
     def test_get_repository(self):
         # Mock the database session
@@ -70,7 +80,7 @@ class TestRepositoryService(unittest.TestCase):
         # Call the service function
         self.repository_service.get_repository(mock_db, 1)
         # Assert that the CRUD function was called
-        self.mock_crud.get_repository.assert_called_once_with(mock_db, 1)
+        self.mock_crud.get_repository.assert_called_once_with(mock_db, 1, with_analyses=True)
 
     def test_get_analysis_results_for_repository(self):
         # Mock the database session
@@ -78,23 +88,21 @@ class TestRepositoryService(unittest.TestCase):
         # Call the service function
         self.repository_service.get_analysis_results_for_repository(mock_db, 1)
         # Assert that the CRUD function was called
-        self.mock_crud.get_analysis_results_for_repository.assert_called_once_with(mock_db, 1)
+        self.mock_crud.get_analysis_results_for_repository.assert_called_once_with(mock_db, 1, cursor=None, limit=100)
 
     def test_get_analysis_narrative(self):
         # Mock the database session
         mock_db = MagicMock(spec=Session)
-        # Mock the return value of the CRUD function
-        mock_analysis_result = MagicMock()
-        mock_analysis_result.narrative = "test_narrative"
-        self.mock_crud.get_analysis_result.return_value = mock_analysis_result
+        self.mock_crud.get_analysis_narrative.return_value = "test_narrative"
         # Call the service function
         narrative = self.repository_service.get_analysis_narrative(mock_db, 1)
         # Assert that the CRUD function was called
-        self.mock_crud.get_analysis_result.assert_called_once_with(mock_db, 1)
+        self.mock_crud.get_analysis_narrative.assert_called_once_with(mock_db, 1)
         # Assert that the correct narrative is returned
         self.assertEqual(narrative, "test_narrative")
 
-        # Test case where analysis result is not found
-        self.mock_crud.get_analysis_result.return_value = None
-        narrative = self.repository_service.get_analysis_narrative(mock_db, 1)
-        self.assertIsNone(narrative)
+    def test_get_analysis_owner_id(self):
+        mock_db = MagicMock(spec=Session)
+        self.mock_crud.get_analysis_owner_id.return_value = 3
+        self.assertEqual(self.repository_service.get_analysis_owner_id(mock_db, 1), 3)
+        self.mock_crud.get_analysis_owner_id.assert_called_once_with(mock_db, 1)
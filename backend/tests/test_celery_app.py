@@ -75,3 +75,24 @@ def test_celery_app_config():
 def test_celery_app_includes_tasks():
     celery_app = celery_app_module.get_celery_app()
     assert 'src.services.analysis_service' in celery_app.conf.include
+
+
+def test_celery_app_task_routes():
+    celery_app = celery_app_module.get_celery_app()
+    router = celery_app.amqp.router
+
+    def queue_for(task_name):
+        return router.route({}, task_name)["queue"].name
+
+    assert queue_for('src.services.analysis_service.generate_narratives_task') == celery_app_module.LLM_QUEUE
+    assert queue_for('src.services.analysis_service.fetch_commit_history') == celery_app_module.FETCH_QUEUE
+    assert queue_for('src.services.analysis_service.clone_and_analyze_repository') == celery_app_module.FETCH_QUEUE
+    assert celery_app.conf.broker_transport_options['queue_order_strategy'] == 'priority'
+
+
+def test_celery_worker_settings_from_env(monkeypatch):
+    monkeypatch.setenv("CELERY_WORKER_CONCURRENCY", "2")
+    monkeypatch.setenv("CELERY_WORKER_PREFETCH_MULTIPLIER", "1")
+    celery_app = celery_app_module.get_celery_app()
+    assert celery_app.conf.worker_concurrency == 2  # noqa: PLR2004
+    assert celery_app.conf.worker_prefetch_multiplier == 1
@@ -1,14 +1,23 @@
-from unittest.mock import AsyncMock, MagicMock, patch
+from unittest.mock import ANY, AsyncMock, MagicMock, patch
 
 import pytest
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import Session
 
 from src.celery_app import celery_app
-from src.core.enums import AnalysisStatus
+from src.core.enums import AnalysisStatus, TaskPriority
 from src.db import models
 from src.services.analysis_service import (
+    BLOB_SWEEP_BATCH_SIZE,
+    analysis_idempotency_key,
     clone_and_analyze_repository,
+    delete_orphaned_blobs,
+    dispatch_analysis,
     generate_narratives_task,
+    handle_analysis_failure,
+    persist_analysis,
+    reconcile_user_stats,
+    release_analysis_lock,
 )
 
 
@@ -80,11 +89,9 @@ def mock_narrative_generator():
 
 
 @pytest.fixture
-def mock_broadcast_status_update():
-    """Mock _broadcast_status_update."""
-    with patch(
-        "src.services.analysis_service._broadcast_status_update", new_callable=AsyncMock
-    ) as mock:
+def mock_publish_status_event():
+    """Mock publish_status_event."""
+    with patch("src.services.analysis_service.publish_status_event") as mock:
         yield mock
 
 
@@ -117,54 +124,68 @@ class TestCeleryTasks:
         self,
         mock_db_session,
         mock_crud,
-        mock_repository_analyzer,
-        mock_broadcast_status_update,
+        mock_publish_status_event,
         sample_repository,
     ):
         mock_crud.get_repository.return_value = sample_repository
-        analysis_result = models.AnalysisResult(repository_id=sample_repository.id)
+        analysis_result = models.AnalysisResult(id=5, repository_id=sample_repository.id)
         mock_crud.create_analysis_result.return_value = analysis_result
 
-        with patch("src.services.analysis_service.generate_narratives_task.delay") as mock_delay:
+        with patch("src.services.analysis_service.chord") as mock_chord:
             clone_and_analyze_repository(sample_repository.id, db=mock_db_session)
 
         mock_crud.get_repository.assert_called_with(mock_db_session, sample_repository.id)
-        mock_repository_analyzer.get_repository_analysis.assert_called_once_with(sample_repository.url)
-        mock_broadcast_status_update.assert_any_call(sample_repository.id, AnalysisStatus.IN_PROGRESS)
-        mock_broadcast_status_update.assert_any_call(sample_repository.id, AnalysisStatus.COMPLETED)
-        assert sample_repository.status == AnalysisStatus.COMPLETED
-        mock_crud.create_analysis_result.assert_called_once()
-        mock_delay.assert_called_once()
+        # The AnalysisResult row exists before any pipeline step runs
+        created = mock_crud.create_analysis_result.call_args.kwargs["analysis"]
+        assert created.repository_id == sample_repository.id
+        assert created.status == AnalysisStatus.IN_PROGRESS
+        assert sample_repository.status == AnalysisStatus.IN_PROGRESS
+        mock_publish_status_event.assert_called_once_with(
+            {"id": sample_repository.id, "owner_id": sample_repository.owner_id, "status": AnalysisStatus.IN_PROGRESS.value}
+        )
 
-    def test_clone_and_analyze_repository_failure(
+        header, body = mock_chord.call_args.args
+        assert [sig.task for sig in header] == [
+            "src.services.analysis_service.fetch_repository_metadata",
+            "src.services.analysis_service.fetch_commit_history",
+            "src.services.analysis_service.fetch_file_structure",
+            "src.services.analysis_service.fetch_tech_stack",
+        ]
+        assert all(sig.args == (sample_repository.url,) for sig in header)
+        assert all(
+            sig.kwargs == {"repo_id": sample_repository.id, "owner_id": sample_repository.owner_id} for sig in header
+        )
+        assert all(sig.options["priority"] == TaskPriority.INTERACTIVE for sig in header)
+        assert body.task == "src.services.analysis_service.persist_analysis"
+        assert body.args == (sample_repository.id, analysis_result.id)
+        assert body.options["link"][0].task == "src.services.analysis_service.generate_narratives_task"
+        assert body.options["link"][0].args == (sample_repository.id, analysis_result.id)
+        assert body.options["link_error"][0].task == "src.services.analysis_service.handle_analysis_failure"
+        mock_chord.return_value.apply_async.assert_called_once()
+
+    def test_handle_analysis_failure(
         self,
         mock_db_session,
         mock_crud,
-        mock_repository_analyzer,
-        mock_broadcast_status_update,
+        mock_publish_status_event,
         sample_repository,
     ):
         # Arrange
         mock_crud.get_repository.return_value = sample_repository
-
-        # Configure the mock analyzer to raise an exception when get_repository_analysis is called
-        mock_repository_analyzer.get_repository_analysis.side_effect = Exception("GitHub API error")
-
-        # Mock the query to return no existing analysis result
-        mock_db_session.query.return_value.filter.return_value.first.return_value = None
+        mock_crud.get_analysis_result.return_value = None
 
         # Act
-        # The exception is caught inside, so we don't need a with pytest.raises
-        clone_and_analyze_repository(sample_repository.id, db=mock_db_session)
+        handle_analysis_failure(
+            None, Exception("GitHub API error"), None,
+            repo_id=sample_repository.id, analysis_id=1, db=mock_db_session,
+        )
 
         # Assert
         # Verify repository status is updated to FAILED
-        mock_crud.get_repository.assert_called_with(mock_db_session, sample_repository.id)
         assert sample_repository.status == AnalysisStatus.FAILED
-
-        # Verify status updates were broadcast
-        mock_broadcast_status_update.assert_any_call(sample_repository.id, AnalysisStatus.IN_PROGRESS)
-        mock_broadcast_status_update.assert_any_call(sample_repository.id, AnalysisStatus.FAILED)
+        mock_publish_status_event.assert_called_once_with(
+            {"id": sample_repository.id, "owner_id": sample_repository.owner_id, "status": AnalysisStatus.FAILED.value}
+        )
 
         # Verify that an error summary was set on the analysis result
         added_object = None
@@ -176,26 +197,70 @@ class TestCeleryTasks:
 
         assert added_object is not None, "AnalysisResult was not created and added to the session"
         assert "An unexpected error occurred during analysis: GitHub API error" in added_object.summary
+        mock_db_session.commit.assert_called_once()
 
-        # Verify the analyzer was called
-        mock_repository_analyzer.get_repository_analysis.assert_called_once_with(sample_repository.url)
+    def test_persist_analysis(
+        self,
+        mock_db_session,
+        mock_crud,
+        mock_publish_status_event,
+        sample_repository,
+        sample_analysis_result,
+    ):
+        mock_crud.get_repository.return_value = sample_repository
+        mock_crud.get_analysis_result.return_value = sample_analysis_result
+        metadata = {"name": "repo", "languages": {"Python": 1000}, "contributors": ["testuser"]}
+        commit_history = [{"sha": "a"}, {"sha": "b"}]
+        file_structure = [{"path": "main.py", "type": "blob", "size": 10}]
+
+        result = persist_analysis(
+            [metadata, commit_history, file_structure, ["FastAPI"]],
+            sample_repository.id, sample_analysis_result.id, db=mock_db_session,
+        )
+
+        assert result == sample_analysis_result.id
+        assert sample_analysis_result.commit_count == 2  # noqa: PLR2004
+        assert sample_analysis_result.file_count == 1
+        assert sample_analysis_result.tech_stack == ["FastAPI"]
+        assert sample_analysis_result.status == AnalysisStatus.COMPLETED
+        assert sample_repository.status == AnalysisStatus.COMPLETED
+        stored_payload = mock_crud.save_analysis_payload.call_args.args[2]
+        assert stored_payload["commit_history"] == commit_history
+        assert stored_payload["file_structure"] == file_structure
+        mock_db_session.commit.assert_called_once()
+        mock_publish_status_event.assert_called_once_with(
+            {"id": sample_repository.id, "owner_id": sample_repository.owner_id, "status": AnalysisStatus.COMPLETED.value}
+        )
 
     def test_clone_and_analyze_repository_not_found(
-        self, mock_db_session, mock_crud, mock_broadcast_status_update
+        self, mock_db_session, mock_crud, mock_publish_status_event
     ):
         mock_crud.get_repository.return_value = None
         clone_and_analyze_repository(999, db=mock_db_session)
         mock_crud.get_repository.assert_called_once_with(mock_db_session, 999)
-        mock_broadcast_status_update.assert_not_called()
+        mock_publish_status_event.assert_not_called()
+
+    def test_reconcile_user_stats(self, mock_db_session):
+        with patch("src.services.analysis_service.stats.reconcile_user_stats", return_value=[3]) as mock_reconcile:
+            assert reconcile_user_stats(db=mock_db_session) == [3]
+        mock_reconcile.assert_called_once_with(mock_db_session, user_id=None)
+
+    def test_delete_orphaned_blobs(self, mock_db_session, mock_crud):
+        mock_crud.delete_orphaned_blobs.return_value = 4
+
+        assert delete_orphaned_blobs(db=mock_db_session) == 4  # noqa: PLR2004
+        mock_crud.delete_orphaned_blobs.assert_called_once_with(mock_db_session, ANY, batch_size=BLOB_SWEEP_BATCH_SIZE)
 
     def test_generate_narratives_task_success(
         self,
         mock_db_session,
+        mock_crud,
         mock_narrative_generator,
         sample_analysis_result,
     ):
-        mock_db_session.query.return_value.filter.return_value.first.return_value = sample_analysis_result
         repo_analysis_data = {"file_structure": [], "commit_history": []}
+        mock_crud.get_analysis_result.return_value = sample_analysis_result
+        mock_crud.get_analysis_payload.return_value = repo_analysis_data
 
         # Configurar mock_db_session.refresh para que copie los cambios a sample_analysis_result
         def mock_refresh_side_effect(instance):
@@ -204,33 +269,36 @@ class TestCeleryTasks:
                 sample_analysis_result.narrative = instance.narrative
         mock_db_session.refresh.side_effect = mock_refresh_side_effect
 
-        with patch("src.services.analysis_service.asyncio.run") as mock_asyncio_run:
-            mock_asyncio_run.return_value = mock_narrative_generator.generate_recruiter_summary.return_value
-            generate_narratives_task(1, repo_analysis_data, db=mock_db_session)
+        with patch("src.services.analysis_service.run_async") as mock_run_async:
+            mock_run_async.return_value = mock_narrative_generator.generate_recruiter_summary.return_value
+            generate_narratives_task(1, sample_analysis_result.id, db=mock_db_session)
 
+        mock_crud.get_analysis_payload.assert_called_once_with(mock_db_session, sample_analysis_result.id)
         mock_narrative_generator.generate_narrative.assert_called_once_with(repo_analysis_data)
         mock_narrative_generator.generate_recruiter_summary.assert_called_once_with(repo_analysis_data)
         assert sample_analysis_result.summary == "Recruiter summary"
         assert sample_analysis_result.narrative == "Comprehensive narrative"
         mock_db_session.add.assert_called_once_with(sample_analysis_result)
         mock_db_session.commit.assert_called_once()
-        mock_db_session.refresh.assert_called_once_with(sample_analysis_result)
+        mock_db_session.refresh.assert_not_called()
+        mock_crud.delete_analysis_payload.assert_called_once_with(mock_db_session, sample_analysis_result.id)
 
     def test_generate_narratives_task_failure(
         self,
         mock_db_session,
+        mock_crud,
         mock_narrative_generator,
         sample_analysis_result,
     ):
-        mock_db_session.query.return_value.filter.return_value.first.return_value = sample_analysis_result
+        mock_crud.get_analysis_result.return_value = sample_analysis_result
+        mock_crud.get_analysis_payload.return_value = {"file_structure": [], "commit_history": []}
         mock_narrative_generator.generate_narrative.side_effect = Exception("LLM error")
-        repo_analysis_data = {"file_structure": [], "commit_history": []}
 
         with patch("src.services.analysis_service.logging.error") as mock_logging_error, \
-             patch("src.services.analysis_service.asyncio.run") as mock_asyncio_run:
+             patch("src.services.analysis_service.run_async") as mock_run_async:
                 # Mock the behavior of asyncio.run if it's called
-                mock_asyncio_run.return_value = None
-                generate_narratives_task(1, repo_analysis_data, db=mock_db_session)
+                mock_run_async.return_value = None
+                generate_narratives_task(1, sample_analysis_result.id, db=mock_db_session)
                 mock_logging_error.assert_called_once()
 
     def test_generate_narratives_task_analysis_result_not_found(
@@ -239,12 +307,130 @@ class TestCeleryTasks:
         mock_narrative_generator,
     ):
         mock_db_session.query.return_value.filter.return_value.first.return_value = None
-        repo_analysis_data = {"file_structure": [], "commit_history": []}
 
         with patch("src.services.analysis_service.logging.warning") as mock_logging_warning, \
-             patch("src.services.analysis_service.asyncio.run") as mock_asyncio_run:
+             patch("src.services.analysis_service.run_async") as mock_run_async:
                 # Mock the behavior of asyncio.run if it's called
-                mock_asyncio_run.return_value = None
-                generate_narratives_task(999, repo_analysis_data, db=mock_db_session)
+                mock_run_async.return_value = None
+                generate_narratives_task(999, 999, db=mock_db_session)
                 mock_logging_warning.assert_called_once()
         mock_narrative_generator.generate_narrative.assert_not_called()
+
+
+class FakeRedis:
+    """Minimal in-memory stand-in for the Redis commands used by the dispatcher."""
+
+    def __init__(self):
+        self.store = {}
+
+    def set(self, key, value, nx=False, ex=None):  # noqa: ARG002
+        if nx and key in self.store:
+            return None
+        self.store[key] = value.encode() if isinstance(value, str) else value
+        return True
+
+    def get(self, key):
+        return self.store.get(key)
+
+    def eval(self, _script, _numkeys, key, token):
+        if self.store.get(key) == token.encode():
+            del self.store[key]
+            return 1
+        return 0
+
+
+@pytest.fixture
+def fake_redis():
+    client = FakeRedis()
+    with patch("src.services.analysis_service.get_redis_client", return_value=client):
+        yield client
+
+
+class TestAnalysisDispatch:
+    def test_dispatch_analysis_deduplicates_within_window(self, fake_redis, mock_celery_send_task):  # noqa: ARG002
+        first_task_id = dispatch_analysis(1)
+        second_task_id = dispatch_analysis(1)
+
+        assert second_task_id == first_task_id
+        mock_celery_send_task.assert_called_once_with(
+            (1,), {"priority": TaskPriority.INTERACTIVE}, task_id=first_task_id, priority=TaskPriority.INTERACTIVE
+        )
+
+    def test_dispatch_analysis_attaches_to_in_flight_run(self, fake_redis, mock_celery_send_task):
+        first_task_id = dispatch_analysis(1)
+        # A new time bucket, while the first run still holds the lock
+        with patch("src.services.analysis_service.time.time", return_value=10**10):
+            second_task_id = dispatch_analysis(1)
+
+        assert second_task_id == first_task_id
+        mock_celery_send_task.assert_called_once()
+        assert fake_redis.get(analysis_idempotency_key(1, now=10**10)) == first_task_id.encode()
+
+    def test_dispatch_analysis_after_lock_release(self, fake_redis, mock_celery_send_task):  # noqa: ARG002
+        first_task_id = dispatch_analysis(1)
+        release_analysis_lock(1, "another-run")  # Not the holder, so the lock stays
+        release_analysis_lock(1, first_task_id)
+
+        with patch("src.services.analysis_service.time.time", return_value=10**10):
+            second_task_id = dispatch_analysis(1)
+
+        assert second_task_id != first_task_id
+        assert mock_celery_send_task.call_count == 2  # noqa: PLR2004
+
+    def test_dispatch_analysis_per_repository(self, fake_redis, mock_celery_send_task):  # noqa: ARG002
+        assert dispatch_analysis(1) != dispatch_analysis(2)
+        assert mock_celery_send_task.call_count == 2  # noqa: PLR2004
+
+    def test_dispatch_analysis_background_priority(self, fake_redis, mock_celery_send_task):  # noqa: ARG002
+        dispatch_analysis(1, priority=TaskPriority.BACKGROUND)
+
+        _, kwargs = mock_celery_send_task.call_args
+        assert kwargs["priority"] == TaskPriority.BACKGROUND
+        assert mock_celery_send_task.call_args.args[1] == {"priority": TaskPriority.BACKGROUND}
+
+    def test_dispatch_analysis_releases_claims_when_publish_fails(self, fake_redis, mock_celery_send_task):
+        mock_celery_send_task.side_effect = ConnectionError("broker down")
+        with pytest.raises(ConnectionError):
+            dispatch_analysis(1)
+        assert fake_redis.store == {}
+
+        mock_celery_send_task.side_effect = None
+        dispatch_analysis(1)
+        assert mock_celery_send_task.call_count == 2  # noqa: PLR2004
+
+
+class TestAnalysisLockRelease:
+    def test_clone_failure_marks_run_failed_and_releases_lock(self, fake_redis, mock_db_session, mock_crud, sample_repository):
+        fake_redis.set("analysis:lock:1", "run-1")
+        mock_crud.get_repository.return_value = sample_repository
+        mock_crud.get_analysis_result.return_value = None
+        mock_crud.create_analysis_result.side_effect = SQLAlchemyError("commit failed")
+
+        result = clone_and_analyze_repository.apply(args=(1,), kwargs={"db": mock_db_session}, task_id="run-1")
+
+        assert isinstance(result.result, SQLAlchemyError)
+        mock_db_session.rollback.assert_called()
+        assert sample_repository.status == AnalysisStatus.FAILED
+        failed = mock_db_session.add.call_args.args[0]
+        assert failed.status == AnalysisStatus.FAILED
+        assert "analysis:lock:1" not in fake_redis.store
+
+    def test_narrative_task_releases_lock_after_last_retry(self, fake_redis, mock_db_session, mock_crud, mock_narrative_generator):  # noqa: ARG002
+        fake_redis.set("analysis:lock:1", "run-1")
+        mock_crud.get_analysis_result.side_effect = SQLAlchemyError("database down")
+
+        generate_narratives_task.push_request(retries=0)
+        try:
+            with pytest.raises(SQLAlchemyError):
+                generate_narratives_task.run(1, 7, lock_token="run-1", db=mock_db_session)
+        finally:
+            generate_narratives_task.pop_request()
+        assert "analysis:lock:1" in fake_redis.store
+
+        generate_narratives_task.push_request(retries=generate_narratives_task.max_retries)
+        try:
+            with pytest.raises(SQLAlchemyError):
+                generate_narratives_task.run(1, 7, lock_token="run-1", db=mock_db_session)
+        finally:
+            generate_narratives_task.pop_request()
+        assert "analysis:lock:1" not in fake_redis.store
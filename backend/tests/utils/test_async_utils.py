@@ -2,7 +2,13 @@ import asyncio
 import pytest
 from unittest.mock import MagicMock, patch
 
-from src.utils.async_utils import run_async
+from src.utils.async_utils import (
+    get_worker_loop,
+    get_worker_resource,
+    run_async,
+    start_worker_loop,
+    stop_worker_loop,
+)
 
 @pytest.mark.asyncio
 async def test_run_async_no_running_loop():
@@ -68,4 +74,38 @@ async def test_run_async_loop_not_running():
         mock_existing_loop.is_running.assert_called_once()
         mock_asyncio_run.assert_called_once_with(mock_coro)
         mock_existing_loop.create_task.assert_not_called()
-        assert result == "coro_result"
\ No newline at end of file
+        assert result == "coro_result"
+
+
+def test_run_async_uses_persistent_worker_loop():
+    """
+    Test run_async submits coroutines to the worker loop, which is reused across calls.
+    """
+    async def current_loop():
+        return asyncio.get_running_loop()
+
+    loop = start_worker_loop()
+    try:
+        assert start_worker_loop() is loop
+        assert run_async(current_loop()) is loop
+        assert run_async(current_loop()) is loop
+    finally:
+        stop_worker_loop()
+    assert get_worker_loop() is None
+    assert loop.is_closed()
+
+def test_get_worker_resource_lifecycle():
+    """
+    Test worker resources are created once, shared, and closed on shutdown.
+    """
+    assert get_worker_resource("client", object) is None
+
+    closer = MagicMock()
+    start_worker_loop()
+    try:
+        first = get_worker_resource("client", object, closer=closer)
+        second = get_worker_resource("client", object, closer=closer)
+        assert first is second
+    finally:
+        stop_worker_loop()
+    closer.assert_called_once_with(first)
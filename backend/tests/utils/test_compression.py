@@ -0,0 +1,13 @@
+from src.utils.compression import pack_blob, unpack_blob
+
+
+def test_pack_blob_round_trip():
+    digest, data = pack_blob({"Python": 100, "Go": 5})
+
+    assert len(digest) == 64  # noqa: PLR2004
+    assert unpack_blob(data) == {"Python": 100, "Go": 5}
+
+
+def test_pack_blob_hashes_equal_values_equally():
+    assert pack_blob({"a": 1, "b": 2})[0] == pack_blob({"b": 2, "a": 1})[0]
+    assert pack_blob("narrative")[0] != pack_blob("other narrative")[0]
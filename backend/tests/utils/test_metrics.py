@@ -0,0 +1,12 @@
+from src.utils import metrics
+
+
+def test_increment_and_get_metrics():
+    metrics.reset_metrics()
+    metrics.increment("requests")
+    metrics.increment("requests", 2)
+
+    assert metrics.get_metrics() == {"requests": 3}
+
+    metrics.reset_metrics()
+    assert metrics.get_metrics() == {}
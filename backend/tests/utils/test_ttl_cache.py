@@ -0,0 +1,45 @@
+import time
+
+from src.utils.ttl_cache import TTLCache
+
+
+def test_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("c") == 3  # noqa: PLR2004
+    assert len(cache) == 2  # noqa: PLR2004
+
+
+def test_entries_expire_after_ttl_or_at_given_time(mocker):
+    now = time.time()
+    mocker.patch("src.utils.ttl_cache.time.time", return_value=now)
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set("ttl", 1)
+    cache.set("early", 2, expires_at=now + 10)
+    cache.set("late", 3, expires_at=now + 600)
+
+    mocker.patch("src.utils.ttl_cache.time.time", return_value=now + 30)
+    assert cache.get("ttl") == 1
+    assert cache.get("early") is None
+    assert cache.get("late") == 3  # noqa: PLR2004
+
+    mocker.patch("src.utils.ttl_cache.time.time", return_value=now + 61)
+    assert cache.get("ttl") is None
+    assert cache.get("late", "missing") == "missing"
+
+
+def test_pop_and_clear():
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.pop("a")
+    cache.pop("missing")
+    assert cache.get("a") is None
+    cache.clear()
+    assert len(cache) == 0
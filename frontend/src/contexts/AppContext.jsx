@@ -65,10 +65,18 @@ export const AppProvider = ({ children }) => {
     const ws = new WebSocket(`${WS_URL}/api/v1/ws/status`);
 
     ws.onmessage = (event) => {
-      const data = JSON.parse(event.data);
+      // Each frame carries the latest status of every repository updated since the last one
+      const updates = JSON.parse(event.data);
+      if (updates.some((update) => update.type === 'ping')) {
+        // Answer the server heartbeat so the connection is not evicted as idle
+        ws.send('pong');
+      }
+      const statuses = new Map(
+        updates.filter((update) => update.status !== undefined).map((update) => [update.id, update.status])
+      );
       setRepositories((prevRepos) =>
         prevRepos.map((repo) =>
-          repo.id === data.id ? { ...repo, status: data.status } : repo
+          statuses.has(repo.id) ? { ...repo, status: statuses.get(repo.id) } : repo
         )
       );
     };